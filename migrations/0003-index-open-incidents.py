@@ -0,0 +1,48 @@
+import sys
+import traceback
+
+from mist.api.users.models import Owner
+from mist.api.logs.methods import get_stories
+from mist.api.logs.models import OpenIncident
+
+
+def index_open_incidents():
+    """Populate the index of open incidents from Elasticsearch."""
+    failed = 0
+    indexed = 0
+
+    for owner in Owner.objects():
+        try:
+            incidents = get_stories(owner_id=owner.id, story_type='incident',
+                                    pending=True)
+        except Exception:
+            failed += 1
+            print "Failed to fetch open incidents of %s" % owner
+            traceback.print_exc()
+            continue
+        for incident in incidents:
+            try:
+                OpenIncident.objects(
+                    incident_id=incident['story_id']
+                ).update_one(
+                    upsert=True,
+                    set__owner_id=owner.id,
+                    set__rule_id=incident.get('rule_id'),
+                    set__cloud_id=incident.get('cloud_id'),
+                    set__machine_id=incident.get('machine_id'),
+                )
+            except Exception:
+                failed += 1
+                traceback.print_exc()
+            else:
+                indexed += 1
+
+    print
+    print "Indexed:", indexed
+    print "Failed:", failed
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    index_open_incidents()
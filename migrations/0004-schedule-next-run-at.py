@@ -0,0 +1,16 @@
+import datetime
+
+from mist.api.poller.models import PollingSchedule
+
+
+def set_next_run_at():
+    """Schedule polling schedules saved without a next_run_at to run now."""
+    result = PollingSchedule._get_collection().update_many(
+        {'next_run_at': {'$exists': False}},
+        {'$set': {'next_run_at': datetime.datetime.utcnow()}},
+    )
+    print "Updated %d polling schedules" % result.modified_count
+
+
+if __name__ == '__main__':
+    set_next_run_at()
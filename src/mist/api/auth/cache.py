@@ -0,0 +1,181 @@
+"""In-process cache of authentication tokens
+
+Resolving the token of a request requires looking up the token, its users and
+its organization in mongo. The `TokenCache` defined here keeps the raw
+documents of recently used, valid tokens in memory, for a short TTL, so that
+authenticating the requests of a token used repeatedly requires no queries.
+
+Entries are invalidated across all processes by broadcasting a message over
+AMQP whenever a token, user or organization is modified, see
+`invalidate_auth_cache`. Each process consumes these messages in a background
+thread. The TTL bounds how stale an entry may get if a message is missed, or
+if a document is modified without being saved through mongoengine.
+
+"""
+
+import os
+import copy
+import time
+import logging
+import threading
+
+from collections import OrderedDict
+
+from mist.api import config
+
+from mist.api.users.models import User, Organization
+
+from mist.api.auth.models import AuthToken
+
+
+log = logging.getLogger(__name__)
+
+
+AMQP_EXCHANGE = 'auth_cache_invalidations'
+
+
+class TokenCache(object):
+    """Size bounded LRU cache of tokens, along with their users and org"""
+
+    def __init__(self, ttl=None, size=None):
+        self.ttl = ttl
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._pid = None
+
+    def _check_pid(self):
+        """Clear entries and start listening for invalidations after fork"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._entries.clear()
+        thread = threading.Thread(target=self._listen, name='TokenCache')
+        thread.daemon = True
+        thread.start()
+
+    def get(self, token):
+        """Return a new token instance, if a valid one is cached, else None"""
+        if not config.AUTH_CACHE_ENABLED:
+            return None
+        self._check_pid()
+        with self._lock:
+            entry = self._entries.pop(token, None)
+            if entry is None:
+                return None
+            if entry['expires'] < time.time():
+                return None
+            self._entries[token] = entry  # Move to the end, as most recent.
+        # Copy documents, since instances may share nested values with them.
+        entry = copy.deepcopy(entry)
+        auth_token = AuthToken._from_son(entry['token'])
+        if entry['org'] is not None:
+            auth_token._data['org'] = Organization._from_son(entry['org'])
+        auth_token._prefetched_users = {
+            user_id: User._from_son(son)
+            for user_id, son in entry['users'].iteritems()
+        }
+        if not auth_token.is_valid():
+            self.invalidate(tokens=[token])
+            return None
+        return auth_token
+
+    def add(self, auth_token):
+        """Cache a valid token, along with its users and org"""
+        if not config.AUTH_CACHE_ENABLED:
+            return
+        if auth_token.pk is None or not auth_token.is_valid():
+            return
+        self._check_pid()
+        users = {}
+        for effective in (False, True):
+            user = auth_token.get_user(effective=effective)
+            if user is not None:
+                users[user.id] = user.to_mongo()
+        org = auth_token.org
+        entry = {
+            'token': auth_token.to_mongo(),
+            'org': org.to_mongo() if org is not None else None,
+            'users': users,
+            'owner_ids': set(users.keys() + ([org.id] if org else [])),
+            'expires': time.time() + (self.ttl or config.AUTH_CACHE_TTL),
+        }
+        with self._lock:
+            self._entries.pop(auth_token.token, None)
+            self._entries[auth_token.token] = entry
+            while len(self._entries) > (self.size or config.AUTH_CACHE_SIZE):
+                self._entries.popitem(last=False)
+
+    def touch(self, token, last_accessed_at):
+        """Update the stored `last_accessed_at` of a cached token
+
+        Otherwise, once the cached value is older than the touch granularity,
+        every request served from the entry would rewrite it in mongo.
+
+        """
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                entry['token']['last_accessed_at'] = last_accessed_at
+
+    def invalidate(self, tokens=(), owner_ids=()):
+        """Drop entries of the given tokens, or of the given users/orgs"""
+        owner_ids = set(owner_ids)
+        with self._lock:
+            for token in tokens:
+                self._entries.pop(token, None)
+            if owner_ids:
+                for token, entry in self._entries.items():
+                    if entry['owner_ids'] & owner_ids:
+                        del self._entries[token]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _listen(self):
+        """Consume invalidation messages broadcast by all processes"""
+        # FIXME: Resolve circular import issues
+        from mist.api.helpers import amqp_subscribe
+
+        def callback(msg):
+            self.invalidate(tokens=msg.body.get('tokens', ()),
+                            owner_ids=msg.body.get('owner_ids', ()))
+
+        while True:
+            try:
+                amqp_subscribe(AMQP_EXCHANGE, callback)
+            except Exception as exc:
+                log.error("Error subscribing to token cache invalidations: "
+                          "%r", exc)
+            # The subscription ended, so messages may have been missed.
+            log.warning("Token cache invalidation subscription ended")
+            self.clear()
+            time.sleep(5)
+
+
+# Cache shared by all requests of the same process.
+token_cache = TokenCache()
+
+
+def invalidate_auth_cache(tokens=(), owner_ids=()):
+    """Invalidate cached tokens in all processes
+
+    Tokens may be invalidated either directly or by the id of any of their
+    users or org.
+
+    """
+    # FIXME: Resolve circular import issues
+    from mist.api.helpers import amqp_publish
+
+    tokens, owner_ids = list(tokens), list(owner_ids)
+    token_cache.invalidate(tokens=tokens, owner_ids=owner_ids)
+    try:
+        amqp_publish(AMQP_EXCHANGE, '',
+                     {'tokens': tokens, 'owner_ids': owner_ids},
+                     ex_declare=True)
+    except Exception as exc:
+        log.error("Error broadcasting token cache invalidation: %r", exc)
@@ -29,6 +29,8 @@ else:
 from mist.api.auth.models import ApiToken
 from mist.api.auth.models import SessionToken
 
+from mist.api.auth.cache import token_cache
+
 
 def migrate_old_api_token(request):
     """Migrate old API tokens (aka mist_1: email:token) to new ApiTokens"""
@@ -94,32 +96,45 @@ def session_from_request(request):
     if session is None:
         token_from_request = request.headers.get('Authorization', '').lower()
         if token_from_request:
-            try:
-                api_token = ApiToken.objects.get(
-                    token=token_from_request
-                )
-            except DoesNotExist:
+            api_token = token_cache.get(token_from_request)
+            if api_token is not None and not (
+                    isinstance(api_token, ApiToken) or
+                    SUPER_EXISTS and isinstance(api_token, SuperToken)):
                 api_token = None
-            try:
-                if not api_token and SUPER_EXISTS:
-                    api_token = SuperToken.objects.get(
-                                token=token_from_request)
-            except DoesNotExist:
-                pass
+            if api_token is None:
+                try:
+                    api_token = ApiToken.objects.get(
+                        token=token_from_request
+                    )
+                except DoesNotExist:
+                    api_token = None
+                try:
+                    if not api_token and SUPER_EXISTS:
+                        api_token = SuperToken.objects.get(
+                                    token=token_from_request)
+                except DoesNotExist:
+                    pass
+                if api_token is not None:
+                    token_cache.add(api_token)
             if api_token and api_token.is_valid():
                 session = api_token
             else:
                 session = ApiToken()
                 session.name = 'dummy_token'
-    if session is None:
-        try:
-            session_token = SessionToken.objects.get(
-                token=request.cookies.get('session.id')
-            )
-            if session_token.is_valid():
-                session = session_token
-        except DoesNotExist:
-            pass
+    if session is None and request.cookies.get('session.id'):
+        session_token = token_cache.get(request.cookies['session.id'])
+        if not isinstance(session_token, SessionToken):
+            session_token = None
+            try:
+                session_token = SessionToken.objects.get(
+                    token=request.cookies.get('session.id')
+                )
+            except DoesNotExist:
+                pass
+            else:
+                token_cache.add(session_token)
+        if session_token is not None and session_token.is_valid():
+            session = session_token
     if session is None:
         session = SessionToken(
             user_agent=request.user_agent,
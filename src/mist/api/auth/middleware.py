@@ -1,8 +1,8 @@
 import logging
-import netaddr
 
 from mist.api.logs.methods import log_event
 from mist.api.helpers import ip_from_request
+from mist.api.helpers import get_ip_whitelist
 from mist.api.helpers import params_from_request
 
 from mist.api.auth.models import ApiToken
@@ -52,8 +52,12 @@ class AuthMiddleware(object):
             # they are to be thrown away, not saved.
             if not (isinstance(session, ApiToken) and
                     'dummy' in session.name):
-                session.touch()
-                session.save()
+                if session.pk is None or session._get_changed_fields():
+                    session.touch()
+                    session.save()
+                else:
+                    # Avoid saving the entire session on every request.
+                    session.touch_lazily()
             # CORS
             if environ.get('HTTP_ORIGIN') and environ.get('PATH_INFO') in \
                 CORS_ENABLED_PATHS:
@@ -77,15 +81,11 @@ class AuthMiddleware(object):
         user = session.get_user()
         # Check whether the request IP is in the user whitelisted ones.
         if session and user is not None and request.path != '/logout':
-            current_user_ip = netaddr.IPAddress(ip_from_request(request))
-            saved_wips = [netaddr.IPNetwork(ip.cidr) for ip in user.ips]
-            config_wips = [netaddr.IPNetwork(cidr) for cidr in config.WHITELIST_CIDR]
-            wips = saved_wips + config_wips
-            if len(saved_wips) > 0:
-                for ipnet in wips:
-                    if current_user_ip in ipnet:
-                        break
-                else:
+            if user.ips:
+                whitelist = get_ip_whitelist(
+                    [ip.cidr for ip in user.ips] + list(config.WHITELIST_CIDR)
+                )
+                if ip_from_request(request) not in whitelist:
                     log_event(
                         owner_id=session.org.id,
                         user_id=user.id,
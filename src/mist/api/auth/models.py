@@ -9,6 +9,8 @@ from datetime import datetime, timedelta
 from mist.api.users.models import User, Organization, SocialAuthUser
 from mist.api.exceptions import UserNotFoundError
 
+from mist.api import config
+
 try:
     from mist.core.rbac.models import Policy
 except ImportError:
@@ -76,7 +78,10 @@ class AuthToken(me.Document):
             return self.last_accessed_at + timedelta(seconds=self.timeout)
 
     def is_timedout(self):
-        return self.timeout and self.timesout() < datetime.utcnow()
+        # The stored `last_accessed_at` may lag behind by up to the touch
+        # granularity, see `touch_lazily`.
+        slack = timedelta(seconds=config.SESSION_TOUCH_GRANULARITY)
+        return self.timeout and self.timesout() + slack < datetime.utcnow()
 
     def is_valid(self):
         return not (self.revoked or self.is_expired() or self.is_timedout())
@@ -84,18 +89,61 @@ class AuthToken(me.Document):
     def invalidate(self):
         self.revoked = True
 
+    def save(self, *args, **kwargs):
+        # Drop cached copies of the token in all processes, unless only its
+        # access time has changed.
+        changed = set(field.split('.')[0]
+                      for field in self._get_changed_fields())
+        invalidate = not self._created and changed - {'last_accessed_at'}
+        result = super(AuthToken, self).save(*args, **kwargs)
+        if invalidate:
+            # FIXME: Resolve circular import issues
+            from mist.api.auth.cache import invalidate_auth_cache
+            invalidate_auth_cache(tokens=[self.token])
+        return result
+
+    def delete(self, *args, **kwargs):
+        super(AuthToken, self).delete(*args, **kwargs)
+        # FIXME: Resolve circular import issues
+        from mist.api.auth.cache import invalidate_auth_cache
+        invalidate_auth_cache(tokens=[self.token])
+
     def touch(self):
         self.last_accessed_at = datetime.utcnow()
 
+    def touch_lazily(self, granularity=None):
+        """Touch token and persist `last_accessed_at` only if needed
+
+        `last_accessed_at` is only written if it has moved by more than
+        `granularity` seconds since it was last stored, using an atomic update
+        of that single field instead of saving the entire token.
+
+        """
+        if granularity is None:
+            granularity = config.SESSION_TOUCH_GRANULARITY
+        stored = self.last_accessed_at
+        self.touch()
+        if stored and (self.last_accessed_at -
+                       stored).total_seconds() < granularity:
+            return False
+        type(self).objects(id=self.id).update_one(
+            set__last_accessed_at=self.last_accessed_at
+        )
+        # FIXME: Resolve circular import issues
+        from mist.api.auth.cache import token_cache
+        token_cache.touch(self.token, self.last_accessed_at)
+        return True
+
     def get_user(self, effective=True):
         """Return `su` user, if `effective` else `user`"""
         if self.user_id:
+            user_id = self.su if effective and self.su else self.user_id
+            # Users may have been prefetched, eg. by the token cache.
+            prefetched = getattr(self, '_prefetched_users', None) or {}
+            if user_id in prefetched:
+                return prefetched[user_id]
             try:
-                if effective and self.su:
-                    user = User.objects.get(id=self.su)
-                else:
-                    user = User.objects.get(id=self.user_id)
-                return user
+                return User.objects.get(id=user_id)
             except me.DoesNotExist:
                 pass
         return None
@@ -1,6 +1,12 @@
+import os
 import ssl
-
+import json
+import time
+import hashlib
 import logging
+import threading
+
+from collections import OrderedDict, deque
 
 from libcloud.common.types import InvalidCredsError
 
@@ -8,16 +14,24 @@ from mist.api.exceptions import CloudUnavailableError
 from mist.api.exceptions import CloudUnauthorizedError
 from mist.api.exceptions import SSLError
 
+from mist.api import config
+
 
 log = logging.getLogger(__name__)
 
 
 class ConnectionProxy(object):
-    """Wraps a connection with a destructor to disconnect upon gc"""
+    """Wraps a connection with a destructor to disconnect upon gc
+
+    If the connection was checked out of the `driver_pool`, it's returned to
+    the pool instead of being closed, see `release`.
 
-    def __init__(self, conn):
+    """
+
+    def __init__(self, conn, pool_key=None):
         """Initialize with a libcloud-like connection object"""
         self.conn = conn
+        self.pool_key = pool_key
 
     def disconnect(self):
         """Close libcloud-like connection to cloud"""
@@ -25,16 +39,166 @@ class ConnectionProxy(object):
             return
         log.debug("Closing libcloud-like connection %s.", self.conn)
         try:
-            self._conn.disconnect()
+            self.conn.disconnect()
         except AttributeError:
             pass
         except Exception as exc:
             log.error("Error disconnecting conn '%s': %r", self.conn, exc)
         self.conn = None
 
+    def release(self):
+        """Return connection to the pool if pooled, else close it"""
+        if self.conn is None:
+            return
+        if self.pool_key is None:
+            return self.disconnect()
+        driver_pool.checkin(self.pool_key, self.conn)
+        self.conn = None
+
     def __del__(self):
-        """When garbage collected, make sure to disconnect the connection"""
-        self.disconnect()
+        """When garbage collected, make sure to release the connection
+
+        Finalizers may run during any allocation, e.g. while this thread
+        holds the lock of the `driver_pool`, so pooled connections are only
+        queued to be checked in, without touching the pool.
+
+        """
+        try:
+            if self.conn is not None and self.pool_key is not None:
+                driver_pool.release(self.pool_key, self.conn)
+                self.conn = None
+            else:
+                self.disconnect()
+        except Exception as exc:
+            log.error("Error releasing conn '%s': %r", self.conn, exc)
+
+
+class DriverPool(object):
+    """Per-process LRU pool of idle, authenticated libcloud drivers
+
+    Building a driver usually means authenticating to the provider (e.g. to
+    get a Keystone token or a GCE OAuth token) and opening new TLS
+    connections. Instead of discarding the driver of a controller once done,
+    it's kept in this pool, so that the next controller of the same cloud in
+    this process, e.g. in the next task or API request, reuses its auth
+    token and open keep-alive connections.
+
+    Drivers are keyed by controller class, cloud id and a fingerprint of the
+    cloud's settings, so a driver is never reused after the credentials of
+    its cloud have changed, even if changed by another process. Drivers are
+    checked out exclusively, since they're not thread safe, and are evicted
+    after being idle for `CLOUD_DRIVER_POOL_MAX_IDLE` seconds, or when more
+    than `CLOUD_DRIVER_POOL_SIZE` are idle.
+
+    """
+
+    def __init__(self, size=None, max_idle=None):
+        self.size = size
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._pid = None
+        self._idle = OrderedDict()
+        self._released = deque()
+
+    def _check_pid(self):
+        """Drop drivers inherited by forking, since they share sockets"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = OrderedDict()
+
+    def checkout(self, key):
+        """Return an idle driver of key, or None"""
+        self._checkin(self._pop_released())
+        with self._lock:
+            self._check_pid()
+            evicted = self._evict_idle()
+            conns = self._idle.get(key)
+            conn = None
+            if conns:
+                conn, _ = conns.pop()
+                if not conns:
+                    del self._idle[key]
+        self._close(evicted)
+        return conn
+
+    def checkin(self, key, conn):
+        """Put a driver that's no longer in use in the pool"""
+        self._checkin(self._pop_released() + [(key, conn)])
+
+    def release(self, key, conn):
+        """Queue a driver to be checked in by the next call to the pool
+
+        This doesn't acquire the pool's lock, so that it's safe to call from
+        finalizers.
+
+        """
+        self._released.append((os.getpid(), key, conn))
+
+    def _pop_released(self):
+        """Return the released drivers of this process as (key, conn)"""
+        items = []
+        while True:
+            try:
+                pid, key, conn = self._released.popleft()
+            except IndexError:
+                return items
+            # Drivers released before forking are dropped, like idle ones.
+            if pid == os.getpid():
+                items.append((key, conn))
+
+    def _checkin(self, items):
+        if not items:
+            return
+        with self._lock:
+            self._check_pid()
+            now = time.time()
+            for key, conn in items:
+                # Move key to the end, as the most recently used.
+                conns = self._idle.pop(key, [])
+                conns.append((conn, now))
+                self._idle[key] = conns
+            evicted = self._evict_idle()
+            size = self.size or config.CLOUD_DRIVER_POOL_SIZE
+            count = sum(len(conns) for conns in self._idle.values())
+            while count > size:
+                oldest_key, oldest_conns = next(self._idle.iteritems())
+                evicted.append(oldest_conns.pop(0)[0])
+                if not oldest_conns:
+                    del self._idle[oldest_key]
+                count -= 1
+        self._close(evicted)
+
+    def invalidate(self, cloud_id):
+        """Close all idle drivers of a cloud"""
+        self._checkin(self._pop_released())
+        evicted = []
+        with self._lock:
+            self._check_pid()
+            for key in self._idle.keys():
+                if key[1] == cloud_id:
+                    evicted.extend(conn for conn, _ in self._idle.pop(key))
+        self._close(evicted)
+
+    def _evict_idle(self):
+        """Remove drivers idle for too long, return them to be closed"""
+        evicted = []
+        deadline = time.time() - (self.max_idle or
+                                  config.CLOUD_DRIVER_POOL_MAX_IDLE)
+        for key in self._idle.keys():
+            conns = self._idle[key]
+            while conns and conns[0][1] < deadline:
+                evicted.append(conns.pop(0)[0])
+            if not conns:
+                del self._idle[key]
+        return evicted
+
+    def _close(self, conns):
+        for conn in conns:
+            ConnectionProxy(conn).disconnect()
+
+
+# Pool shared by all controllers of the same process.
+driver_pool = DriverPool()
 
 
 class BaseController(object):
@@ -45,6 +209,11 @@ class BaseController(object):
 
     """
 
+    # Whether drivers may be reused by other controllers of the same cloud in
+    # this process, see `DriverPool`. Subclasses whose connections are bound
+    # to state that isn't captured by the cloud's fields SHOULD disable it.
+    pool_connections = True
+
     def __init__(self, main_ctl):
         """Initialize cloud controller given a cloud
 
@@ -112,9 +281,30 @@ class BaseController(object):
 
         """
         if self._conn is None:
-            self._conn = ConnectionProxy(self.connect())
+            key = conn = None
+            if self.pool_connections and config.CLOUD_DRIVER_POOL_SIZE:
+                key = self._connection_pool_key()
+                conn = driver_pool.checkout(key)
+            if conn is None:
+                conn = self.connect()
+            self._conn = ConnectionProxy(conn, pool_key=key)
         return self._conn.conn
 
+    def _connection_pool_key(self):
+        """Return the key of this controller's drivers in the `driver_pool`
+
+        This includes a fingerprint of the cloud type specific fields, which
+        include its credentials, so that drivers built with outdated
+        credentials are never reused.
+
+        """
+        fields = self.cloud.to_mongo(fields=self.cloud._cloud_specific_fields)
+        fields.pop('_id', None)
+        fields.pop('_cls', None)
+        fingerprint = hashlib.sha1(json.dumps(fields.to_dict(), sort_keys=True,
+                                              default=str)).hexdigest()
+        return (type(self), self.cloud.id, fingerprint)
+
     def check_connection(self):
         """Raise exception if we can't connect to cloud provider
 
@@ -132,6 +322,7 @@ class BaseController(object):
         self.connect()
 
     def disconnect(self):
+        """Release the connection, returning it to the pool if pooled"""
         if self._conn is not None:
-            self._conn.disconnect()
+            self._conn.release()
             self._conn = None
@@ -6,29 +6,31 @@ to db etc. Cloud specific controllers are in `mist.api.clouds.controllers`.
 
 """
 
+import os
 import ssl
 import json
 import copy
+import time
 import socket
+import hashlib
 import logging
 import datetime
 import calendar
 import requests
-
-import jsonpatch
+import threading
 
 import mongoengine as me
 
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
 from libcloud.common.types import InvalidCredsError
 from libcloud.compute.types import NodeState
 from libcloud.compute.base import NodeLocation, Node
 
-from amqp.connection import Connection
-
 from mist.api import config
 
 from mist.api.exceptions import MistError
-from mist.api.exceptions import ConflictError
 from mist.api.exceptions import ForbiddenError
 from mist.api.exceptions import BadRequestError
 from mist.api.exceptions import InternalServerError
@@ -41,6 +43,7 @@ from mist.api.helpers import get_datetime
 from mist.api.helpers import amqp_publish
 from mist.api.helpers import amqp_publish_user
 from mist.api.helpers import amqp_owner_listening
+from mist.api.helpers import make_patch_by_key
 
 from mist.api.concurrency.models import PeriodicTaskInfo
 from mist.api.concurrency.models import PeriodicTaskThresholdExceeded
@@ -59,7 +62,119 @@ from mist.api.machines.models import Machine
 log = logging.getLogger(__name__)
 
 
-def _decide_machine_cost(machine, tags=None, cost=(0, 0)):
+class CostContext(object):
+    """Values reused when deciding the cost of all machines of a poll
+
+    This holds the number of days of the current month, the cost tags of the
+    polled machines, which are fetched with a single query, and any values
+    memoized by the controller's cost hooks, see `memoize`.
+
+    """
+
+    def __init__(self, owner=None, machines=(), now=None):
+        now = now or datetime.datetime.utcnow()
+        self.month_days = calendar.monthrange(now.year, now.month)[1]
+        self.owner = owner
+        self.tags = {}
+        self._memo = {}
+        self.prefetch_tags(machines)
+
+    def prefetch_tags(self, machines):
+        """Fetch the cost tags of machines with no cached tags at once"""
+        tags = {machine.id: {} for machine in machines
+                if machine.cached_tags is None}
+        if not tags or self.owner is None:
+            return
+        for tag in Tag.objects(
+            owner=self.owner, resource__in=[machine for machine in machines
+                                            if machine.id in tags],
+            key__in=['cost_per_hour', 'cost_per_month'],
+        ).only('key', 'value', 'resource').as_pymongo():
+            machine_id = tag['resource']['_ref'].id
+            if machine_id in tags:
+                tags[machine_id][tag['key']] = tag.get('value')
+        self.tags.update(tags)
+
+    def get_tags(self, machine):
+        """Return the tags of a machine that are relevant to its cost"""
+        if machine.cached_tags is not None:
+            return {tag['key']: tag['value'] for tag in machine.cached_tags}
+        if machine.id in self.tags:
+            return self.tags[machine.id]
+        return {tag.key: tag.value for tag in Tag.objects(
+            owner=machine.cloud.owner, resource=machine,
+        )}
+
+    def memoize(self, key, func):
+        """Return the value of key, calling func to set it the first time"""
+        try:
+            return self._memo[key]
+        except KeyError:
+            value = self._memo[key] = func()
+            return value
+
+
+class NodeListings(object):
+    """Per-process cache of the nodes most recently listed per cloud
+
+    Machine actions need the libcloud node of the machine. For clouds that
+    can't fetch a single node, this means listing all nodes of the cloud.
+    The listings of `list_machines` and `_get_machine_libcloud` are kept here
+    for `MACHINE_NODE_LISTING_TTL` seconds, so that bulk actions on many
+    machines of the same cloud, or actions right after a poll, don't list
+    all nodes once per machine.
+
+    Each cached node is handed out at most once, so repeated actions on the
+    same machine always look up its current state.
+
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._pid = None
+        self._listings = {}
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._listings = {}
+
+    def put(self, cloud_id, nodes):
+        """Store the nodes just listed for a cloud"""
+        ttl = config.MACHINE_NODE_LISTING_TTL if self.ttl is None else self.ttl
+        if not ttl:
+            return
+        now = time.time()
+        with self._lock:
+            self._check_pid()
+            for key, (expires, _) in self._listings.items():
+                if expires < now:
+                    del self._listings[key]
+            self._listings[cloud_id] = (now + ttl,
+                                        {node.id: node for node in nodes})
+
+    def pop(self, cloud_id, node_id):
+        """Return and forget the cached node of a cloud, or None"""
+        with self._lock:
+            self._check_pid()
+            expires, nodes = self._listings.get(cloud_id, (0, {}))
+            if expires < time.time():
+                self._listings.pop(cloud_id, None)
+                return None
+            return nodes.pop(node_id, None)
+
+    def invalidate(self, cloud_id):
+        with self._lock:
+            self._check_pid()
+            self._listings.pop(cloud_id, None)
+
+
+# Listings shared by all controllers of the same process.
+node_listings = NodeListings()
+
+
+def _decide_machine_cost(machine, tags=None, cost=(0, 0), context=None):
     """Decide what the monthly and hourly machine cost is
 
     Params:
@@ -67,6 +182,7 @@ def _decide_machine_cost(machine, tags=None, cost=(0, 0)):
     tags:       Optional machine tags dict, if not provided it will be queried.
     cost:       Optional two-tuple of hourly/monthly cost, such as that
                 returned by cloud provider.
+    context:    Optional `CostContext` shared by the machines of a poll.
 
     Any cost-specific tags take precedence.
     """
@@ -78,13 +194,13 @@ def _decide_machine_cost(machine, tags=None, cost=(0, 0)):
             log.warning("Can't parse %r as float.", num)
             return 0
 
-    now = datetime.datetime.utcnow()
-    month_days = calendar.monthrange(now.year, now.month)[1]
+    if context is None:
+        context = CostContext()
+    month_days = context.month_days
 
-    # Get machine tags from db
-    tags = tags or {tag.key: tag.value for tag in Tag.objects(
-        owner=machine.cloud.owner, resource=machine,
-    )}
+    # Get machine tags from the machine's cached tags, or else from db
+    if not tags:
+        tags = context.get_tags(machine)
 
     try:
         cph = parse_num(tags.get('cost_per_hour'))
@@ -103,6 +219,23 @@ def _decide_machine_cost(machine, tags=None, cost=(0, 0)):
     machine.cost.monthly = cpm
 
 
+# Fields that may change when polling without the machine being rewritten.
+_SKIPPABLE_FIELDS = set(Machine.POLLED_FIELDS +
+                        ('last_seen', 'missing_since', 'poll_hash'))
+
+
+def _machine_poll_hash(machine):
+    """Return a hash of the machine fields that are updated when polling
+
+    The hash is stored on the machine model, so that machines whose polled
+    fields haven't changed since the last poll don't need to be rewritten.
+    """
+    data = machine.to_mongo(fields=Machine.POLLED_FIELDS)
+    data.pop('_id', None)
+    return hashlib.md5(json.dumps(data, sort_keys=True,
+                                  default=str)).hexdigest()
+
+
 class BaseComputeController(BaseController):
     """Abstract base class for every cloud/provider controller
 
@@ -151,6 +284,9 @@ class BaseComputeController(BaseController):
 
     """
 
+    # Set by `_list_machines`, see `_list_machines__cost_context`.
+    _cost_context = None
+
     def check_connection(self):
         """Raise exception if we can't connect to cloud provider
 
@@ -185,12 +321,17 @@ class BaseComputeController(BaseController):
             last_seen__gt=datetime.datetime.utcnow() - timedelta,
         )
 
-    def list_machines(self, persist=True):
+    def list_machines(self, persist=True, nodes=None):
         """Return list of machines for cloud
 
         A list of nodes is fetched from libcloud, the data is processed, stored
         on machine models, and a list of machine models is returned.
 
+        If `nodes` is provided, it is expected to be the result of an earlier
+        call to `fetch_nodes`, and no nodes will be fetched from the provider.
+        This allows the poller to fetch the nodes of many clouds concurrently,
+        see `mist.api.poller.executor`.
+
         Subclasses SHOULD NOT override or extend this method.
 
         This method wraps `_list_machines` which contains the core
@@ -202,53 +343,105 @@ class BaseComputeController(BaseController):
         task = PeriodicTaskInfo.get_or_add(task_key)
         try:
             with task.task_runner(persist=persist):
-                old_machines = {'%s-%s' % (m.id, m.machine_id): m.as_dict()
-                                for m in self.list_cached_machines()}
-                machines = self._list_machines()
+                cached_machines = list(self.list_cached_machines())
+                old_machines = {
+                    '%s-%s' % (m.id, m.machine_id): mdict
+                    for m, mdict in zip(cached_machines,
+                                        Machine.as_dicts(cached_machines))
+                }
+                machines = self._list_machines(nodes=nodes)
         except PeriodicTaskThresholdExceeded:
             self.cloud.disable()
             raise
 
-        # Initialize AMQP connection to reuse for multiple messages.
-        amqp_conn = Connection(config.AMQP_URI)
-
         if amqp_owner_listening(self.cloud.owner.id):
+            machine_dicts = Machine.as_dicts(machines)
             if not config.MACHINE_PATCHES:
                 amqp_publish_user(self.cloud.owner.id,
                                   routing_key='list_machines',
-                                  connection=amqp_conn,
                                   data={'cloud_id': self.cloud.id,
-                                        'machines': [machine.as_dict()
-                                                     for machine in machines]})
+                                        'machines': machine_dicts})
             else:
                 # Publish patches to rabbitmq.
-                new_machines = {'%s-%s' % (m.id, m.machine_id): m.as_dict()
-                                for m in machines}
+                new_machines = {'%s-%s' % (m.id, m.machine_id): mdict
+                                for m, mdict in zip(machines, machine_dicts)}
                 # Exclude last seen and probe fields from patch.
                 for md in old_machines, new_machines:
                     for m in md.values():
                         m.pop('last_seen')
                         m.pop('probe')
-                patch = jsonpatch.JsonPatch.from_diff(old_machines,
-                                                      new_machines).patch
+                patch = make_patch_by_key(old_machines, new_machines)
                 if patch:
                     amqp_publish_user(self.cloud.owner.id,
                                       routing_key='patch_machines',
-                                      connection=amqp_conn,
                                       data={'cloud_id': self.cloud.id,
                                             'patch': patch})
 
         # Push historic information for inventory and cost reporting.
-        for machine in machines:
-            data = {'owner_id': self.cloud.owner.id,
-                    'machine_id': machine.id,
-                    'cost_per_month': machine.cost.monthly}
-            amqp_publish(exchange='machines_inventory', routing_key='',
-                         auto_delete=False, data=data, connection=amqp_conn)
+        if not config.MACHINES_INVENTORY_BATCHED:
+            for machine in machines:
+                data = {'owner_id': self.cloud.owner.id,
+                        'machine_id': machine.id,
+                        'cost_per_month': machine.cost.monthly}
+                amqp_publish(exchange='machines_inventory', routing_key='',
+                             auto_delete=False, data=data)
+        else:
+            # Publish a single message per cloud, only if any machine's cost
+            # or the set of machines changed since the last poll, or if the
+            # last poll was in a previous snapshot interval, so that
+            # consumers that missed a message eventually catch up.
+            old_costs = {m.id: m.cost.monthly for m in cached_machines}
+            new_costs = {m.id: m.cost.monthly for m in machines}
+            interval = config.MACHINES_INVENTORY_SNAPSHOT_INTERVAL
+            last_polls = [m.last_seen for m in cached_machines if m.last_seen]
+            snapshot = False
+            if interval and last_polls:
+                last_poll = calendar.timegm(max(last_polls).utctimetuple())
+                snapshot = last_poll // interval != time.time() // interval
+            if snapshot or new_costs != old_costs:
+                try:
+                    amqp_publish(exchange='machines_inventory',
+                                 routing_key='', auto_delete=False,
+                                 data={'owner_id': self.cloud.owner.id,
+                                       'cloud_id': self.cloud.id,
+                                       'machine_ids': new_costs.keys(),
+                                       'costs_per_month': new_costs.values()})
+                except Exception as exc:
+                    log.error("Error publishing machines inventory of %s: "
+                              "%r", self.cloud, exc)
 
         return machines
 
-    def _list_machines(self):
+    def fetch_nodes(self):
+        """Fetch list of nodes from the provider
+
+        This only performs the (I/O bound) provider API call of
+        `list_machines`, translating any errors to the appropriate
+        `MistError`. Instead of raising, the error is returned, so that it can
+        be passed on to `list_machines` and be tracked along with any other
+        failures of the task.
+
+        Subclasses SHOULD NOT override or extend this method.
+
+        """
+        try:
+            nodes = self._list_machines__fetch_machines()
+            log.info("List nodes returned %d results for %s.",
+                     len(nodes), self.cloud)
+        except InvalidCredsError as exc:
+            log.warning("Invalid creds on running list_nodes on %s: %s",
+                        self.cloud, exc)
+            return CloudUnauthorizedError(msg=exc.message)
+        except (requests.exceptions.SSLError, ssl.SSLError) as exc:
+            log.error("SSLError on running list_nodes on %s: %s",
+                      self.cloud, exc)
+            return SSLError(exc=exc)
+        except Exception as exc:
+            log.exception("Error while running list_nodes on %s", self.cloud)
+            return CloudUnavailableError(exc=exc)
+        return nodes
+
+    def _list_machines(self, nodes=None):
         """Core logic of list_machines method
         A list of nodes is fetched from libcloud, the data is processed, stored
         on machine models, and a list of machine models is returned.
@@ -269,37 +462,40 @@ class BaseComputeController(BaseController):
         default, dummy methods.
 
         """
-        # Try to query list of machines from provider API.
-        try:
-            nodes = self._list_machines__fetch_machines()
-            log.info("List nodes returned %d results for %s.",
-                     len(nodes), self.cloud)
-        except InvalidCredsError as exc:
-            log.warning("Invalid creds on running list_nodes on %s: %s",
-                        self.cloud, exc)
-            raise CloudUnauthorizedError(msg=exc.message)
-        except (requests.exceptions.SSLError, ssl.SSLError) as exc:
-            log.error("SSLError on running list_nodes on %s: %s",
-                      self.cloud, exc)
-            raise SSLError(exc=exc)
-        except Exception as exc:
-            log.exception("Error while running list_nodes on %s", self.cloud)
-            raise CloudUnavailableError(exc=exc)
+        # Try to query list of machines from provider API, unless already
+        # fetched.
+        if nodes is None:
+            nodes = self.fetch_nodes()
+        if isinstance(nodes, Exception):
+            raise nodes
+        node_listings.put(self.cloud.id, nodes)
 
         machines = []
         now = datetime.datetime.utcnow()
 
+        # Fetch all machine models of this cloud from the db in one query,
+        # instead of querying for each node returned by the provider.
+        cached_machines = {machine.machine_id: machine
+                           for machine in Machine.objects(cloud=self.cloud)}
+
+        # Share month length, cost tags and pricing data of the cloud among
+        # the cost calculations of all machines.
+        cost_context = CostContext(owner=self.cloud.owner,
+                                   machines=cached_machines.values(),
+                                   now=now)
+        self._cost_context = cost_context
+
         # Process each machine in returned list.
         # Store previously unseen machines separately.
         new_machines = []
         for node in nodes:
 
-            # Fetch machine mongoengine model from db, or initialize one.
-            try:
-                machine = Machine.objects.get(cloud=self.cloud,
-                                              machine_id=node.id)
-            except Machine.DoesNotExist:
-                machine = Machine(cloud=self.cloud, machine_id=node.id).save()
+            # Get machine mongoengine model, or initialize one. New machines
+            # are inserted in the db along with all other changes below.
+            machine = cached_machines.get(node.id)
+            if machine is None:
+                machine = Machine(cloud=self.cloud, machine_id=node.id)
+                cached_machines[node.id] = machine
                 new_machines.append(machine)
 
             # Update machine_model's last_seen fields.
@@ -392,6 +588,7 @@ class BaseComputeController(BaseController):
                 _decide_machine_cost(
                     machine,
                     cost=self._list_machines__cost_machine(machine, node),
+                    context=cost_context,
                 )
             except Exception as exc:
                 log.exception("Error while calculating cost "
@@ -401,17 +598,6 @@ class BaseComputeController(BaseController):
                 machine.cost.hourly = 0
                 machine.cost.monthly = 0
 
-            # Save all changes to machine model on the database.
-            try:
-                machine.save()
-            except me.ValidationError as exc:
-                log.error("Error adding %s: %s", machine.name, exc.to_dict())
-                raise BadRequestError({"msg": exc.message,
-                                       "errors": exc.to_dict()})
-            except me.NotUniqueError as exc:
-                log.error("Machine %s not unique error: %s", machine.name, exc)
-                raise ConflictError("Machine with this name already exists")
-
             machines.append(machine)
 
         # Append generic-type machines, which aren't handled by libcloud.
@@ -439,16 +625,24 @@ class BaseComputeController(BaseController):
                         break
 
             # Parse cost from tags
-            _decide_machine_cost(machine)
+            _decide_machine_cost(machine, context=cost_context)
 
-            # Save machine
-            machine.save()
             machines.append(machine)
+        self._cost_context = None
+
+        # Save all changes to machine models on the database in bulk.
+        seen_ids = [machine.id for machine in machines]
+        machines = self._list_machines__bulk_write(machines, new_machines,
+                                                   now)
+        new_machines = [machine for machine in new_machines
+                        if not machine._created]
 
         # Set last_seen on machine models we didn't see for the first time now.
+        # Also reset their poll hash, so that they'll be rewritten when seen.
         Machine.objects(cloud=self.cloud,
-                        id__nin=[m.id for m in machines],
-                        missing_since=None).update(missing_since=now)
+                        id__nin=seen_ids,
+                        missing_since=None).update(missing_since=now,
+                                                   poll_hash=None)
 
         # Update RBAC Mappings given the list of nodes seen for the first time.
         self.cloud.owner.mapper.update(new_machines, async=False)
@@ -473,6 +667,85 @@ class BaseComputeController(BaseController):
 
         return machines
 
+    def _list_machines__bulk_write(self, machines, new_machines, now):
+        """Store changes of machine models on the database in bulk
+
+        All changes are written with a single unordered `bulk_write`, made up
+        of an `InsertOne` operation for each machine in `new_machines` and an
+        `UpdateOne` operation, containing only the changed fields, for every
+        other machine.
+
+        Machines whose poll hash matches the one stored during the last poll
+        are not rewritten. Instead, their `last_seen` is set to `now` with a
+        single update query.
+
+        Machines that fail validation or whose write fails are logged and
+        left out of the returned list, without aborting the rest of the batch.
+
+        Subclasses SHOULD NOT override or extend this method.
+
+        """
+        new_ids = set(machine.id for machine in new_machines)
+        saved, unchanged, ops, op_machines = [], [], [], []
+        for machine in machines:
+            old_hash = machine.poll_hash
+            try:
+                machine.validate()
+            except me.ValidationError as exc:
+                log.error("Error adding %s: %s", machine.name, exc.to_dict())
+                continue
+            machine.poll_hash = _machine_poll_hash(machine)
+            # Fields that aren't hashed, e.g. changed by `clean`, are always
+            # written.
+            changed = set(field.split('.')[0]
+                          for field in machine._get_changed_fields())
+            if machine.id not in new_ids and old_hash == machine.poll_hash \
+                    and changed <= _SKIPPABLE_FIELDS:
+                machine._clear_changed_fields()
+                unchanged.append(machine)
+                continue
+            if machine.id in new_ids:
+                ops.append(InsertOne(machine.to_mongo()))
+            else:
+                set_data, unset_data = machine._delta()
+                update = {}
+                if set_data:
+                    update['$set'] = set_data
+                if unset_data:
+                    update['$unset'] = unset_data
+                if not update:
+                    saved.append(machine)
+                    continue
+                ops.append(UpdateOne({'_id': machine.id}, update))
+            op_machines.append(machine)
+
+        if unchanged:
+            Machine.objects(id__in=[machine.id for machine in unchanged],
+                            missing_since=None).update(last_seen=now)
+            saved.extend(unchanged)
+
+        failed = set()
+        if ops:
+            try:
+                Machine._get_collection().bulk_write(ops, ordered=False)
+            except BulkWriteError as exc:
+                for error in exc.details.get('writeErrors', []):
+                    machine = op_machines[error['index']]
+                    log.error("Error saving %s in %s: %s",
+                              machine, self.cloud, error.get('errmsg'))
+                    failed.add(error['index'])
+
+        for index, machine in enumerate(op_machines):
+            if index in failed:
+                continue
+            machine._clear_changed_fields()
+            machine._created = False
+            saved.append(machine)
+
+        # Preserve the order in which machines were returned by the provider.
+        saved_ids = set(machine.id for machine in saved)
+        return [machine for machine in machines if machine.id in saved_ids]
+
     def _list_machines__fetch_machines(self):
         """Perform the actual libcloud call to get list of nodes"""
         return self.connection.list_nodes()
@@ -553,6 +826,19 @@ class BaseComputeController(BaseController):
         """
         return
 
+    def _list_machines__cost_context(self):
+        """Return the `CostContext` of the current poll
+
+        Cost hooks may use it to memoize values, such as the sizes of the
+        cloud, once per poll instead of once per machine.
+
+        Subclasses SHOULD NOT override this method.
+
+        """
+        if self._cost_context is None:
+            self._cost_context = CostContext(owner=self.cloud.owner)
+        return self._cost_context
+
     def _list_machines__cost_machine(self, machine, machine_libcloud):
         """Perform cost calculations for a machine
 
@@ -791,20 +1077,75 @@ class BaseComputeController(BaseController):
         """Return an instance of a libcloud node
 
         This is a private method, used mainly by machine action methods.
+
+        The node is fetched directly, if the cloud supports it, see
+        `_get_machine_libcloud__fetch_node`. Otherwise, it's taken from a
+        listing of the cloud's nodes, which is reused for a few seconds by
+        actions on other machines of the same cloud, see `NodeListings`.
+
+        If the node isn't found and `no_fail` is True, a node built from the
+        machine model is returned instead.
+
+        Subclasses MAY override `_get_machine_libcloud__fetch_node`.
+
         """
         # assert isinstance(machine.cloud, Machine)
         assert self.cloud == machine.cloud
-        for node in self.connection.list_nodes():
-            if node.id == machine.machine_id:
-                return node
+        try:
+            node = self._get_machine_libcloud__fetch_node(machine)
+        except InvalidCredsError:
+            raise
+        except Exception as exc:
+            log.warning("Error fetching node %s of %s, will list all nodes: "
+                        "%r", machine.machine_id, self.cloud, exc)
+            node = None
+        if node is None:
+            node = node_listings.pop(self.cloud.id, machine.machine_id)
+            if node is not None:
+                # Don't share the driver of another controller.
+                node = copy.copy(node)
+                node.driver = self.connection
+        if node is None:
+            nodes = self.connection.list_nodes()
+            for node in nodes:
+                if node.id == machine.machine_id:
+                    break
+            else:
+                node = None
+            node_listings.put(self.cloud.id,
+                              [other for other in nodes if other is not node])
+        if node is not None:
+            return node
         if no_fail:
-            return Node(machine.machine_id, name=machine.machine_id,
-                        state=0, public_ips=[], private_ips=[],
-                        driver=self.connection)
+            return self._get_machine_libcloud__from_machine(machine)
         raise MachineNotFoundError(
             "Machine with machine_id '%s'." % machine.machine_id
         )
 
+    def _get_machine_libcloud__fetch_node(self, machine):
+        """Fetch the libcloud node of a single machine, or return None
+
+        This is called by `_get_machine_libcloud` to avoid listing all nodes
+        of the cloud. If None is returned, or an error is raised, the node is
+        looked up in a listing of all nodes.
+
+        Subclasses MAY override this method, if the provider supports
+        fetching a single node.
+
+        """
+        return None
+
+    def _get_machine_libcloud__from_machine(self, machine):
+        """Build a libcloud node from the stored machine model"""
+        states = {value: key for key, value in config.STATES.items()}
+        return Node(machine.machine_id,
+                    name=machine.name or machine.machine_id,
+                    state=states.get(machine.state, NodeState.UNKNOWN),
+                    public_ips=list(machine.public_ips or []),
+                    private_ips=list(machine.private_ips or []),
+                    driver=self.connection,
+                    extra=copy.deepcopy(machine.extra or {}))
+
     def start_machine(self, machine):
         """Start machine
 
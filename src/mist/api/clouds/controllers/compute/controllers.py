@@ -33,8 +33,7 @@ import mongoengine as me
 
 from xml.sax.saxutils import escape
 
-from libcloud.pricing import get_size_price
-from libcloud.compute.base import Node, NodeImage, NodeSize
+from libcloud.compute.base import NodeImage, NodeSize
 from libcloud.compute.providers import get_driver
 from libcloud.container.providers import get_driver as get_container_driver
 from libcloud.compute.types import Provider, NodeState
@@ -52,6 +51,7 @@ from mist.api.machines.models import Machine
 from mist.api.misc.cloud import CloudImage
 
 from mist.api.clouds.controllers.main.base import BaseComputeController
+from mist.api.clouds.controllers.compute.pricing import get_size_price
 
 from mist.api import config
 
@@ -82,6 +82,10 @@ class AmazonComputeController(BaseComputeController):
                                         self.cloud.apisecret,
                                         region=self.cloud.region)
 
+    def _get_machine_libcloud__fetch_node(self, machine):
+        nodes = self.connection.list_nodes(ex_node_ids=[machine.machine_id])
+        return nodes[0] if nodes else None
+
     def _list_machines__machine_creation_date(self, machine, machine_libcloud):
         return machine_libcloud.created_at  # datetime
 
@@ -136,15 +140,19 @@ class AmazonComputeController(BaseComputeController):
         if machine_libcloud.state == NodeState.STOPPED:
             return 0, 0
 
-        sizes = machine_libcloud.driver.list_sizes()
-        size = machine_libcloud.extra.get('instance_type')
-        for node_size in sizes:
-            if node_size.id == size:
-                plan_price = node_size.price.get(machine.os_type)
-                if not plan_price:
-                    # Use the default which is linux.
-                    plan_price = node_size.price.get('linux')
-                return plan_price.replace('/hour', '').replace('$', ''), 0
+        # Sizes are listed once per poll, since the driver builds them from
+        # the pricing data of its region.
+        driver = machine_libcloud.driver
+        sizes = self._list_machines__cost_context().memoize(
+            'sizes', lambda: {size.id: size for size in driver.list_sizes()}
+        )
+        node_size = sizes.get(machine_libcloud.extra.get('instance_type'))
+        if node_size is not None:
+            plan_price = node_size.price.get(machine.os_type)
+            if not plan_price:
+                # Use the default which is linux.
+                plan_price = node_size.price.get('linux')
+            return plan_price.replace('/hour', '').replace('$', ''), 0
         return 0, 0
 
     def _list_images__fetch_images(self, search=None):
@@ -292,10 +300,10 @@ class RackSpaceComputeController(BaseComputeController):
         size = machine_libcloud.extra.get('flavorId')
         location = machine_libcloud.driver.region[:3]
         driver_name = 'rackspacenova' + location
-        price = get_size_price(driver_type='compute', driver_name=driver_name,
-                               size_id=size)
-        if price:
-            plan_price = price.get(machine.os_type) or price.get('linux')
+        plan_price = get_size_price(driver_type='compute',
+                                    driver_name=driver_name, size_id=size,
+                                    os_type=machine.os_type)
+        if plan_price:
             # 730 is the number of hours per month as on
             # https://www.rackspace.com/calculator
             return plan_price, float(plan_price) * 730
@@ -441,18 +449,13 @@ class AzureComputeController(BaseComputeController):
             machine_libcloud_id)
         return cloud_service
 
-    def _get_machine_libcloud(self, machine, no_fail=False):
+    def _get_machine_libcloud__fetch_node(self, machine):
         cloud_service = self._cloud_service(machine.machine_id)
         for node in self.connection.list_nodes(
                 ex_cloud_service_name=cloud_service):
             if node.id == machine.machine_id:
                 return node
-            if no_fail:
-                return Node(machine.machine_id, name=machine.machine_id,
-                            state=0, public_ips=[], private_ips=[],
-                            driver=self.connection)
-            raise MachineNotFoundError("Machine with id '%s'." %
-                                       machine.machine_id)
+        return None
 
     def _start_machine(self, machine, machine_libcloud):
         cloud_service = self._cloud_service(machine.machine_id)
@@ -650,6 +653,8 @@ class GoogleComputeController(BaseComputeController):
                 ram_price = get_size_price(driver_type='compute',
                                            driver_name=driver_name,
                                            size_id=ram_price)
+                if not (cpu_price and ram_price):
+                    return 0, 0
                 # Example custom-4-16384
                 try:
                     cpu = int(size.split('-')[1])
@@ -801,6 +806,9 @@ class OpenStackComputeController(BaseComputeController):
             ex_force_base_url=self.cloud.compute_endpoint,
         )
 
+    def _get_machine_libcloud__fetch_node(self, machine):
+        return self.connection.ex_get_node_details(machine.machine_id)
+
     def _list_machines__machine_creation_date(self, machine, machine_libcloud):
         return machine_libcloud.extra.get('created')  # iso8601 string
 
@@ -1139,6 +1147,9 @@ class DockerComputeController(BaseComputeController):
 
 class LibvirtComputeController(BaseComputeController):
 
+    # Connections are bound to the cloud's key, which may change in place.
+    pool_connections = False
+
     def _connect(self):
         """Three supported ways to connect: local system, qemu+tcp, qemu+ssh"""
 
@@ -1363,6 +1374,8 @@ class OnAppComputeController(BaseComputeController):
 
 class OtherComputeController(BaseComputeController):
 
+    pool_connections = False
+
     def _connect(self):
         return None
 
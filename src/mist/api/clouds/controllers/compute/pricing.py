@@ -0,0 +1,76 @@
+"""In-memory index of libcloud's compute pricing data
+
+libcloud's `get_size_price` looks up the pricing data of a driver every time
+it's called and, for drivers with no pricing data, such as unknown GCE
+regions, it loads and parses the whole pricing file on every call, only to
+raise a `KeyError`. The cost hooks of compute controllers call it for each
+machine on every poll.
+
+The `PricingIndex` defined here loads the pricing data of each driver once
+per process, including the prices generated by `bin/get-ec2-prices`,
+`bin/get-gce-prices` and `bin/get-rackspace-prices` that are shipped with
+libcloud's pricing file, and remembers missing drivers as well, so that
+lookups by driver (which includes the region), size and OS are dict lookups.
+
+"""
+
+import logging
+
+from libcloud.pricing import get_pricing
+
+
+log = logging.getLogger(__name__)
+
+
+class PricingIndex(object):
+    """Memoize libcloud's pricing data by driver type and name"""
+
+    def __init__(self):
+        self._pricing = {}
+
+    def get_pricing(self, driver_type, driver_name):
+        """Return the prices of a driver by size id, or an empty dict"""
+        key = (driver_type, driver_name)
+        try:
+            return self._pricing[key]
+        except KeyError:
+            pass
+        try:
+            pricing = get_pricing(driver_type=driver_type,
+                                  driver_name=driver_name) or {}
+        except KeyError:
+            pricing = {}
+        except Exception as exc:
+            # Don't memoize, the pricing file may be temporarily unavailable.
+            log.error("Error loading pricing data of %s: %r", driver_name, exc)
+            return {}
+        if not pricing:
+            log.warning("No pricing data for %s %s", driver_type, driver_name)
+        self._pricing[key] = pricing
+        return pricing
+
+    def get_size_price(self, driver_type, driver_name, size_id, os_type=None):
+        """Return the price of a size, or None if unknown
+
+        Some drivers are priced per OS, in which case the price for `os_type`
+        is returned if given, falling back to linux. Otherwise, the prices of
+        all OSes are returned as a dict.
+
+        """
+        price = self.get_pricing(driver_type, driver_name).get(size_id)
+        if isinstance(price, dict) and os_type is not None:
+            price = price.get(os_type) or price.get('linux')
+        return price
+
+    def clear(self):
+        self._pricing = {}
+
+
+# Index shared by all controllers of the same process.
+pricing_index = PricingIndex()
+
+
+def get_size_price(driver_type, driver_name, size_id, os_type=None):
+    """Return the price of a size, or None if unknown, see `PricingIndex`"""
+    return pricing_index.get_size_price(driver_type, driver_name, size_id,
+                                        os_type=os_type)
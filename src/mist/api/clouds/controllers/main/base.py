@@ -28,6 +28,7 @@ from mist.api.exceptions import CloudUnauthorizedError
 from mist.api.exceptions import SSLError
 
 from mist.api.helpers import rename_kwargs
+from mist.api.clouds.controllers.base import driver_pool
 from mist.api.clouds.controllers.network.base import BaseNetworkController
 
 from mist.api.clouds.controllers.compute.base import BaseComputeController
@@ -206,8 +207,9 @@ class BaseMainController(object):
 
         """
 
-        # Close previous connection.
+        # Close previous connection, along with any pooled ones.
         self.disconnect()
+        driver_pool.invalidate(self.cloud.id)
 
         # Transform params with extra underscores for compatibility.
         rename_kwargs(kwargs, 'api_key', 'apikey')
@@ -276,6 +278,9 @@ class BaseMainController(object):
             log.error("Cloud %s not unique error: %s", self.cloud, exc)
             raise CloudExistsError()
 
+        # Drop any drivers of the previous settings released in the meantime.
+        driver_pool.invalidate(self.cloud.id)
+
     def _update__preparse_kwargs(self, kwargs):
         """Preparse keyword arguments to `self.update`
 
@@ -302,6 +307,13 @@ class BaseMainController(object):
         self.cloud.enabled = True
         self.cloud.save()
 
+        # Schedules of disabled clouds are not checked again until their
+        # next run, so make sure the cloud gets polled right away.
+        # FIXME: Resolve circular import issues
+        from mist.api.poller.models import ListMachinesPollingSchedule
+
+        ListMachinesPollingSchedule.add(cloud=self.cloud)
+
     def disable(self):
         self.cloud.enabled = False
         self.cloud.save()
@@ -87,6 +87,10 @@ class Cloud(me.Document):
 
     deleted = me.DateTimeField()
 
+    # Denormalized copy of the cloud's tags, kept in sync by the methods in
+    # `mist.api.tag.methods`. None if the tags haven't been cached yet.
+    cached_tags = me.ListField(me.DictField(), default=None)
+
     meta = {
         'strict': False,
         'allow_inheritance': True,
@@ -180,7 +184,7 @@ class Cloud(me.Document):
             'dns_enabled': self.dns_enabled,
             'state': 'online' if self.enabled else 'offline',
             'polling_interval': self.polling_interval,
-            'tags': [
+            'tags': self.cached_tags if self.cached_tags is not None else [
                 {'key': tag.key, 'value': tag.value}
                 for tag in Tag.objects(owner=self.owner,
                                        resource=self).only('key', 'value')
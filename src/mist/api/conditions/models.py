@@ -84,16 +84,15 @@ class TaggingCondition(BaseCondition):
     def q(self):
         rtype = self._instance.condition_resource_cls._meta["collection"]
         ids = set()
-        for key, value in self.tags.iteritems():
-            query = {
-                'owner': self._instance.owner,
-                'resource_type': rtype,
-                'key': key,
-            }
-            if value:
-                query['value'] = value
-            ids |= set(tag.resource.id
-                       for tag in Tag.objects(**query).only('resource'))
+        tags_q = [me.Q(key=key, value=value) if value else me.Q(key=key)
+                  for key, value in self.tags.iteritems()]
+        if tags_q:
+            # Find the resources that have any of the tags with a single query.
+            query = me.Q(owner=self._instance.owner, resource_type=rtype)
+            query &= reduce(lambda q1, q2: q1 | q2, tags_q)
+            ids = set(tag['resource']['_ref'].id
+                      for tag in Tag.objects(query).only(
+                          'resource').as_pymongo())
         return me.Q(id__in=ids)
 
     def validate(self, clean=True):
@@ -908,6 +908,94 @@ ENABLE_AB = False
 ENABLE_MONITORING = False
 MACHINE_PATCHES = True
 
+# Max number of concurrent provider API calls of the poller, per process.
+POLLER_CONCURRENCY = 200
+# Max number of clouds whose polled results are stored at once, per process.
+POLLER_SYNC_CONCURRENCY = 8
+# Max number of concurrent poller API calls per provider, per process.
+POLLER_PROVIDER_CONCURRENCY = {
+    'default': 50,
+}
+# Seconds after which a socket operation of a poller API call fails, so that
+# calls to unresponsive providers don't hold their thread forever.
+POLLER_SOCKET_TIMEOUT = 60
+# Max number of clouds polled by a single list_machines_batch task.
+POLLER_BATCH_SIZE = 100
+# Max number of machines pinged by a single ping_probe_batch task.
+POLLER_PING_BATCH_SIZE = 200
+
+# Max number of idle AMQP connections kept open for publishing, per process.
+AMQP_POOL_SIZE = 8
+# Seconds to cache whether an owner has any sessions listening for updates.
+AMQP_LISTENING_CACHE_TTL = 3
+# Seconds to remember exchanges declared over a pooled AMQP connection,
+# instead of declaring them before every publish.
+AMQP_EXCHANGE_CACHE_TTL = 3
+
+# Store and publish logged events in the background, in batches. If False,
+# events are written synchronously by log_event, eg. in tests.
+LOG_EVENT_ASYNC = True
+# Max number of events buffered per process.
+LOG_EVENT_QUEUE_SIZE = 10000
+# Max seconds to buffer events for, and max number of events per batch.
+LOG_EVENT_FLUSH_INTERVAL = 1
+LOG_EVENT_FLUSH_SIZE = 500
+# What to do when the buffer is full: 'sync' to write the event directly,
+# 'block' to wait until there's room in the buffer or 'drop' to discard it.
+LOG_EVENT_BACKPRESSURE = 'sync'
+
+# Min seconds between writes of a session's last access time to the database.
+SESSION_TOUCH_GRANULARITY = 60
+
+# Cache valid auth tokens, along with their users and org, in each process.
+AUTH_CACHE_ENABLED = True
+# Max seconds to cache a token for, and max number of cached tokens.
+AUTH_CACHE_TTL = 30
+AUTH_CACHE_SIZE = 10000
+
+# Number of threads running blocking calls of sockjs connections, per process.
+SOCKJS_EXECUTOR_THREADS = 16
+
+# Max number of section snapshots kept per process, used to send JSON patches
+# to websocket clients reconnecting with older versions of their sections.
+SOCKJS_SECTION_SNAPSHOTS = 2000
+
+# Seconds within which session update sections are coalesced, 0 to disable.
+SOCKJS_UPDATE_COALESCE_WINDOW = 0.5
+
+# Websocket messages larger than this many bytes are compressed with zlib, for
+# clients supporting it.
+SOCKJS_COMPRESSION_THRESHOLD = 4096
+SOCKJS_COMPRESSION_LEVEL = 6
+
+# Min length of lists of objects encoded as rows of values, for clients
+# supporting compact encoding.
+SOCKJS_COMPACT_MIN_ROWS = 20
+
+# Seconds between logging stats of websocket bytes sent and saved per message
+# type, 0 to disable.
+SOCKJS_MESSAGE_STATS_INTERVAL = 0
+
+# Seconds a refresh of a cached user task result is considered in flight, so
+# that concurrent stale reads don't schedule it again.
+USER_TASK_LEASE_TIME = 60
+
+# Publish a single machines_inventory message per cloud poll, only when the
+# machines or their costs changed, instead of one message per machine.
+MACHINES_INVENTORY_BATCHED = True
+# Seconds between full machines_inventory snapshots of each cloud, which are
+# published even if nothing changed, 0 to only publish changes.
+MACHINES_INVENTORY_SNAPSHOT_INTERVAL = 3600
+
+# Max number of idle, authenticated libcloud drivers kept per process for
+# reuse, 0 to disable, and seconds after which idle drivers are closed.
+CLOUD_DRIVER_POOL_SIZE = 100
+CLOUD_DRIVER_POOL_MAX_IDLE = 300
+
+# Seconds for which the nodes listed for a cloud are reused to look up the
+# nodes of machine actions, 0 to always list them again.
+MACHINE_NODE_LISTING_TTL = 10
+
 ## DO NOT PUT ANYTHING BELOW HERE UNLESS YOU KNOW WHAT YOU ARE DOING
 
 # Get settings from mist.core.
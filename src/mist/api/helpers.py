@@ -16,6 +16,7 @@ import re
 import sys
 import uuid
 import json
+import bisect
 import string
 import random
 import socket
@@ -24,8 +25,10 @@ import smtplib
 import logging
 import datetime
 import tempfile
+import threading
 import traceback
 import functools
+import jsonpatch
 import jsonpickle
 
 from time import time, strftime, sleep
@@ -55,6 +58,8 @@ from Crypto.Random import get_random_bytes
 from amqp import Message
 from amqp.connection import Connection
 from amqp.exceptions import NotFound as AmqpNotFound
+from amqp.exceptions import ChannelError as AmqpChannelError
+from amqp.exceptions import ConnectionError as AmqpConnectionError
 
 from distutils.version import LooseVersion
 
@@ -246,21 +251,149 @@ def dirty_cow(os, os_version, kernel_version):
         return False
 
 
+class AmqpPool(object):
+    """Process-wide pool of long-lived AMQP connections
+
+    Each item of the pool is a connection along with an open channel, which
+    is checked out by a single caller at a time. Connections inherited from
+    a parent process are never used, since the pool is reset after forking.
+    Connections that fail are discarded, and the failed operation is retried
+    once over a new connection. Exchanges declared over each connection are
+    remembered for a few seconds, see `exchange_declare`.
+
+    """
+
+    def __init__(self, size=None):
+        self.size = size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._items = []
+        # Map of connection to map of exchange to expiration timestamp.
+        self._declared = {}
+
+    def _checkout(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._items = []
+                self._declared = {}
+            if self._items:
+                return self._items.pop()
+        connection = Connection(config.AMQP_URI)
+        return connection, connection.channel()
+
+    def _checkin(self, item):
+        with self._lock:
+            if self._pid == os.getpid() and (
+                    len(self._items) < (self.size or config.AMQP_POOL_SIZE)):
+                self._items.append(item)
+                return
+        self._discard(item)
+
+    def _discard(self, item):
+        self._declared.pop(item[0], None)
+        try:
+            item[0].close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def channel(self):
+        """Check out a channel, returning it to the pool once done"""
+        item = self._checkout()
+        try:
+            yield item[1]
+        except AmqpChannelError:
+            # The channel is reopened automatically after channel errors. The
+            # error may be caused by an earlier publish to an exchange that
+            # has since been deleted, so declare exchanges again.
+            self._declared.pop(item[0], None)
+            self._checkin(item)
+            raise
+        except BaseException:
+            self._discard(item)
+            raise
+        self._checkin(item)
+
+    def exchange_declare(self, channel, exchange, ex_type='fanout',
+                         passive=False, auto_delete=True):
+        """Declare exchange over a pooled channel, unless recently declared
+
+        Declared exchanges are remembered per connection for
+        AMQP_EXCHANGE_CACHE_TTL seconds. Publishing to an exchange that has
+        been deleted meanwhile, eg. an auto deleted owner exchange, closes the
+        channel without raising. That raises a channel error on the next
+        synchronous call over the channel, which clears the connection's
+        declared exchanges.
+
+        """
+        declared = self._declared.setdefault(channel.connection, {})
+        now = time()
+        if declared.get(exchange, 0) > now:
+            return
+        channel.exchange_declare(exchange=exchange, type=ex_type,
+                                 passive=passive, auto_delete=auto_delete)
+        if len(declared) > 10000:
+            declared.clear()
+        declared[exchange] = now + config.AMQP_EXCHANGE_CACHE_TTL
+
+    def run(self, func):
+        """Call func with a pooled channel, retrying on connection errors"""
+        try:
+            with self.channel() as channel:
+                return func(channel)
+        except (IOError, AmqpConnectionError) as exc:
+            log.warning("AMQP connection failed, reconnecting: %r", exc)
+        with self.channel() as channel:
+            return func(channel)
+
+
+amqp_pool = AmqpPool()
+
+
 def amqp_publish(exchange, routing_key, data,
                  ex_type='fanout', ex_declare=False, auto_delete=True,
                  connection=None):
-    close = False
-    if connection is None:
-        connection = Connection(config.AMQP_URI)
-        close = True
-    channel = connection.channel()
-    if ex_declare:
-        channel.exchange_declare(exchange=exchange, type=ex_type, auto_delete=auto_delete)
     msg = Message(json.dumps(data))
-    channel.basic_publish(msg, exchange=exchange, routing_key=routing_key)
-    channel.close()
-    if close:
-        connection.close()
+    if connection is not None:
+        channel = connection.channel()
+        if ex_declare:
+            channel.exchange_declare(exchange=exchange, type=ex_type,
+                                     auto_delete=auto_delete)
+        channel.basic_publish(msg, exchange=exchange, routing_key=routing_key)
+        channel.close()
+        return
+
+    def publish(channel):
+        # Publishing to a missing exchange closes the channel without
+        # raising, so make sure it exists first, which raises NotFound.
+        amqp_pool.exchange_declare(channel, exchange, ex_type=ex_type,
+                                   passive=not ex_declare,
+                                   auto_delete=auto_delete)
+        channel.basic_publish(msg, exchange=exchange, routing_key=routing_key)
+
+    amqp_pool.run(publish)
+
+
+def amqp_publish_many(exchange, messages, ex_type='fanout', ex_declare=False,
+                      auto_delete=True):
+    """Publish many messages to exchange over a single pooled channel
+
+    `messages` is a list of (routing_key, data) tuples.
+    """
+    msgs = [(routing_key, Message(json.dumps(data)))
+            for routing_key, data in messages]
+
+    def publish(channel):
+        amqp_pool.exchange_declare(channel, exchange, ex_type=ex_type,
+                                   passive=not ex_declare,
+                                   auto_delete=auto_delete)
+        for routing_key, msg in msgs:
+            channel.basic_publish(msg, exchange=exchange,
+                                  routing_key=routing_key)
+
+    if msgs:
+        amqp_pool.run(publish)
 
 
 def amqp_subscribe(exchange, callback, queue='',
@@ -323,19 +456,39 @@ def amqp_subscribe_user(owner, queue, callback):
     amqp_subscribe(_amqp_owner_exchange(owner), callback, queue)
 
 
+# Map of owner id to tuple of (expiration timestamp, listening).
+_amqp_owner_listening_cache = {}
+
+
 def amqp_owner_listening(owner):
-    connection = Connection(config.AMQP_URI)
-    channel = connection.channel()
-    try:
-        channel.exchange_declare(exchange=_amqp_owner_exchange(owner),
-                                 type='fanout', passive=True)
-    except AmqpNotFound:
-        return False
+    """Check whether any session of owner is listening for updates
+
+    Results are cached for AMQP_LISTENING_CACHE_TTL seconds.
+    """
+    if isinstance(owner, mist.api.users.models.Owner):
+        owner_id = owner.id
     else:
+        owner_id = owner
+    now = time()
+    cached = _amqp_owner_listening_cache.get(owner_id)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    def check(channel):
+        try:
+            channel.exchange_declare(exchange=_amqp_owner_exchange(owner),
+                                     type='fanout', passive=True)
+        except AmqpNotFound:
+            return False
         return True
-    finally:
-        channel.close()
-        connection.close()
+
+    listening = amqp_pool.run(check)
+    if len(_amqp_owner_listening_cache) > 10000:
+        _amqp_owner_listening_cache.clear()
+    _amqp_owner_listening_cache[owner_id] = (
+        now + config.AMQP_LISTENING_CACHE_TTL, listening
+    )
+    return listening
 
 
 def trigger_session_update(owner, sections=['clouds', 'keys', 'monitoring',
@@ -345,6 +498,27 @@ def trigger_session_update(owner, sections=['clouds', 'keys', 'monitoring',
     amqp_publish_user(owner, routing_key='update', data=sections)
 
 
+def unpack_machines_inventory(data):
+    """Return the per machine messages of a machines_inventory message
+
+    Inventory messages used to be published per machine, after every poll, as
+    `{'owner_id': ..., 'machine_id': ..., 'cost_per_month': ...}`. They are
+    now published per cloud, only when changed, listing the ids and costs of
+    all machines of the cloud in `machine_ids` and `costs_per_month`.
+    Consumers may use this to handle both formats as a list of the former.
+    Machines missing from a cloud's message no longer exist.
+
+    """
+    if 'machine_ids' not in data:
+        return [data]
+    return [{'owner_id': data['owner_id'],
+             'cloud_id': data['cloud_id'],
+             'machine_id': machine_id,
+             'cost_per_month': cost}
+            for machine_id, cost in zip(data['machine_ids'],
+                                        data['costs_per_month'])]
+
+
 def amqp_log(msg):
     return
     msg = "[%s] %s" % (strftime("%Y-%m-%d %H:%M:%S %Z"), msg)
@@ -519,16 +693,50 @@ def transform_key_machine_associations(machines, key):
     key_associations = []
     for machine in machines:
         for key_assoc in machine.key_associations:
-            if key_assoc.keypair == key:
-                key_associations.append([machine.cloud.id,
-                                        machine.machine_id,
-                                        key_assoc.last_used,
-                                        key_assoc.ssh_user,
-                                        key_assoc.sudo,
-                                        key_assoc.port])
+            # Compare ids of referenced documents to avoid dereferencing.
+            keypair = key_assoc._data.get('keypair')
+            if keypair is None or keypair.id != key.id:
+                continue
+            key_associations.append([machine._data['cloud'].id,
+                                     machine.machine_id,
+                                     key_assoc.last_used,
+                                     key_assoc.ssh_user,
+                                     key_assoc.sudo,
+                                     key_assoc.port])
     return key_associations
 
 
+def make_patch_by_key(old, new):
+    """Return a JSON patch from dict `old` to dict `new` of documents
+
+    This is equivalent to `jsonpatch.JsonPatch.from_diff(old, new).patch`
+    for dicts mapping keys to JSON documents, e.g. machines by id. Instead of
+    diffing the whole structure, which gets slow and memory hungry for
+    thousands of large documents, documents are compared by key and only the
+    ones that differ are diffed structurally. Patch paths are prefixed by
+    the documents' keys, as `jsonpatch` does.
+
+    """
+    def escape(key):
+        return key.replace('~', '~0').replace('/', '~1')
+
+    patch = []
+    for key in old:
+        if key not in new:
+            patch.append({'op': 'remove', 'path': '/' + escape(key)})
+    for key, value in new.iteritems():
+        prefix = '/' + escape(key)
+        if key not in old:
+            patch.append({'op': 'add', 'path': prefix, 'value': value})
+        elif old[key] != value:
+            for op in jsonpatch.make_patch(old[key], value).patch:
+                op['path'] = prefix + op['path']
+                if 'from' in op:
+                    op['from'] = prefix + op['from']
+                patch.append(op)
+    return patch
+
+
 def get_datetime(timestamp):
     """Parse several representations of time into a datetime object"""
     if isinstance(timestamp, datetime.datetime):
@@ -597,6 +805,55 @@ def ip_from_request(request):
             '0.0.0.0')
 
 
+class IPWhitelist(object):
+    """A precompiled list of CIDRs, for fast checks of whether an IP matches
+
+    The CIDRs are merged into sorted, non-overlapping ranges of integers per
+    IP version, so that an IP is checked with a binary search.
+
+    """
+
+    def __init__(self, cidrs):
+        ranges = {4: [], 6: []}
+        for cidr in cidrs:
+            net = netaddr.IPNetwork(cidr)
+            ranges[net.version].append((net.first, net.last))
+        self._starts, self._ends = {}, {}
+        for version, version_ranges in ranges.iteritems():
+            merged = []
+            for first, last in sorted(version_ranges):
+                if merged and first <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], last)
+                else:
+                    merged.append([first, last])
+            self._starts[version] = [first for first, _ in merged]
+            self._ends[version] = [last for _, last in merged]
+
+    def __contains__(self, ip):
+        ip = netaddr.IPAddress(ip)
+        value = int(ip)
+        index = bisect.bisect_right(self._starts[ip.version], value) - 1
+        return index >= 0 and value <= self._ends[ip.version][index]
+
+
+# Map of tuples of CIDRs to the respective precompiled IPWhitelist.
+_ip_whitelists = {}
+
+
+def get_ip_whitelist(cidrs):
+    """Return a precompiled IPWhitelist of the given CIDRs
+
+    Whitelists are cached in memory, so that each one is only compiled once.
+    """
+    key = tuple(cidrs)
+    whitelist = _ip_whitelists.get(key)
+    if whitelist is None:
+        if len(_ip_whitelists) > 1000:
+            _ip_whitelists.clear()
+        whitelist = _ip_whitelists[key] = IPWhitelist(key)
+    return whitelist
+
+
 def send_email(subject, body, recipients, sender=None, bcc=None, attempts=3):
     """Send email.
 
@@ -0,0 +1,245 @@
+"""Ping many hosts at once from a single process
+
+Instead of spawning a `ping` subprocess per host, `BatchPinger` sends ICMP
+echo requests to all hosts from one socket per address family and collects
+the replies with a select loop. Unprivileged ICMP datagram sockets are used
+when the kernel allows it (see `net.ipv4.ping_group_range`), otherwise raw
+sockets, which require root.
+
+The statistics of each host are returned in the same format as the one
+produced by `pingparsing` for the output of `ping`.
+
+"""
+
+import os
+import time
+import errno
+import select
+import socket
+import struct
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMP6_ECHO_REQUEST = 128
+ICMP6_ECHO_REPLY = 129
+
+IPPROTO_ICMPV6 = getattr(socket, 'IPPROTO_ICMPV6', 58)
+
+
+def checksum(data):
+    """Compute the internet checksum of data (RFC 1071)"""
+    if len(data) % 2:
+        data += '\0'
+    total = sum(struct.unpack('!%dH' % (len(data) / 2), data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def open_socket(family):
+    """Open a non-blocking ICMP socket for the given address family
+
+    An unprivileged datagram socket is preferred, falling back to a raw
+    socket. Raises `socket.error` if neither can be opened.
+
+    """
+    proto = socket.IPPROTO_ICMP if family == socket.AF_INET else IPPROTO_ICMPV6
+    error = None
+    for sock_type in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+        try:
+            sock = socket.socket(family, sock_type, proto)
+        except socket.error as exc:
+            error = exc
+            continue
+        sock.setblocking(0)
+        return sock
+    raise error
+
+
+def resolve(host):
+    """Return (family, address) of host, or (None, None) if unresolvable"""
+    try:
+        info = socket.getaddrinfo(host, None, 0, socket.SOCK_DGRAM)
+    except socket.error as exc:
+        log.warning("Can't resolve %s: %r", host, exc)
+        return None, None
+    for family, _, _, _, sockaddr in info:
+        if family in (socket.AF_INET, socket.AF_INET6):
+            return family, sockaddr[0].split('%')[0]
+    return None, None
+
+
+class BatchPinger(object):
+    """Ping many hosts concurrently
+
+    Params:
+    pkts:       Number of echo requests to send to each host.
+    interval:   Seconds to wait between successive echo requests to a host.
+    timeout:    Seconds to wait for replies after the last echo request.
+
+    """
+
+    def __init__(self, pkts=10, interval=0.4, timeout=1):
+        self.pkts = pkts
+        self.interval = interval
+        self.timeout = timeout
+
+    def ping(self, hosts):
+        """Ping all hosts and return a dict of statistics per host
+
+        Raises `socket.error` if an ICMP socket can't be opened for the
+        address family of any of the hosts.
+
+        """
+        hosts = set(hosts)
+        targets = {}  # address -> list of hosts resolving to it
+        families = {}  # address -> address family
+        for host in hosts:
+            family, addr = resolve(host)
+            if addr is not None:
+                targets.setdefault(addr, []).append(host)
+                families[addr] = family
+
+        sockets = {}
+        try:
+            for family in set(families.values()):
+                sockets[family] = open_socket(family)
+            stats = self._run(sockets, families)
+        finally:
+            for sock in sockets.values():
+                sock.close()
+
+        results = {host: self._summarize(None) for host in hosts}
+        for addr, addr_hosts in targets.iteritems():
+            for host in addr_hosts:
+                results[host] = self._summarize(stats[addr])
+        return results
+
+    def _run(self, sockets, families):
+        """Send echo requests to all addresses and collect the replies"""
+        ident = os.getpid() & 0xFFFF
+        # Random cookie in the payload of requests to identify the replies.
+        cookie = os.urandom(8)
+        payload = cookie + '\0' * 48
+        stats = {addr: {'tx': 0, 'rtts': [], 'dup': 0} for addr in families}
+        sent = {}  # (address, seq) -> time sent
+        received = set()
+
+        start = time.time()
+        for seq in xrange(self.pkts):
+            send_at = start + seq * self.interval
+            self._receive(sockets, send_at, cookie, stats, sent, received)
+            for addr, family in families.iteritems():
+                if family == socket.AF_INET:
+                    icmp_type = ICMP_ECHO_REQUEST
+                else:
+                    icmp_type = ICMP6_ECHO_REQUEST
+                header = struct.pack('!BBHHH', icmp_type, 0, 0, ident, seq)
+                csum = checksum(header + payload)
+                packet = struct.pack('!BBHHH', icmp_type, 0, csum,
+                                     ident, seq) + payload
+                stats[addr]['tx'] += 1
+                try:
+                    sockets[family].sendto(packet, (addr, 0))
+                except socket.error as exc:
+                    log.debug("Error sending echo request to %s: %r",
+                              addr, exc)
+                    continue
+                sent[(addr, seq)] = time.time()
+        deadline = time.time() + self.timeout
+        while len(received) < len(sent) and time.time() < deadline:
+            self._receive(sockets, deadline, cookie, stats, sent, received)
+        return stats
+
+    def _receive(self, sockets, until, cookie, stats, sent, received):
+        """Process echo replies until the given time"""
+        by_fd = {sock.fileno(): (family, sock)
+                 for family, sock in sockets.iteritems()}
+        while True:
+            wait = until - time.time()
+            if wait <= 0:
+                return
+            try:
+                readable, _, _ = select.select(by_fd.keys(), [], [], wait)
+            except select.error as exc:
+                if exc.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd in readable:
+                family, sock = by_fd[fd]
+                self._read(family, sock, cookie, stats, sent, received)
+
+    def _read(self, family, sock, cookie, stats, sent, received):
+        """Read all pending packets of sock and record echo replies"""
+        while True:
+            try:
+                data, sockaddr = sock.recvfrom(4096)
+            except socket.error as exc:
+                if exc.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK,
+                                   errno.EINTR):
+                    return
+                raise
+            now = time.time()
+            if (family == socket.AF_INET and
+                    sock.type == socket.SOCK_RAW and data):
+                # Raw IPv4 sockets also return the IP header.
+                data = data[(ord(data[0]) & 0x0F) * 4:]
+            if len(data) < 8 + len(cookie):
+                continue
+            icmp_type, _, _, _, seq = struct.unpack('!BBHHH', data[:8])
+            if icmp_type not in (ICMP_ECHO_REPLY, ICMP6_ECHO_REPLY):
+                continue
+            if data[8:8 + len(cookie)] != cookie:
+                continue  # Reply to some other process
+            key = (sockaddr[0].split('%')[0], seq)
+            if key not in sent:
+                continue
+            if key in received:
+                stats[key[0]]['dup'] += 1
+                continue
+            received.add(key)
+            stats[key[0]]['rtts'].append((now - sent[key]) * 1000)
+
+    def _summarize(self, stats):
+        """Return statistics in the format produced by pingparsing"""
+        result = {
+            'packet_transmit': None,
+            'packet_receive': None,
+            'packet_loss_rate': None,
+            'packet_duplicate_rate': None,
+            'rtt_min': None,
+            'rtt_avg': None,
+            'rtt_max': None,
+            'rtt_mdev': None,
+        }
+        if stats is None:
+            return result
+        rtts = stats['rtts']
+        result['packet_transmit'] = stats['tx']
+        result['packet_receive'] = len(rtts)
+        if stats['tx']:
+            result['packet_loss_rate'] = (
+                100.0 * (stats['tx'] - len(rtts)) / stats['tx']
+            )
+        if rtts:
+            avg = sum(rtts) / len(rtts)
+            mdev = (sum(rtt ** 2 for rtt in rtts) / len(rtts) - avg ** 2)
+            result.update({
+                'packet_duplicate_rate': 100.0 * stats['dup'] / len(rtts),
+                'rtt_min': round(min(rtts), 3),
+                'rtt_avg': round(avg, 3),
+                'rtt_max': round(max(rtts), 3),
+                'rtt_mdev': round(max(mdev, 0) ** 0.5, 3),
+            })
+        return result
+
+
+def ping_hosts(hosts, pkts=10, interval=0.4, timeout=1):
+    """Ping all hosts at once, return a dict of statistics per host"""
+    return BatchPinger(pkts=pkts, interval=interval,
+                       timeout=timeout).ping(hosts)
@@ -4,7 +4,7 @@ from mist.api.keys.models import Key
 from mist.api.clouds.models import Cloud
 from mist.api.machines.models import Machine
 
-from mist.api.tag.methods import get_tags_for_resource
+from mist.api.tag.methods import get_tags_for_resources
 
 from mist.api.helpers import trigger_session_update
 from mist.api.helpers import transform_key_machine_associations
@@ -46,20 +46,22 @@ def list_keys(owner):
     :param owner:
     :return:
     """
-    keys = Key.objects(owner=owner, deleted=None)
+    keys = list(Key.objects(owner=owner, deleted=None))
     clouds = Cloud.objects(owner=owner, deleted=None)
+    # Fetch machines and tags of all keys at once, instead of once per key.
+    machines = list(Machine.objects(cloud__in=clouds,
+                                    key_associations__keypair__in=keys))
+    tags = get_tags_for_resources(owner, keys)
     key_objects = []
     # FIXME: This must be taken care of in Keys.as_dict
     for key in keys:
         key_object = {}
-        machines = Machine.objects(cloud__in=clouds,
-                                   key_associations__keypair__exact=key)
         key_object["id"] = key.id
         key_object['name'] = key.name
         key_object["isDefault"] = key.default
         key_object["machines"] = transform_key_machine_associations(machines,
                                                                     key)
-        key_object['tags'] = get_tags_for_resource(owner, key)
+        key_object['tags'] = tags[key.id]
         key_objects.append(key_object)
     return key_objects
 
@@ -2,14 +2,10 @@ import uuid
 import json
 import time
 import logging
+import datetime
 import elasticsearch.exceptions as eexc
 
-from pymongo import MongoClient
-
-from mist.api import config
-
 from mist.api.helpers import es_client as es
-from mist.api.helpers import amqp_publish
 
 from mist.api.exceptions import NotFoundError
 from mist.api.exceptions import BadRequestError
@@ -20,6 +16,9 @@ from mist.api.users.models import User
 from mist.api.logs.helpers import _filtered_query
 from mist.api.logs.helpers import _on_response_callback
 
+from mist.api.logs.sink import sink
+from mist.api.logs.models import OpenIncident
+
 from mist.api.logs.constants import FIELDS, JOBS
 from mist.api.logs.constants import EXCLUDED_BUCKETS, TYPES
 from mist.api.logs.constants import STARTS_STORY, CLOSES_STORY, CLOSES_INCIDENT
@@ -42,8 +41,9 @@ def log_event(owner_id, event_type, action, error=None, **kwargs):
     Log a new event comprised of the arguments provided.
 
     Once the new event has been prepared, additional processing is applied
-    in order to associate any relevant stories, and, finally, it is pushed
-    to RabbitMQ.
+    in order to associate any relevant stories, and, finally, it is handed
+    over to the event sink, which stores it and pushes it to RabbitMQ in the
+    background, along with other events.
 
     Arguments:
         - owner_id: the current Owner's ID.
@@ -76,7 +76,8 @@ def log_event(owner_id, event_type, action, error=None, **kwargs):
             event['story_id'] = kwargs.pop('story_id')
         if 'user_id' in event:
             try:
-                event['email'] = User.objects.get(id=event['user_id']).email
+                event['email'] = User.objects.only('email').get(
+                    id=event['user_id']).email
             except User.DoesNotExist:
                 log.error('User %s does not exist', event['user_id'])
 
@@ -101,6 +102,12 @@ def log_event(owner_id, event_type, action, error=None, **kwargs):
                 except Exception as exc:
                     log.error('Event %s failed to close open incidents: %s',
                               event['log_id'], exc)
+        # Keep the index of open incidents up to date.
+        try:
+            update_open_incidents(event)
+        except Exception as exc:
+            log.error('Event %s failed to update open incidents: %s',
+                      event['log_id'], exc)
         # Cross populate session-log data.
         try:
             cross_populate_session_data(event, kwargs)
@@ -109,20 +116,13 @@ def log_event(owner_id, event_type, action, error=None, **kwargs):
     except Exception as exc:
         log.error('Failed to log event %s: %s', event, exc)
     else:
-        # FIXME: Deprecate
-        conn = MongoClient(config.MONGO_URI)
-        coll = conn['mist'].logging
-        coll.save(event.copy())
-        conn.close()
-
         # Construct RabbitMQ routing key.
         keys = [str(owner_id), str(event_type), str(action)]
         keys.append('true' if error else 'false')
         routing_key = '.'.join(map(str.lower, keys))
 
-        # Broadcast event to RabbitMQ's "events" exchange.
-        amqp_publish('events', routing_key, event,
-                     ex_type='topic', ex_declare=True, auto_delete=False)
+        # Store event and broadcast it to RabbitMQ's "events" exchange.
+        sink.put(event.copy(), routing_key)
 
         event.pop('extra')
         event.update(kwargs)
@@ -546,19 +546,35 @@ def close_open_incidents(event):
         return
     if 'stories' not in event:
         event['stories'] = []
-    kwargs = {
-        'owner_id': event['owner_id'],
-        'story_type': 'incident', 'pending': True,
-    }
+    kwargs = {'owner_id': event['owner_id']}
     for key in ('rule_id', 'cloud_id', 'machine_id'):
         if key in event:
             kwargs[key] = event[key]
-    incidents = get_stories(**kwargs)
-    for inc in incidents:
-        event['stories'].append(('closes', 'incident', inc['story_id']))
+    # Look up the index of open incidents, rather than Elasticsearch.
+    incidents = list(OpenIncident.objects(**kwargs).scalar('incident_id'))
+    for incident_id in incidents:
+        event['stories'].append(('closes', 'incident', incident_id))
     log.warn('%s incident(s) closed by %s', len(incidents), event['log_id'])
 
 
+def update_open_incidents(event):
+    """Update the index of open incidents based on the event provided."""
+    for action, story_type, story_id in event.get('stories', []):
+        if story_type != 'incident':
+            continue
+        if action == 'opens':
+            OpenIncident.objects(incident_id=story_id).update_one(
+                upsert=True,
+                set__owner_id=event['owner_id'],
+                set__rule_id=event.get('rule_id'),
+                set__cloud_id=event.get('cloud_id'),
+                set__machine_id=event.get('machine_id'),
+                set_on_insert__opened_at=datetime.datetime.utcnow(),
+            )
+        elif action == 'closes':
+            OpenIncident.objects(incident_id=story_id).delete()
+
+
 def get_story(owner_id, story_id, story_type=None, expand=True):
     """Fetch a single story given its story_id."""
     assert story_id
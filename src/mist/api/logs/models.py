@@ -0,0 +1,34 @@
+import datetime
+
+import mongoengine as me
+
+
+class OpenIncident(me.Document):
+    """An index of the incidents that are currently open
+
+    Incidents are stories stored in Elasticsearch. This collection mirrors
+    the incidents that are still open, so that the incidents closed by an
+    event can be found with an indexed lookup, instead of querying
+    Elasticsearch when logging the event. It's updated by `log_event` as
+    events that open or close incidents are logged.
+
+    """
+
+    incident_id = me.StringField(primary_key=True)
+    owner_id = me.StringField(required=True)
+    rule_id = me.StringField()
+    cloud_id = me.StringField()
+    machine_id = me.StringField()
+    opened_at = me.DateTimeField(default=datetime.datetime.utcnow)
+
+    meta = {
+        'collection': 'open_incidents',
+        'indexes': [
+            ('owner_id', 'rule_id'),
+            ('owner_id', 'cloud_id'),
+            ('owner_id', 'machine_id'),
+        ],
+    }
+
+    def __str__(self):
+        return 'OpenIncident %s of %s' % (self.incident_id, self.owner_id)
@@ -0,0 +1,231 @@
+"""Asynchronous, batched storage of logged events
+
+Rather than having each `log_event` call store the event in mongo and
+publish it to RabbitMQ on its own, events are put in a bounded in-process
+queue. A background thread writes them in batches, using a single
+`insert_many` and publishing all of them over a single pooled AMQP channel.
+
+Events are written synchronously if `LOG_EVENT_ASYNC` is False, which is
+useful in tests. What happens when the queue is full is controlled by the
+`LOG_EVENT_BACKPRESSURE` setting. Queued events are flushed when the process
+exits, including celery pool processes and recycled uwsgi workers.
+
+"""
+
+import os
+import time
+import Queue
+import atexit
+import logging
+import threading
+
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError, ConnectionFailure
+
+from mist.api import config
+
+from mist.api.helpers import amqp_publish_many
+
+
+log = logging.getLogger(__name__)
+
+
+class EventSink(object):
+    """Buffer logged events and write them in batches"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._client = None
+        self._client_pid = None
+
+    def _get_queue(self):
+        """Return the queue, starting the flusher thread after forking"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = Queue.Queue(maxsize=config.LOG_EVENT_QUEUE_SIZE)
+                thread = threading.Thread(target=self._run, name='EventSink',
+                                          args=(self._queue, ))
+                thread.daemon = True
+                thread.start()
+            return self._queue
+
+    def _get_collection(self):
+        if self._client_pid != os.getpid():
+            self._client_pid = os.getpid()
+            self._client = MongoClient(config.MONGO_URI)
+        # FIXME: Deprecate
+        return self._client['mist'].logging
+
+    def put(self, event, routing_key):
+        """Store event and publish it to the events exchange"""
+        if not config.LOG_EVENT_ASYNC:
+            return self.write([(event, routing_key)])
+        queue = self._get_queue()
+        try:
+            queue.put_nowait((event, routing_key))
+        except Queue.Full:
+            if config.LOG_EVENT_BACKPRESSURE == 'block':
+                queue.put((event, routing_key))
+            elif config.LOG_EVENT_BACKPRESSURE == 'drop':
+                log.warning("Event queue is full, dropping event %s",
+                            event['log_id'])
+            else:
+                self.write([(event, routing_key)])
+
+    def write(self, items):
+        """Write a list of (event, routing_key) tuples synchronously
+
+        Events are stored with a single `insert_many` and the ones stored are
+        published at once. Events that fail to be stored are logged and left
+        out, so that a bad event doesn't cause the rest of the batch to be
+        lost.
+
+        """
+        if not items:
+            return
+        collection = self._get_collection()
+        try:
+            # Copy events, since pymongo adds an `_id` to inserted documents.
+            collection.insert_many([event.copy() for event, _ in items],
+                                   ordered=False)
+        except BulkWriteError as exc:
+            failed = set(error['index']
+                         for error in exc.details.get('writeErrors', []))
+            log.error("Failed to store %d/%d events: %s", len(failed),
+                      len(items), exc.details.get('writeErrors', [])[:1])
+            items = [item for index, item in enumerate(items)
+                     if index not in failed]
+        except ConnectionFailure:
+            raise
+        except Exception as exc:
+            # The batch couldn't be encoded, write each event on its own.
+            log.error("Failed to store %d events at once, will store them "
+                      "one by one: %r", len(items), exc)
+            for item in items:
+                try:
+                    self._write_one(collection, item)
+                except ConnectionFailure:
+                    raise
+                except Exception as exc:
+                    log.error("Failed to write event %s: %r",
+                              item[0].get('log_id'), exc)
+            return
+        self._publish(items)
+
+    def _write_one(self, collection, item):
+        collection.insert_one(item[0].copy())
+        self._publish([item])
+
+    def _publish(self, items):
+        """Broadcast events to RabbitMQ's "events" exchange"""
+        if not items:
+            return
+        amqp_publish_many('events', [(routing_key, event)
+                                     for event, routing_key in items],
+                          ex_type='topic', ex_declare=True, auto_delete=False)
+
+    def flush(self, timeout=10):
+        """Write all queued events of this process before returning
+
+        The flusher thread is asked to write everything queued so far,
+        including any batch it's currently writing. If it doesn't finish in
+        `timeout` seconds, the events still queued are written synchronously.
+
+        """
+        if self._queue is None or self._pid != os.getpid():
+            return
+        request = FlushRequest()
+        try:
+            self._queue.put(request, timeout=timeout)
+        except Queue.Full:
+            pass
+        else:
+            if request.done.wait(timeout):
+                return
+            log.warning("Timed out waiting for events to be flushed")
+        items = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            if isinstance(item, FlushRequest):
+                item.done.set()
+            else:
+                items.append(item)
+        try:
+            self.write(items)
+        except Exception as exc:
+            log.error("Failed to write %d events: %r", len(items), exc)
+
+    def _run(self, queue):
+        """Write queued events in batches, forever"""
+        while True:
+            items = [queue.get()]
+            deadline = time.time() + config.LOG_EVENT_FLUSH_INTERVAL
+            while len(items) < config.LOG_EVENT_FLUSH_SIZE:
+                # Write right away if a flush was requested.
+                if isinstance(items[-1], FlushRequest):
+                    break
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(queue.get(timeout=timeout))
+                except Queue.Empty:
+                    break
+            events = [item for item in items
+                      if not isinstance(item, FlushRequest)]
+            try:
+                self.write(events)
+            except Exception as exc:
+                log.error("Failed to write %d events: %r", len(events), exc)
+            for item in items:
+                if isinstance(item, FlushRequest):
+                    item.done.set()
+
+
+class FlushRequest(object):
+    """Queued by `EventSink.flush`, set once preceding events are written"""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+# Sink shared by all log_event calls of the same process.
+sink = EventSink()
+
+
+def flush_sink(*args, **kwargs):
+    """Flush the sink, accepting any arguments, for use as a signal handler"""
+    sink.flush()
+
+
+# Flush on every way a process may exit. Celery pool processes and uwsgi
+# workers recycled by `max-requests` exit without running `atexit` hooks.
+atexit.register(flush_sink)
+
+try:
+    from celery.signals import worker_process_shutdown, worker_shutdown
+except ImportError:
+    pass
+else:
+    worker_process_shutdown.connect(flush_sink, weak=False)
+    worker_shutdown.connect(flush_sink, weak=False)
+
+try:
+    import uwsgi
+except ImportError:
+    pass
+else:
+    _uwsgi_atexit = getattr(uwsgi, 'atexit', None)
+
+    def _flush_sink_atexit():
+        flush_sink()
+        if _uwsgi_atexit is not None:
+            _uwsgi_atexit()
+
+    uwsgi.atexit = _flush_sink_atexit
@@ -71,7 +71,12 @@ class MachineController(object):
             return self.machine.private_ips[0]
         raise RuntimeError("Couldn't find machine host.")
 
-    def ping_probe(self, persist=True):
+    def ping_probe(self, persist=True, data=None):
+        """Ping machine and store the results
+
+        If `data` is given, it's used as the ping results instead of pinging
+        the machine, which allows pinging many machines at once.
+        """
 
         from mist.api.methods import ping
         from mist.api.machines.models import PingProbe
@@ -93,7 +98,8 @@ class MachineController(object):
         task_key = 'machine:ping_probe:%s' % self.machine.id
         task = PeriodicTaskInfo.get_or_add(task_key)
         with task.task_runner(persist=persist):
-            data = ping(self.machine.cloud.owner, self.get_host())
+            if data is None:
+                data = ping(self.machine.cloud.owner, self.get_host())
 
         probe = PingProbe()
         probe.update_from_dict(data)
@@ -260,6 +260,20 @@ class Machine(me.Document):
     ssh_probe = me.EmbeddedDocumentField(SSHProbe, required=False)
     ping_probe = me.EmbeddedDocumentField(PingProbe, required=False)
 
+    # Hash of the fields below, as they were last updated by list_machines.
+    # Used to avoid rewriting machines that haven't changed since last poll.
+    # These are all the fields set by `_list_machines` and the
+    # `_list_machines__*` hooks of controllers, apart from `last_seen` and
+    # `missing_since`. Changes to any other field are always written.
+    POLLED_FIELDS = ('name', 'hostname', 'public_ips', 'private_ips',
+                     'actions', 'extra', 'cost', 'image_id', 'size', 'state',
+                     'machine_type', 'parent', 'created', 'os_type')
+    poll_hash = me.StringField()
+
+    # Denormalized copy of the machine's tags, kept in sync by the methods in
+    # `mist.api.tag.methods`. None if the tags haven't been cached yet.
+    cached_tags = me.ListField(me.DictField(), default=None)
+
     meta = {
         'collection': 'machines',
         'indexes': [
@@ -290,6 +304,12 @@ class Machine(me.Document):
         if not self.owner:
             self.owner = self.cloud.owner
         self.clean_os_type()
+        # Changes to polled fields saved outside of list_machines invalidate
+        # the poll hash, so that the next poll will rewrite them.
+        changed = set(field.split('.')[0]
+                      for field in self._get_changed_fields())
+        if changed & set(self.POLLED_FIELDS):
+            self.poll_hash = None
 
     def clean_os_type(self):
         """Clean self.os_type"""
@@ -309,17 +329,23 @@ class Machine(me.Document):
         except (AttributeError, me.DoesNotExist) as exc:
             log.error(exc)
 
-    def as_dict(self):
+    def as_dict(self, tags=None):
         # Return a dict as it will be returned to the API
 
         # tags as a list return for the ui
-        tags = {tag.key: tag.value for tag in mist.api.tag.models.Tag.objects(
-            owner=self.cloud.owner, resource=self
-        ).only('key', 'value')}
+        if tags is None and self.cached_tags is not None:
+            tags = self.cached_tags
+        elif tags is None:
+            tags = {tag.key: tag.value
+                    for tag in mist.api.tag.models.Tag.objects(
+                        owner=self.cloud.owner, resource=self
+                    ).only('key', 'value')}
         # Optimize tags data structure for js...
         if isinstance(tags, dict):
             tags = [{'key': key, 'value': value}
                     for key, value in tags.iteritems()]
+        # Get ids of referenced documents without dereferencing them.
+        cloud, parent = self._data.get('cloud'), self._data.get('parent')
         return {
             'id': self.id,
             'hostname': self.hostname,
@@ -340,7 +366,7 @@ class Machine(me.Document):
             'tags': tags,
             'monitoring': self.monitoring.as_dict() if self.monitoring else '',
             'key_associations': [ka.as_dict() for ka in self.key_associations],
-            'cloud': self.cloud.id,
+            'cloud': cloud.id,
             'last_seen': str(self.last_seen.replace(tzinfo=None)
                              if self.last_seen else ''),
             'missing_since': str(self.missing_since.replace(tzinfo=None)
@@ -348,7 +374,7 @@ class Machine(me.Document):
             'created': str(self.created.replace(tzinfo=None)
                            if self.created else ''),
             'machine_type': self.machine_type,
-            'parent_id': self.parent.id if self.parent is not None else '',
+            'parent_id': parent.id if parent is not None else '',
             'probe': {
                 'ping': (self.ping_probe.as_dict()
                          if self.ping_probe is not None
@@ -359,6 +385,38 @@ class Machine(me.Document):
             },
         }
 
+    @classmethod
+    def as_dicts(cls, machines):
+        """Return a list of dicts, as returned by `as_dict`, for machines
+
+        This should be preferred over calling `as_dict` for each machine when
+        serializing many machines at once, since it fetches the tags of all
+        given machines with a single query per owner.
+
+        """
+        machines = list(machines)
+        if not machines:
+            return []
+        # Machines whose tags are cached on the document need no query.
+        tags = {machine.id: {} for machine in machines
+                if machine.cached_tags is None}
+        # Group machines by owner, to query the tags of each owner, as done
+        # by `as_dict`, without dereferencing the cloud of every machine.
+        owned = {}
+        for machine in machines:
+            if machine.id in tags:
+                owner = machine._data.get('owner') or machine.cloud.owner
+                owned.setdefault(owner.id, []).append(machine)
+        for owner_id, resources in owned.iteritems():
+            for tag in mist.api.tag.models.Tag.objects(
+                owner=owner_id, resource__in=resources
+            ).only('key', 'value', 'resource').as_pymongo():
+                machine_id = tag['resource']['_ref'].id
+                if machine_id in tags:
+                    tags[machine_id][tag['key']] = tag.get('value')
+        return [machine.as_dict(tags=tags.get(machine.id))
+                for machine in machines]
+
     def as_dict_old(self):
         # Return a dict as it was previously being returned by list_machines
 
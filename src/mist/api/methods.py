@@ -2,6 +2,7 @@ import os
 import re
 import json
 import shutil
+import socket
 import tempfile
 import subprocess
 
@@ -39,6 +40,8 @@ from mist.api.helpers import StdStreamCapture
 
 from mist.api.helpers import dirty_cow, parse_os_release
 
+from mist.api.icmp import ping_hosts
+
 import mist.api.tasks
 import mist.api.inventory
 
@@ -464,17 +467,8 @@ def _ping_host(host, pkts=10):
     return ping_parser.as_dict()
 
 
-def ping(owner, host, pkts=10):
-    try:
-        from mist.core.vpn.methods import super_ping
-    except ImportError:
-        result = _ping_host(host, pkts=pkts)
-    else:
-        result = super_ping(owner=owner, host=host, pkts=pkts)
-
-    # In both cases, the returned dict is formatted by pingparsing.
-
-    # Rename keys.
+def _format_ping_result(result):
+    """Rename keys of a dict of ping statistics formatted by pingparsing"""
     final = {}
     for key, newkey in (('packet_transmit', 'packets_tx'),
                         ('packet_receive', 'packets_rx'),
@@ -489,6 +483,46 @@ def ping(owner, host, pkts=10):
     return final
 
 
+def ping(owner, host, pkts=10):
+    try:
+        from mist.core.vpn.methods import super_ping
+    except ImportError:
+        result = _ping_host(host, pkts=pkts)
+    else:
+        result = super_ping(owner=owner, host=host, pkts=pkts)
+
+    # In both cases, the returned dict is formatted by pingparsing.
+    return _format_ping_result(result)
+
+
+def ping_many(targets, pkts=10):
+    """Ping many hosts at once
+
+    `targets` is a list of (owner, host) tuples. Returns a list with the
+    result of each target, in the same format as the one returned by `ping`.
+
+    All hosts are pinged concurrently from this process, instead of spawning
+    a `ping` subprocess per host.
+
+    """
+    try:
+        from mist.core.vpn.methods import super_ping
+    except ImportError:
+        hosts = set(host for _, host in targets)
+        try:
+            results = ping_hosts(hosts, pkts=pkts)
+        except socket.error as exc:
+            log.warning("Can't open ICMP sockets, falling back to spawning "
+                        "a ping process per host: %r", exc)
+            results = {host: _ping_host(host, pkts=pkts) for host in hosts}
+        results = [results[host] for _, host in targets]
+    else:
+        # Hosts may only be reachable through each owner's VPN.
+        results = [super_ping(owner=owner, host=host, pkts=pkts)
+                   for owner, host in targets]
+    return [_format_ping_result(result) for result in results]
+
+
 def find_public_ips(ips):
     public_ips = []
     for ip in ips:
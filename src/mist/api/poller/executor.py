@@ -0,0 +1,179 @@
+"""Concurrent execution of polling tasks
+
+Polling a cloud consists of an I/O bound stage, the provider API call, which
+may take tens of seconds to complete, and a short stage of processing the
+results and storing them in the database.
+
+The `PollingExecutor` defined here runs the first stage of many clouds
+concurrently in a pool of threads, limiting the number of concurrent calls to
+each provider, and hands the results over to a smaller pool of threads that
+runs the database stage. This allows a single process to poll hundreds of
+clouds at once, instead of blocking for the duration of each provider call.
+
+"""
+
+import os
+import time
+import logging
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+from mist.api import config
+
+
+log = logging.getLogger(__name__)
+
+
+class PollingExecutor(object):
+    """Poll many clouds concurrently using pools of threads
+
+    Params:
+    concurrency:            Max number of concurrent provider API calls.
+    sync_concurrency:       Max number of clouds whose results are being
+                            processed and stored in the database at once.
+    provider_concurrency:   Dict of max number of concurrent API calls per
+                            provider. The `default` key applies to providers
+                            missing from the dict.
+
+    """
+
+    def __init__(self, concurrency=None, sync_concurrency=None,
+                 provider_concurrency=None):
+        self.concurrency = concurrency or config.POLLER_CONCURRENCY
+        self.sync_concurrency = (sync_concurrency or
+                                 config.POLLER_SYNC_CONCURRENCY)
+        self.provider_concurrency = dict(config.POLLER_PROVIDER_CONCURRENCY)
+        self.provider_concurrency.update(provider_concurrency or {})
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._busy = {}
+        self._pid = None
+        self._fetch_pool = None
+        self._sync_pool = None
+
+    def _get_pools(self):
+        """Return the thread pools, initializing them after forking"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._fetch_pool = ThreadPool(self.concurrency)
+                self._sync_pool = ThreadPool(self.sync_concurrency)
+                self._semaphores = {}
+                self._busy = {}
+            return self._fetch_pool, self._sync_pool
+
+    def _get_semaphore(self, provider):
+        """Return the semaphore limiting concurrent calls to provider"""
+        with self._lock:
+            if provider not in self._semaphores:
+                limit = self.provider_concurrency.get(
+                    provider, self.provider_concurrency['default']
+                )
+                self._semaphores[provider] = threading.BoundedSemaphore(limit)
+            return self._semaphores[provider]
+
+    def _set_busy(self, provider, delta):
+        with self._lock:
+            self._busy[provider] = self._busy.get(provider, 0) + delta
+
+    def busy(self):
+        """Return the number of running API calls per provider
+
+        This includes calls of tasks that have already timed out, which keep
+        holding their thread and provider slot until they actually return.
+
+        """
+        with self._lock:
+            return {provider: count
+                    for provider, count in self._busy.iteritems() if count}
+
+    def _bound_socket_timeout(self, cloud):
+        """Make the socket operations of the cloud's driver time out
+
+        The driver's connection is patched, so that it uses the timeout both
+        for new sockets and for the socket of a pooled, open connection.
+
+        """
+        timeout = config.POLLER_SOCKET_TIMEOUT
+        conn = getattr(cloud.ctl.compute.connection, 'connection', None)
+        if not timeout or not hasattr(conn, 'timeout'):
+            return
+        conn.timeout = timeout
+        sock = getattr(getattr(conn, 'connection', None), 'sock', None)
+        if sock is not None:
+            sock.settimeout(timeout)
+
+    def _fetch(self, cloud):
+        """Fetch nodes of cloud, respecting the provider's concurrency cap
+
+        The provider's slot is released only once the API call returns, even
+        if `list_machines` has timed out in the meantime.
+
+        """
+        try:
+            provider = cloud.ctl.provider
+            with self._get_semaphore(provider):
+                self._set_busy(provider, 1)
+                try:
+                    self._bound_socket_timeout(cloud)
+                    return cloud, cloud.ctl.compute.fetch_nodes()
+                finally:
+                    self._set_busy(provider, -1)
+        except Exception as exc:
+            log.error("Error while fetching nodes of %s: %r", cloud, exc)
+            return cloud, exc
+
+    def _sync(self, cloud, nodes):
+        """Process and store the fetched nodes of cloud"""
+        try:
+            cloud.ctl.compute.list_machines(persist=False, nodes=nodes)
+        except Exception as exc:
+            log.error("Error while listing machines of %s: %r", cloud, exc)
+            return False
+        return True
+
+    def list_machines(self, clouds, timeout=None):
+        """Run list_machines for all given clouds concurrently
+
+        Nodes are fetched from the providers of all clouds concurrently and
+        the machines of each cloud are stored in the database as soon as its
+        nodes are fetched.
+
+        Returns a dict mapping the id of each cloud to whether its machines
+        were listed successfully. Clouds that didn't complete within `timeout`
+        seconds are missing from the result.
+
+        """
+        fetch_pool, sync_pool = self._get_pools()
+        clouds = list(clouds)
+        deadline = time.time() + timeout if timeout is not None else None
+
+        def remaining():
+            if deadline is not None:
+                return max(deadline - time.time(), 0)
+
+        results, syncs = {}, []
+        fetched = fetch_pool.imap_unordered(self._fetch, clouds)
+        for _ in clouds:
+            try:
+                cloud, nodes = fetched.next(remaining())
+            except StopIteration:
+                break
+            except Exception as exc:
+                log.error("Timed out fetching nodes of %d clouds, API calls "
+                          "still running per provider: %s: %r",
+                          len(clouds) - len(syncs), self.busy(), exc)
+                break
+            syncs.append((cloud, sync_pool.apply_async(self._sync,
+                                                       (cloud, nodes))))
+        for cloud, sync in syncs:
+            try:
+                results[cloud.id] = sync.get(remaining())
+            except Exception as exc:
+                log.error("Timed out listing machines of %s: %r", cloud, exc)
+        return results
+
+
+# Executor shared by all polling tasks of the same process.
+executor = PollingExecutor()
@@ -5,6 +5,8 @@ import celery
 
 import mongoengine as me
 
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
 
 from mist.api.clouds.models import Cloud
 from mist.api.machines.models import Machine
@@ -44,6 +46,13 @@ class PollingSchedule(me.Document):
     meta = {
         'allow_inheritance': True,
         'strict': False,
+        'indexes': [
+            {
+                'fields': ['next_run_at'],
+                'sparse': False,
+                'cls': False,
+            },
+        ],
     }
 
     # We use a unique name for easy identification and to avoid running the
@@ -64,6 +73,9 @@ class PollingSchedule(me.Document):
         PollingInterval, required=True, default=PollingInterval(every=0)
     )
     override_intervals = me.EmbeddedDocumentListField(PollingInterval)
+    # The interval currently in effect, out of the default and override
+    # intervals. It's recomputed when intervals are added or when it expires.
+    effective_interval = me.EmbeddedDocumentField(PollingInterval)
 
     # Optional arguments.
     queue = me.StringField()
@@ -75,6 +87,11 @@ class PollingSchedule(me.Document):
     last_run_at = me.DateTimeField()
     total_run_count = me.IntField(min_value=0)
     run_immediately = me.BooleanField()
+    # When this schedule should run next. Computed automatically on save and
+    # updated by the scheduler. None means that it should never run. Such
+    # schedules may be stored without the field, so they must only ever be
+    # matched by range queries, which skip missing fields.
+    next_run_at = me.DateTimeField()
 
     def get_name(self):
         """Construct name based on self.task"""
@@ -84,8 +101,23 @@ class PollingSchedule(me.Document):
             return '%s: No task specified.' % self.__class__.__name__
 
     def clean(self):
-        """Automatically set value of name"""
+        """Automatically set value of name and next_run_at"""
         self.name = self.get_name()
+        self.update_effective_interval()
+        self.next_run_at = self.get_next_run_at()
+
+    def get_next_run_at(self):
+        """Compute when this schedule should run next
+
+        Times are naive datetimes in UTC.
+        """
+        now = datetime.datetime.utcnow()
+        if self.run_immediately or not self.last_run_at:
+            return now
+        interval = self.interval.timedelta
+        if not interval:
+            return None
+        return self.last_run_at + interval
 
     @property
     def task(self):
@@ -114,16 +146,37 @@ class PollingSchedule(me.Document):
     def interval(self):
         """Merge multiple intervals into one
 
-        Returns a dynamic PollingInterval, with the highest frequency of any
-        override schedule or the default schedule.
+        Returns a PollingInterval, with the highest frequency of any override
+        schedule or the default schedule.
+
+        The merged interval is stored in `effective_interval` and is only
+        recomputed, in memory, once it has expired.
 
         """
+        interval = self.effective_interval
+        if interval is None or interval.expired():
+            interval = self._merge_intervals()
+            # Cache without marking the field as changed.
+            self._data['effective_interval'] = interval
+        return interval
+
+    def _merge_intervals(self):
+        """Return a copy of the interval with the highest frequency"""
         interval = self.default_interval
         for i in self.override_intervals:
             if not i.expired():
                 if not interval.timedelta or i.timedelta < interval.timedelta:
                     interval = i
-        return interval
+        return PollingInterval(name=interval.name, every=interval.every,
+                               expires=interval.expires)
+
+    def update_effective_interval(self):
+        """Recompute the interval in effect
+
+        This is called automatically whenever intervals are modified using
+        the model's methods.
+        """
+        self.effective_interval = self._merge_intervals()
 
     @property
     def schedule(self):
@@ -148,19 +201,27 @@ class PollingSchedule(me.Document):
 
         Override schedules can only increase, not decrease frequency of the
         schedule, in relation to that define in the `default_interval`.
+
+        Override schedules are deduplicated by name, so adding an override
+        schedule replaces any existing one with the same name.
         """
         assert isinstance(interval, int) and interval > 0
         assert isinstance(ttl, int) and 0 < ttl < 3600
         expires = datetime.datetime.now() + datetime.timedelta(seconds=ttl)
+        self.override_intervals = [override
+                                   for override in self.override_intervals
+                                   if override.name != name]
         self.override_intervals.append(
             PollingInterval(name=name, expires=expires, every=interval)
         )
+        self.update_effective_interval()
 
     def cleanup_expired_intervals(self):
         """Remove override schedules that have expired"""
         self.override_intervals = [override
                                    for override in self.override_intervals
                                    if not override.expired()]
+        self.update_effective_interval()
 
     def set_default_interval(self, interval):
         """Set default interval
@@ -170,6 +231,7 @@ class PollingSchedule(me.Document):
         expires. To disable a task, simply set `enabled` equal to False.
         """
         self.default_interval = PollingInterval(name='default', every=interval)
+        self.update_effective_interval()
 
     def __unicode__(self):
         return "%s %s" % (self.get_name(), self.interval or '(no interval)')
@@ -219,18 +281,16 @@ class CloudPollingSchedule(PollingSchedule):
             log.error('Cannot get cloud for polling schedule.')
             return False
 
-    @property
-    def interval(self):
+    def clean(self):
+        """Keep default interval in sync with the cloud's polling interval"""
         try:
             if self.default_interval.every != self.cloud.polling_interval:
                 log.warning("Schedule has different interval from cloud, "
                             "fixing")
-                self.default_interval.every = self.cloud.polling_interval
-                self.save()
-            return super(CloudPollingSchedule, self).interval
+                self.set_default_interval(self.cloud.polling_interval)
         except me.DoesNotExist:
-            log.error('Cannot get interval. Cloud is missing')
-            return PollingInterval(every=0)
+            log.error('Cannot sync interval. Cloud is missing')
+        super(CloudPollingSchedule, self).clean()
 
 
 class ListMachinesPollingSchedule(CloudPollingSchedule):
@@ -275,6 +335,63 @@ class MachinePollingSchedule(PollingSchedule):
         schedule.save()
         return schedule
 
+    @classmethod
+    def add_many(cls, machine_ids, interval=None, ttl=300):
+        """Add or update the schedules of many machines at once
+
+        This is equivalent to calling `add` for each machine, but fetches all
+        existing schedules with a single query and writes all changes with a
+        single bulk write.
+
+        Returns the number of schedules written.
+
+        """
+        machine_ids = set(machine_ids)
+        if not machine_ids:
+            return 0
+        schedules = cls.objects(machine_id__in=list(machine_ids))
+        schedules = {schedule.machine_id: schedule for schedule in schedules}
+        ops = []
+        for machine_id in machine_ids:
+            schedule = schedules.get(machine_id)
+            if schedule is None:
+                schedule = cls(machine_id=machine_id)
+            schedule.set_default_interval(60 * 60 * 2)
+            if interval is not None:
+                schedule.add_interval(interval, ttl)
+            schedule.run_immediately = True
+            schedule.cleanup_expired_intervals()
+            try:
+                schedule.validate()
+            except me.ValidationError as exc:
+                log.error("Invalid %s: %r", schedule, exc)
+                continue
+            if schedule.id is None:
+                ops.append(InsertOne(schedule.to_mongo()))
+                continue
+            updates, removals = schedule._delta()
+            update = {}
+            if updates:
+                update['$set'] = updates
+            if removals:
+                update['$unset'] = removals
+            if update:
+                ops.append(UpdateOne({'_id': schedule.id}, update))
+        if not ops:
+            return 0
+        try:
+            result = cls._get_collection().bulk_write(ops, ordered=False)
+        except BulkWriteError as exc:
+            # Schedules created concurrently will fail with a duplicate key
+            # error, which is fine since they've just been added.
+            errors = [error for error in exc.details['writeErrors']
+                      if error['code'] != 11000]
+            for error in errors:
+                log.error("Error writing %s: %s", cls.__name__,
+                          error['errmsg'])
+            return len(ops) - len(exc.details['writeErrors'])
+        return result.inserted_count + result.matched_count
+
 
 class PingProbeMachinePollingSchedule(MachinePollingSchedule):
 
@@ -1,7 +1,163 @@
-from celerybeatmongo.schedulers import MongoScheduler
+import logging
+import datetime
+
+from pymongo import UpdateOne
+
+from celery.beat import Scheduler
+
+from mist.api.machines.models import Machine
 
 from mist.api.poller.models import PollingSchedule
+from mist.api.poller.models import MachinePollingSchedule
+from mist.api.poller.models import ListMachinesPollingSchedule
+from mist.api.poller.models import PingProbeMachinePollingSchedule
+
+from mist.api import config
+
+
+log = logging.getLogger(__name__)
 
 
-class PollingScheduler(MongoScheduler):
+class PollingScheduler(Scheduler):
+    """Celery beat scheduler for polling schedules
+
+    Rather than loading every schedule and checking whether it's due on every
+    tick, this scheduler fetches only the schedules that are due, using a
+    single range query on the indexed `next_run_at` field, and updates them
+    in bulk after dispatching their tasks. This way the cost of each tick
+    depends on the number of due schedules, not on the total number of
+    schedules.
+
+    Due list machines and ping probe schedules are dispatched in batches, so
+    that the clouds or machines of each batch are polled concurrently by a
+    single task.
+
+    """
+
     Model = PollingSchedule
+
+    # Max number of due schedules to dispatch in a single tick.
+    max_due = 1000
+
+    # Delay before retrying schedules whose interval can't be determined or
+    # whose task couldn't be sent.
+    retry_delay = datetime.timedelta(seconds=30)
+
+    # Schedules of these types are dispatched in batches, using the given
+    # task and setting for the batch size.
+    batched = (
+        (ListMachinesPollingSchedule,
+         'mist.api.poller.tasks.list_machines_batch', 'POLLER_BATCH_SIZE'),
+        (PingProbeMachinePollingSchedule,
+         'mist.api.poller.tasks.ping_probe_batch', 'POLLER_PING_BATCH_SIZE'),
+    )
+
+    def setup_schedule(self):
+        pass
+
+    def get_due(self, now):
+        """Return schedules that should run now, oldest first"""
+        return list(self.Model.objects(next_run_at__lte=now).order_by(
+            'next_run_at').limit(self.max_due).select_related())
+
+    def get_enabled(self, schedules):
+        """Return ids of enabled schedules
+
+        Machine schedules are checked with a single query, instead of
+        counting the machine of each schedule separately.
+        """
+        machine_ids = set(Machine.objects(
+            id__in=[sched.machine_id for sched in schedules
+                    if isinstance(sched, MachinePollingSchedule)],
+            missing_since=None,
+        ).distinct('id'))
+        enabled = set()
+        for sched in schedules:
+            try:
+                if isinstance(sched, MachinePollingSchedule):
+                    if sched.machine_id in machine_ids and bool(
+                            sched.interval.timedelta):
+                        enabled.add(sched.id)
+                elif sched.enabled:
+                    enabled.add(sched.id)
+            except Exception as exc:
+                log.error("Error checking if %s is enabled: %r", sched, exc)
+        return enabled
+
+    def send(self, task, args=None, kwargs=None, sched=None):
+        options = {}
+        if sched is not None:
+            for key in ('queue', 'exchange', 'routing_key'):
+                if getattr(sched, key):
+                    options[key] = getattr(sched, key)
+        try:
+            self.app.send_task(task, args=args, kwargs=kwargs,
+                               publisher=self.publisher, **options)
+        except Exception as exc:
+            log.error("Error sending task %s%r: %r", task, args, exc)
+            return False
+        return True
+
+    def tick(self):
+        now = datetime.datetime.utcnow()
+        due = self.get_due(now)
+        enabled = self.get_enabled(due)
+
+        ops, batches = [], {task: [] for _, task, _ in self.batched}
+        # Postpone, without disabling or marking as run, on transient errors.
+        retry = {'$set': {'next_run_at': now + self.retry_delay}}
+        for sched in due:
+            # Only update schedules that haven't changed since fetched.
+            query = {'_id': sched.id, 'next_run_at': sched.next_run_at}
+            update = {}
+            try:
+                interval = sched.interval
+                # Persist effective interval, in case it was just recomputed.
+                update['effective_interval'] = interval.to_mongo()
+                interval = interval.timedelta
+            except Exception as exc:
+                log.error("Error getting interval of %s: %r", sched, exc)
+                ops.append(UpdateOne(query, retry))
+                continue
+            # Run again after an interval, or never if there's none.
+            update['next_run_at'] = now + interval if interval else None
+            if sched.id not in enabled:
+                ops.append(UpdateOne(query, {'$set': update}))
+                continue
+            update.update({'last_run_at': now, 'run_immediately': False})
+            run = {'$set': update, '$inc': {'total_run_count': 1}}
+            for sched_type, task, _ in self.batched:
+                if isinstance(sched, sched_type):
+                    batches[task].append((str(sched.id), query, run))
+                    break
+            else:
+                sent = self.send(sched.task, sched.args, sched.kwargs, sched)
+                ops.append(UpdateOne(query, run if sent else retry))
+
+        for _, task, setting in self.batched:
+            batch, size = batches[task], getattr(config, setting)
+            for i in xrange(0, len(batch), size):
+                chunk = batch[i:i + size]
+                # Only mark the schedules of a batch as run once it's sent.
+                sent = self.send(task, args=([item[0] for item in chunk], ))
+                for _, query, run in chunk:
+                    ops.append(UpdateOne(query, run if sent else retry))
+
+        if ops:
+            self.Model._get_collection().bulk_write(ops, ordered=False)
+        if due:
+            log.info("Dispatched %d/%d due schedules", len(enabled), len(due))
+        if len(due) >= self.max_due:
+            return 0
+
+        # Sleep until next schedule is due.
+        upcoming = self.Model.objects(next_run_at__ne=None).order_by(
+            'next_run_at').only('next_run_at').first()
+        if upcoming is None:
+            return self.max_interval
+        wait = (upcoming.next_run_at - datetime.datetime.utcnow())
+        return min(max(wait.total_seconds(), 0), self.max_interval)
+
+    @property
+    def info(self):
+        return '    . db -> %s' % self.Model._get_collection_name()
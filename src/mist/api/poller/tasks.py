@@ -40,6 +40,25 @@ def list_machines(schedule_id):
     sched.cloud.ctl.compute.list_machines(persist=False)
 
 
+@app.task(time_limit=60, soft_time_limit=55)
+def list_machines_batch(schedule_ids):
+    """Perform list machines for many clouds concurrently
+
+    Nodes of all clouds are fetched concurrently by the process-wide polling
+    executor and each cloud's controller stores the results in mongodb.
+    """
+
+    # Fetch schedules and clouds from database.
+    # FIXME: resolve circular deps error
+    from mist.api.poller.models import ListMachinesPollingSchedule
+    from mist.api.poller.executor import executor
+    scheds = ListMachinesPollingSchedule.objects(id__in=schedule_ids)
+    clouds = [sched.cloud for sched in scheds.select_related()]
+    results = executor.list_machines(clouds, timeout=50)
+    log.info("Listed machines of %d/%d clouds successfully",
+             sum(results.values()), len(schedule_ids))
+
+
 @app.task(time_limit=45, soft_time_limit=40)
 def ping_probe(schedule_id):
     """Perform ping probe"""
@@ -54,6 +73,40 @@ def ping_probe(schedule_id):
         log.error("Error while ping-probing %s: %r", sched.machine, exc)
 
 
+@app.task(time_limit=60, soft_time_limit=55)
+def ping_probe_batch(schedule_ids):
+    """Perform ping probe for many machines at once
+
+    All machines are pinged concurrently from this process and the results
+    are stored by each machine's controller.
+    """
+
+    # Fetch schedules and machines from database.
+    # FIXME: resolve circular deps error
+    from mist.api.poller.models import PingProbeMachinePollingSchedule
+    from mist.api.machines.models import Machine
+    from mist.api.methods import ping_many
+    machine_ids = PingProbeMachinePollingSchedule.objects(
+        id__in=schedule_ids).scalar('machine_id')
+    machines, targets = [], []
+    for machine in Machine.objects(id__in=list(machine_ids)).select_related(2):
+        try:
+            targets.append((machine.cloud.owner, machine.ctl.get_host()))
+        except Exception as exc:
+            log.error("Error while ping-probing %s: %r", machine, exc)
+            continue
+        machines.append(machine)
+    if not machines:
+        return
+    results = ping_many(targets)
+    for machine, result in zip(machines, results):
+        try:
+            machine.ctl.ping_probe(persist=False, data=result)
+        except Exception as exc:
+            log.error("Error while ping-probing %s: %r", machine, exc)
+    log.info("Ping-probed %d machines", len(machines))
+
+
 @app.task(time_limit=45, soft_time_limit=40)
 def ssh_probe(schedule_id):
     """Perform ssh probe"""
@@ -8,17 +8,24 @@ greenlet.
 
 """
 
+import copy
 import uuid
 import json
+import hashlib
 import time
 import random
 import traceback
 import datetime
+import threading
+import collections
+
+import jsonpatch
 
 import tornado.gen
+import tornado.locks
 
 from sockjs.tornado import SockJSConnection, SockJSRouter
-from mist.api.sockjs_mux import MultiplexConnection
+from mist.api.sockjs_mux import MultiplexConnection, message_stats
 
 from mist.api.logs.methods import log_event
 from mist.api.logs.methods import get_stories
@@ -31,6 +38,7 @@ from mist.api.auth.methods import auth_context_from_session_id
 from mist.api.exceptions import UnauthorizedError, MistError
 from mist.api.exceptions import PolicyUnauthorizedError
 from mist.api.amqp_tornado import Consumer
+from mist.api.tornado_executor import run_in_thread
 
 from mist.api.clouds.methods import filter_list_clouds
 from mist.api.keys.methods import filter_list_keys
@@ -89,6 +97,39 @@ def get_conn_info(conn_info):
     return ip, user_agent, session_id
 
 
+def compact_lists(data):
+    """Encode large lists of objects with the same keys as rows of values
+
+    Such lists, either being data or values of data if it's a dict, are
+    replaced by `{'__columns__': [keys], '__rows__': [[values], ...]}`, which
+    omits repeating the keys in each object. Return data as is if no list
+    was compacted, otherwise a copy.
+
+    """
+    def compact(items):
+        if not (isinstance(items, list) and
+                len(items) >= config.SOCKJS_COMPACT_MIN_ROWS and
+                isinstance(items[0], dict)):
+            return items
+        keys = set(items[0])
+        for item in items:
+            if not isinstance(item, dict) or len(item) != len(keys) or \
+                    not keys.issuperset(item):
+                return items
+        columns = sorted(keys)
+        return {'__columns__': columns,
+                '__rows__': [[item[key] for key in columns]
+                             for item in items]}
+
+    if isinstance(data, list):
+        return compact(data)
+    if isinstance(data, dict):
+        compacted = {key: compact(value) for key, value in data.iteritems()}
+        if any(compacted[key] is not data[key] for key in data):
+            return compacted
+    return data
+
+
 class MistConnection(SockJSConnection):
     closed = False
 
@@ -108,8 +149,39 @@ class MistConnection(SockJSConnection):
             self.session_id = uuid.uuid4().hex
             CONNECTIONS.add(self)
 
+    @property
+    def capabilities(self):
+        return getattr(self.session, 'capabilities', ())
+
     def send(self, msg, data=None):
-        super(MistConnection, self).send(json.dumps({msg: data}))
+        self.send_encoded(msg, *self.encode(data))
+
+    def encode(self, data):
+        """JSON encode data, compacting large lists if supported
+
+        Return the encoded data, along with the size it would take if it
+        weren't compacted, if measured, else None.
+
+        """
+        if 'compact' not in self.capabilities:
+            return json.dumps(data), None
+        compacted = compact_lists(data)
+        if compacted is data:
+            return json.dumps(data), None
+        original_size = None
+        if message_stats.enabled:
+            original_size = len(json.dumps(data))
+        return json.dumps(compacted), original_size
+
+    def send_encoded(self, msg, payload, original_size=None):
+        """Send a message whose data has already been JSON encoded"""
+        if self.is_closed:
+            return
+        frame = '{%s: %s}' % (json.dumps(msg), payload)
+        if original_size is not None:
+            original_size += len(frame) - len(payload)
+        self.session.send_message(frame, msg_type=msg,
+                                  original_size=original_size)
 
     def on_close(self, stale=False):
         if not self.closed:
@@ -198,36 +270,148 @@ class ShellConnection(MistConnection):
         super(ShellConnection, self).on_close(stale=stale)
 
 
-class OwnerUpdatesConsumer(Consumer):
-    def __init__(self, main_sockjs_conn,
-                 amqp_url=config.BROKER_URL):
-        self.sockjs_conn = main_sockjs_conn
+class ConsumerHub(object):
+    """Share AMQP consumers among the sockjs connections of this process
+
+    Rather than each connection consuming its own queue, which means that
+    every message is delivered by RabbitMQ and decoded once per connection,
+    a single consumer is maintained per key (e.g. per owner) and each message
+    it receives is decoded once and fanned out to all local connections that
+    have subscribed to that key. Connections still apply their own RBAC
+    filtering on the messages they receive.
+
+    Consumers are reference counted: a consumer is started along with the
+    first subscription to its key and stopped when the last one is removed.
+
+    """
+
+    def __init__(self, consumer_class):
+        self.consumer_class = consumer_class
+        self.consumers = {}
+        self.subscribers = {}
+
+    def subscribe(self, key, conn):
+        """Subscribe conn to the messages of key, starting a consumer"""
+        subscribers = self.subscribers.setdefault(key, [])
+        if conn in subscribers:
+            log.error("%s has already subscribed to %s", conn, key)
+            return
+        subscribers.append(conn)
+        consumer = self.consumers.get(key)
+        if consumer is None:
+            log.info("Starting shared %s for %s",
+                     self.consumer_class.__name__, key)
+            consumer = self.consumers[key] = self.consumer_class(key, self)
+            consumer.run()
+        elif consumer.consuming:
+            consumer.on_subscribed(conn)
+
+    def unsubscribe(self, key, conn):
+        """Unsubscribe conn, stopping the consumer if it was the last one"""
+        subscribers = self.subscribers.get(key, [])
+        if conn in subscribers:
+            subscribers.remove(conn)
+        if subscribers:
+            return
+        self.subscribers.pop(key, None)
+        consumer = self.consumers.pop(key, None)
+        if consumer is not None:
+            log.info("Stopping shared %s for %s",
+                     self.consumer_class.__name__, key)
+            try:
+                consumer.stop()
+            except Exception as exc:
+                log.error("Error closing pika consumer: %r", exc)
+
+    def get_subscribers(self, key):
+        # Return a copy, since subscribers may be removed while iterating.
+        return list(self.subscribers.get(key, []))
+
+
+class SharedConsumer(Consumer):
+    """Base class of consumers whose messages are fanned out by a hub"""
+
+    def __init__(self, key, hub, **kwargs):
+        self.key = key
+        self.hub = hub
+        self.consuming = False
+        super(SharedConsumer, self).__init__(**kwargs)
+
+    def on_message(self, unused_channel, basic_deliver, properties, body):
+        super(SharedConsumer, self).on_message(
+            unused_channel, basic_deliver, properties, body
+        )
+        try:
+            data = self.decode(basic_deliver.routing_key, body)
+        except Exception as exc:
+            log.error("Error decoding message of %s: %r", self.key, exc)
+            return
+        for conn in self.hub.get_subscribers(self.key):
+            try:
+                self.dispatch(conn, basic_deliver.routing_key, data)
+            except Exception as exc:
+                log.error("Error dispatching message to %s: %r", conn, exc)
+
+    def start_consuming(self):
+        if self._closing:
+            # Stopped by the hub before it had started consuming.
+            self.close_connection()
+            return
+        super(SharedConsumer, self).start_consuming()
+        self.consuming = True
+        for conn in self.hub.get_subscribers(self.key):
+            self.on_subscribed(conn)
+
+    def on_connection_closed(self, connection, reply_code, reply_text):
+        self.consuming = False
+        super(SharedConsumer, self).on_connection_closed(
+            connection, reply_code, reply_text
+        )
+
+    def decode(self, routing_key, body):
+        """Decode a message, once for all subscribers"""
+        return json.loads(body)
+
+    def dispatch(self, conn, routing_key, data):
+        """Deliver a decoded message to a subscribed connection"""
+        raise NotImplementedError()
+
+    def on_subscribed(self, conn):
+        """Invoked once conn will receive all subsequent messages"""
+        pass
+
+
+class OwnerUpdatesConsumer(SharedConsumer):
+
+    def __init__(self, owner_id, hub, amqp_url=config.BROKER_URL):
         super(OwnerUpdatesConsumer, self).__init__(
+            owner_id, hub,
             amqp_url=amqp_url,
-            exchange='owner_%s' % self.sockjs_conn.owner.id,
+            exchange='owner_%s' % owner_id,
             queue='mist-socket-%d' % random.randrange(2 ** 20),
             exchange_type='fanout',
             exchange_kwargs={'auto_delete': True},
             queue_kwargs={'auto_delete': True, 'exclusive': True},
         )
 
-    def on_message(self, unused_channel, basic_deliver, properties, body):
-        super(OwnerUpdatesConsumer, self).on_message(
-            unused_channel, basic_deliver, properties, body
-        )
-        self.sockjs_conn.process_update(
-            unused_channel, basic_deliver, properties, body
-        )
+    def decode(self, routing_key, body):
+        try:
+            return json.loads(body)
+        except:
+            return body
 
-    def start_consuming(self):
-        super(OwnerUpdatesConsumer, self).start_consuming()
-        self.sockjs_conn.start()
+    def dispatch(self, conn, routing_key, data):
+        conn.process_update(routing_key, data)
 
+    def on_subscribed(self, conn):
+        conn.start()
 
-class LogsConsumer(Consumer):
 
-    def __init__(self, owner_id, callback, amqp_url=config.BROKER_URL):
+class LogsConsumer(SharedConsumer):
+
+    def __init__(self, owner_id, hub, amqp_url=config.BROKER_URL):
         super(LogsConsumer, self).__init__(
+            owner_id, hub,
             amqp_url=amqp_url,
             exchange='events',
             queue='mist-logs-%d' % random.randrange(2 ** 20),
@@ -236,13 +420,139 @@ class LogsConsumer(Consumer):
             exchange_kwargs={'auto_delete': False},
             queue_kwargs={'auto_delete': True, 'exclusive': True},
         )
-        self.callback = callback
 
-    def on_message(self, unused_channel, basic_deliver, properties, body):
-        super(LogsConsumer, self).on_message(
-            unused_channel, basic_deliver, properties, body
-        )
-        self.callback(json.loads(body))
+    def decode(self, routing_key, body):
+        event = json.loads(body)
+        event.pop('_id', None)
+        try:
+            for key, value in json.loads(event.pop('extra')).iteritems():
+                event[key] = value
+        except:
+            pass
+        return event
+
+    def dispatch(self, conn, routing_key, data):
+        # Connections may edit the top-level keys of the events they emit.
+        conn.emit_event(dict(data))
+
+
+# Hubs shared by all connections of the same process.
+owner_updates_hub = ConsumerHub(OwnerUpdatesConsumer)
+logs_hub = ConsumerHub(LogsConsumer)
+
+
+# Messages of MainConnection that carry a whole section of the client's state,
+# which may be skipped or sent as a patch, see `MainConnection.send`.
+SECTIONS = set(['user', 'org', 'list_tags', 'list_keys', 'list_scripts',
+                'list_schedules', 'list_templates', 'list_stacks',
+                'list_tunnels', 'list_clouds', 'notifications', 'monitoring'])
+CLOUD_SECTIONS = set(['list_machines', 'list_images', 'list_sizes',
+                      'list_networks', 'list_zones', 'list_locations',
+                      'list_projects', 'list_resource_groups',
+                      'list_storage_accounts'])
+
+
+class SectionSnapshots(object):
+    """Size bounded LRU store of section snapshots, keyed by version
+
+    A section's version is the hash of its content, so snapshots may be
+    shared by all connections of the process. They are kept so that, when a
+    client reconnects with an older version of a section, only a JSON patch
+    against that version may be sent.
+
+    The encoding and version of recently sent data, and the patches between
+    versions, are memoized as well, so that data sent to many connections,
+    such as an update dispatched by a shared consumer, is hashed and diffed
+    only once. Data is assumed not to be modified once sent.
+
+    """
+
+    # Max number of memoized encodings and patches.
+    memo_size = 64
+
+    def __init__(self, size=None):
+        self.size = size
+        self._lock = threading.Lock()
+        self._snapshots = collections.OrderedDict()
+        self._encoded = collections.OrderedDict()
+        self._patches = collections.OrderedDict()
+
+    def _memoize(self, memo, key, value):
+        memo.pop(key, None)
+        memo[key] = value
+        while len(memo) > self.memo_size:
+            memo.popitem(last=False)
+
+    def get(self, version):
+        with self._lock:
+            data = self._snapshots.pop(version, None)
+            if data is not None:
+                self._snapshots[version] = data  # Move to the end.
+            return data
+
+    def add(self, version, data):
+        with self._lock:
+            self._snapshots.pop(version, None)
+            self._snapshots[version] = data
+            while len(self._snapshots) > (self.size or
+                                          config.SOCKJS_SECTION_SNAPSHOTS):
+                self._snapshots.popitem(last=False)
+
+    def encode(self, data):
+        """Return the JSON encoding of data and its version"""
+        with self._lock:
+            # Memoized by identity, keeping a reference to data, so that its
+            # id can't be reused while memoized.
+            entry = self._encoded.get(id(data))
+        if entry is not None and entry[0] is data:
+            return entry[1], entry[2]
+        payload = json.dumps(data, sort_keys=True)
+        version = hashlib.sha1(payload).hexdigest()
+        with self._lock:
+            self._memoize(self._encoded, id(data), (data, payload, version))
+        return payload, version
+
+    def make_patch(self, base, version, data):
+        """Return the patch from version base to data and its encoded size
+
+        Return None if there's no snapshot of base.
+
+        """
+        with self._lock:
+            entry = self._patches.get((base, version))
+        if entry is not None:
+            return entry
+        snapshot = self.get(base)
+        if snapshot is None:
+            return None
+        patch = jsonpatch.make_patch(snapshot, data).patch
+        entry = patch, len(json.dumps(patch))
+        with self._lock:
+            self._memoize(self._patches, (base, version), entry)
+        return entry
+
+
+# Snapshots shared by all connections of the same process.
+section_snapshots = SectionSnapshots()
+
+
+def diff_section(data, known=None):
+    """Decide what to send to a client that has version known of a section
+
+    Return the version of data, along with a patch from the known version, if
+    smaller than data, or the JSON encoded data, or neither if the client is
+    up to date. This is CPU bound and meant to be run off the IOLoop.
+
+    """
+    payload, version = section_snapshots.encode(data)
+    if known == version:
+        return version, None, None
+    section_snapshots.add(version, data)
+    if known:
+        entry = section_snapshots.make_patch(known, version, data)
+        if entry is not None and entry[1] < len(payload):
+            return version, entry[0], None
+    return version, None, payload
 
 
 class MainConnection(MistConnection):
@@ -251,7 +561,16 @@ class MainConnection(MistConnection):
         log.info("************** Open!")
         super(MainConnection, self).on_open(conn_info)
         self.running_machines = set()
-        self.consumer = None
+        self.subscribed = False
+        # Serializes initial sync and processing of updates.
+        self.lock = tornado.locks.Lock()
+        # Versions of the sections the client has, if it supports them.
+        self.versions = None
+        self.synced_sections = None
+        self.pending_sections = set()
+        # Messages queued behind sections being versioned in a thread.
+        self.send_queue = collections.deque()
+        self.sends_done = tornado.locks.Condition()
         self.log_kwargs = {
             'ip': self.ip,
             'user_agent': self.user_agent,
@@ -264,27 +583,48 @@ class MainConnection(MistConnection):
             self.log_kwargs['su'] = self.auth_context.token.su
         log_event(action='connect', **self.log_kwargs)
 
-    def on_ready(self):
+    def on_ready(self, versions=None):
+        """Start syncing the client's state
+
+        Clients that support versioned sections send the versions of the
+        sections they already have, possibly empty. Sections that haven't
+        changed since are then skipped, or sent as JSON patches.
+
+        """
         log.info("************** Ready to go!")
-        if self.consumer is None:
-            self.consumer = OwnerUpdatesConsumer(self)
-            self.consumer.run()
+        if isinstance(versions, dict):
+            self.versions = dict(versions)
+        if not self.subscribed:
+            self.subscribed = True
+            owner_updates_hub.subscribe(self.owner.id, self)
         else:
             log.error("It seems we have received 'on_ready' more than once.")
 
+    @tornado.gen.coroutine
     def start(self):
-        self.update_user()
-        self.update_org()
-        self.list_tags()
-        self.list_keys()
-        self.list_scripts()
-        self.list_schedules()
-        self.list_templates()
-        self.list_stacks()
-        self.list_tunnels()
-        self.list_clouds()
-        self.update_notifications()
-        self.check_monitoring()
+        with (yield self.lock.acquire()):
+            self.synced_sections = set()
+            yield self.update_user()
+            yield self.update_org()
+            yield self.list_tags()
+            yield self.list_keys()
+            yield self.list_scripts()
+            yield self.list_schedules()
+            yield self.list_templates()
+            yield self.list_stacks()
+            yield self.list_tunnels()
+            yield self.list_clouds()
+            yield self.update_notifications()
+            yield self.check_monitoring()
+            yield self.wait_sent()
+            if self.versions is not None:
+                # Forget, and let the client drop, the sections that weren't
+                # part of the sync, since they may no longer exist.
+                self.versions = {section: version
+                                 for section, version in self.versions.items()
+                                 if section in self.synced_sections}
+                self.send('versions', self.versions)
+            self.synced_sections = None
         if config.ACTIVATE_POLLER:
             self.periodic_update_poller()
 
@@ -293,65 +633,174 @@ class MainConnection(MistConnection):
         while True:
             if self.closed:
                 break
-            self.update_poller()
+            yield self.update_poller()
             yield tornado.gen.sleep(100)
 
+    def send(self, msg, data=None):
+        """Send a message, skipping or patching sections the client has
+
+        For clients that support versioned sections, each section is hashed
+        and sent only if its version differs from the one the client has.
+        When the snapshot of the client's version is still around, only a
+        JSON patch against it is sent, if smaller. Each new version is then
+        announced with a `section_version` message.
+
+        Sections are hashed and diffed in a thread, see `diff_section`, so
+        messages are queued while a section is being processed, to be sent
+        in order.
+
+        """
+        section = None
+        if self.versions is not None and (
+                msg in SECTIONS or
+                msg in CLOUD_SECTIONS and isinstance(data, dict)):
+            section = msg
+            if msg in CLOUD_SECTIONS:
+                section = '%s:%s' % (msg, data.get('cloud_id'))
+            if self.synced_sections is not None:
+                self.synced_sections.add(section)
+        elif not self.send_queue:
+            return super(MainConnection, self).send(msg, data)
+        self.send_queue.append((msg, section, data))
+        if len(self.send_queue) == 1:
+            self._process_send_queue()
+
+    @tornado.gen.coroutine
+    def _process_send_queue(self):
+        while self.send_queue:
+            msg, section, data = self.send_queue[0]
+            try:
+                if section is None:
+                    super(MainConnection, self).send(msg, data)
+                else:
+                    yield self._send_section(msg, section, data)
+            except Exception as exc:
+                log.exception("Error sending %s: %r", msg, exc)
+            self.send_queue.popleft()
+        self.sends_done.notify_all()
+
+    @tornado.gen.coroutine
+    def wait_sent(self):
+        """Wait until all queued messages have been sent"""
+        while self.send_queue:
+            yield self.sends_done.wait()
+
+    @tornado.gen.coroutine
+    def _send_section(self, msg, section, data):
+        known = self.versions.get(section)
+        version, patch, payload = yield run_in_thread(diff_section, data,
+                                                      known)
+        if version == known or self.is_closed:
+            return
+        self.versions[section] = version
+        send = super(MainConnection, self).send
+        if patch is not None:
+            send('patch_section', {
+                'section': section, 'key': msg, 'base': known,
+                'version': version, 'patch': patch,
+            })
+            return
+        if 'compact' in self.capabilities:
+            self.send_encoded(msg, *(yield run_in_thread(self.encode, data)))
+        else:
+            self.send_encoded(msg, payload)
+        send('section_version', {'section': section, 'version': version})
+
     def update_poller(self):
         """Increase polling frequency for all clouds"""
-        tasks.update_poller.delay(self.owner.id)
+        return run_in_thread(tasks.update_poller.delay, self.owner.id)
 
+    @tornado.gen.coroutine
     def update_user(self):
-        self.send('user', get_user_data(self.auth_context))
+        user = yield run_in_thread(get_user_data, self.auth_context)
+        self.send('user', user)
 
+    @tornado.gen.coroutine
     def update_org(self):
         try:
-            org = filter_org(self.auth_context)
+            org = yield run_in_thread(filter_org, self.auth_context)
         except:  # Forbidden
             org = None
 
         if org:
             self.send('org', org)
 
+    @tornado.gen.coroutine
     def list_tags(self):
-        self.send('list_tags', filter_list_tags(self.auth_context))
+        tags = yield run_in_thread(filter_list_tags, self.auth_context)
+        self.send('list_tags', tags)
 
+    @tornado.gen.coroutine
     def list_keys(self):
-        self.send('list_keys', filter_list_keys(self.auth_context))
+        keys = yield run_in_thread(filter_list_keys, self.auth_context)
+        self.send('list_keys', keys)
 
+    @tornado.gen.coroutine
     def list_scripts(self):
-        self.send('list_scripts', filter_list_scripts(self.auth_context))
+        scripts = yield run_in_thread(filter_list_scripts, self.auth_context)
+        self.send('list_scripts', scripts)
 
+    @tornado.gen.coroutine
     def list_schedules(self):
-        self.send('list_schedules', filter_list_schedules(self.auth_context))
+        schedules = yield run_in_thread(filter_list_schedules,
+                                        self.auth_context)
+        self.send('list_schedules', schedules)
 
+    @tornado.gen.coroutine
     def list_templates(self):
-        self.send('list_templates', filter_list_templates(self.auth_context))
+        templates = yield run_in_thread(filter_list_templates,
+                                        self.auth_context)
+        self.send('list_templates', templates)
 
+    @tornado.gen.coroutine
     def list_stacks(self):
-        self.send('list_stacks', filter_list_stacks(self.auth_context))
+        stacks = yield run_in_thread(filter_list_stacks, self.auth_context)
+        self.send('list_stacks', stacks)
 
+    @tornado.gen.coroutine
     def list_tunnels(self):
-        self.send('list_tunnels', filter_list_vpn_tunnels(self.auth_context))
+        tunnels = yield run_in_thread(filter_list_vpn_tunnels,
+                                      self.auth_context)
+        self.send('list_tunnels', tunnels)
 
+    @tornado.gen.coroutine
     def list_clouds(self):
+        messages = yield run_in_thread(self._list_clouds)
+        for key, data in messages:
+            self.send(key, data)
+
+    def _list_clouds(self):
+        """Return the messages to send for list_clouds
+
+        This performs blocking calls and runs in the executor's threads.
+        """
+        messages = []
         if config.ACTIVATE_POLLER:
-            self.update_poller()
-        self.send('list_clouds', filter_list_clouds(self.auth_context))
+            tasks.update_poller.delay(self.owner.id)
+        messages.append(('list_clouds',
+                         filter_list_clouds(self.auth_context)))
         clouds = Cloud.objects(owner=self.owner, enabled=True, deleted=None)
         log.info(clouds)
         periodic_tasks = []
         if not config.ACTIVATE_POLLER:
             periodic_tasks.append(('list_machines', tasks.ListMachines()))
         else:
+            # Serialize cached machines of all clouds at once, so that tags
+            # are fetched with a single query.
+            cached_machines = {cloud.id: [] for cloud in clouds}
+            machines = []
+            for cloud in clouds:
+                machines.extend(cloud.ctl.compute.list_cached_machines())
+            for machine in Machine.as_dicts(machines):
+                cached_machines[machine['cloud']].append(machine)
             for cloud in clouds:
-                machines = cloud.ctl.compute.list_cached_machines()
                 machines = filter_list_machines(
                     self.auth_context, cloud_id=cloud.id,
-                    machines=[machine.as_dict() for machine in machines]
+                    machines=cached_machines[cloud.id]
                 )
                 log.info("Emitting list_machines from poller's cache.")
-                self.send('list_machines',
-                          {'cloud_id': cloud.id, 'machines': machines})
+                messages.append(('list_machines',
+                                 {'cloud_id': cloud.id, 'machines': machines}))
 
         periodic_tasks.extend([('list_images', tasks.ListImages()),
                                ('list_sizes', tasks.ListSizes()),
@@ -363,37 +812,46 @@ class MainConnection(MistConnection):
                                ('list_storage_accounts',
                                 tasks.ListStorageAccounts()),
                                ('list_projects', tasks.ListProjects())])
-        for key, task in periodic_tasks:
-            for cloud in clouds:
-                cached = task.smart_delay(self.owner.id, cloud.id)
-                if cached is not None:
-                    log.info("Emitting %s from cache", key)
-                    if key == 'list_machines':
-                        cached['machines'] = filter_list_machines(
-                            self.auth_context, **cached
-                        )
-                        if cached['machines'] is None:
-                            continue
-                    elif key == 'list_zones':
-                        cached = filter_list_zones(
-                            self.auth_context, cloud.id, cached['zones']
-                        )
-                        if cached is None:
-                            continue
-                    self.send(key, cached)
+        # Fetch cached results of all tasks and clouds in one round trip.
+        calls = [(key, task, cloud) for key, task in periodic_tasks
+                 for cloud in clouds]
+        results = tasks.smart_delay_many([(task, (self.owner.id, cloud.id))
+                                          for _, task, cloud in calls])
+        for (key, task, cloud), cached in zip(calls, results):
+            if cached is None:
+                continue
+            log.info("Emitting %s from cache", key)
+            if key == 'list_machines':
+                cached['machines'] = filter_list_machines(
+                    self.auth_context, **cached
+                )
+                if cached['machines'] is None:
+                    continue
+            elif key == 'list_zones':
+                cached = filter_list_zones(
+                    self.auth_context, cloud.id, cached['zones']
+                )
+                if cached is None:
+                    continue
+            messages.append((key, cached))
+        return messages
 
+    @tornado.gen.coroutine
     def update_notifications(self):
         user = self.auth_context.user
         org = self.auth_context.org
-        notifications_json = InAppNotification.objects(
-            user=user, organization=org, dismissed=False).to_json()
+        notifications_json = yield run_in_thread(
+            lambda: InAppNotification.objects(
+                user=user, organization=org, dismissed=False).to_json()
+        )
         log.info("Emitting notifications list")
         self.send('notifications', notifications_json)
 
+    @tornado.gen.coroutine
     def check_monitoring(self):
         func = check_monitoring
         try:
-            self.send('monitoring', func(self.owner))
+            self.send('monitoring', (yield run_in_thread(func, self.owner)))
         except Exception as exc:
             log.warning("Check monitoring failed with: %r", exc)
 
@@ -429,12 +887,31 @@ class MainConnection(MistConnection):
         except Exception as exc:
             log.error("Exception in get_stats: %r", exc)
 
-    def process_update(self, ch, method, properties, body):
-        routing_key = method.routing_key
-        try:
-            result = json.loads(body)
-        except:
-            result = body
+    @tornado.gen.coroutine
+    def process_update(self, routing_key, result):
+        """Process an update, decoded by the shared consumer of the owner
+
+        The decoded update is shared by all connections of the owner, so it
+        must not be modified in place.
+
+        """
+        if routing_key == 'update' and config.SOCKJS_UPDATE_COALESCE_WINDOW:
+            # Coalesce sections of updates received within a short window.
+            if self.pending_sections:
+                self.pending_sections.update(result)
+                return
+            self.pending_sections.update(result)
+            yield tornado.gen.sleep(config.SOCKJS_UPDATE_COALESCE_WINDOW)
+            result = list(self.pending_sections)
+            self.pending_sections = set()
+            if self.closed:
+                return
+        # Process updates one at a time, in the order they were received.
+        with (yield self.lock.acquire()):
+            yield self._process_update(routing_key, result)
+
+    @tornado.gen.coroutine
+    def _process_update(self, routing_key, result):
         log.info("Got %s", routing_key)
         if routing_key in set(['notify', 'probe', 'list_sizes', 'list_images',
                                'list_networks', 'list_machines', 'list_zones',
@@ -442,107 +919,54 @@ class MainConnection(MistConnection):
                                'list_resource_groups',
                                'list_storage_accounts']):
             if routing_key == 'list_machines':
-                # probe newly discovered running machines
-                machines = result['machines']
-                cloud_id = result['cloud_id']
-                filtered_machines = filter_list_machines(
-                    self.auth_context, cloud_id, machines
-                )
-                if filtered_machines is not None:
-                    self.send(routing_key, {'cloud_id': cloud_id,
-                                            'machines': filtered_machines})
-                # update cloud machine count in multi-user setups
-                cloud = Cloud.objects.get(owner=self.owner, id=cloud_id,
-                                          deleted=None)
-                for machine in machines:
-                    bmid = (cloud_id, machine['machine_id'])
-                    if bmid in self.running_machines:
-                        # machine was running
-                        if machine['state'] != 'running':
-                            # machine no longer running
-                            self.running_machines.remove(bmid)
-                        continue
-                    if machine['state'] != 'running':
-                        # machine not running
-                        continue
-                    # machine just started running
-                    self.running_machines.add(bmid)
-
-                    ips = filter(lambda ip: ':' not in ip,
-                                 machine.get('public_ips', []))
-                    if not ips:
-                        # if not public IPs, search for private IPs, otherwise
-                        # continue iterating over the list of machines
-                        ips = filter(lambda ip: ':' not in ip,
-                                     machine.get('private_ips', []))
-                        if not ips:
-                            continue
-
-                    machine_obj = Machine.objects(
-                        cloud=cloud,
-                        machine_id=machine['machine_id'],
-                        key_associations__not__size=0
-                    ).first()
-                    if machine_obj:
-                        cached = tasks.ProbeSSH().smart_delay(
-                            self.owner.id, cloud_id, machine['machine_id'],
-                            ips[0], machine['id']
-                        )
-                        if cached is not None:
-                            self.send('probe', cached)
-
-                    cached = tasks.Ping().smart_delay(
-                        self.owner.id, cloud_id, machine['machine_id'], ips[0]
-                    )
-                    if cached is not None:
-                        self.send('ping', cached)
+                messages = yield run_in_thread(self._process_list_machines,
+                                               result)
+                for key, data in messages:
+                    self.send(key, data)
             elif routing_key == 'list_zones':
                 zones = result['zones']
+                if not self.auth_context.is_owner():
+                    # Filtering removes disallowed records in place.
+                    zones = copy.deepcopy(zones)
                 cloud_id = result['cloud_id']
-                filtered_zones = filter_list_zones(
-                    self.auth_context, cloud_id, zones
+                filtered_zones = yield run_in_thread(
+                    filter_list_zones, self.auth_context, cloud_id, zones
                 )
                 self.send(routing_key, filtered_zones)
             else:
                 self.send(routing_key, result)
 
         elif routing_key == 'update':
-            self.owner.reload()
+            yield run_in_thread(self.owner.reload)
             sections = result
             if 'clouds' in sections:
-                self.list_clouds()
+                yield self.list_clouds()
             if 'keys' in sections:
-                self.list_keys()
+                yield self.list_keys()
             if 'scripts' in sections:
-                self.list_scripts()
+                yield self.list_scripts()
             if 'schedules' in sections:
-                self.list_schedules()
+                yield self.list_schedules()
             if 'zones' in sections:
-                task = tasks.ListZones()
-                clouds = Cloud.objects(owner=self.owner,
-                                       enabled=True,
-                                       deleted=None)
-                for cloud in clouds:
-                    if cloud.dns_enabled:
-                        task.smart_delay(self.owner.id, cloud.id)
+                yield run_in_thread(self._list_zones)
             if 'templates' in sections:
-                self.list_templates()
+                yield self.list_templates()
             if 'stacks' in sections:
-                self.list_stacks()
+                yield self.list_stacks()
             if 'tags' in sections:
-                self.list_tags()
+                yield self.list_tags()
             if 'tunnels' in sections:
-                self.list_tunnels()
+                yield self.list_tunnels()
             if 'notifications' in sections:
-                self.update_notifications()
+                yield self.update_notifications()
             if 'monitoring' in sections:
-                self.check_monitoring()
+                yield self.check_monitoring()
             if 'user' in sections:
-                self.auth_context.user.reload()
-                self.update_user()
+                yield run_in_thread(self.auth_context.user.reload)
+                yield self.update_user()
             if 'org' in sections:
-                self.auth_context.org.reload()
-                self.update_org()
+                yield run_in_thread(self.auth_context.org.reload)
+                yield self.update_org()
 
         elif routing_key == 'patch_notifications':
             if json.loads(result).get('user') == self.user.id:
@@ -552,22 +976,100 @@ class MainConnection(MistConnection):
             cloud_id = result['cloud_id']
             patch = result['patch']
             machine_ids = []
+            paths = []
             for line in patch:
-                machine_id, line['path'] = line['path'][1:].split('-', 1)
+                machine_id, path = line['path'][1:].split('-', 1)
                 machine_ids.append(machine_id)
+                paths.append(path)
             if not self.auth_context.is_owner():
-                allowed_machine_ids = filter_machine_ids(self.auth_context,
-                                                         cloud_id, machine_ids)
+                allowed_machine_ids = yield run_in_thread(
+                    filter_machine_ids, self.auth_context, cloud_id,
+                    machine_ids
+                )
             else:
                 allowed_machine_ids = machine_ids
-            patch = [line for line, m_id in zip(patch, machine_ids)
+            patch = [dict(line, path='/clouds/%s/machines/%s' % (cloud_id,
+                                                                 path))
+                     for line, path, m_id in zip(patch, paths, machine_ids)
                      if m_id in allowed_machine_ids]
-            for line in patch:
-                line['path'] = '/clouds/%s/machines/%s' % (cloud_id,
-                                                           line['path'])
             if patch:
+                if self.versions is not None:
+                    # The client's snapshot won't match any version anymore.
+                    self.versions.pop('list_machines:%s' % cloud_id, None)
                 self.send('patch_model', patch)
 
+    def _process_list_machines(self, result):
+        """Return the messages to send for a list_machines update
+
+        This performs blocking calls and runs in the executor's threads.
+        """
+        messages = []
+        # probe newly discovered running machines
+        machines = result['machines']
+        cloud_id = result['cloud_id']
+        filtered_machines = filter_list_machines(
+            self.auth_context, cloud_id, machines
+        )
+        if filtered_machines is not None:
+            messages.append(('list_machines',
+                             {'cloud_id': cloud_id,
+                              'machines': filtered_machines}))
+        # update cloud machine count in multi-user setups
+        cloud = Cloud.objects.get(owner=self.owner, id=cloud_id,
+                                  deleted=None)
+        for machine in machines:
+            bmid = (cloud_id, machine['machine_id'])
+            if bmid in self.running_machines:
+                # machine was running
+                if machine['state'] != 'running':
+                    # machine no longer running
+                    self.running_machines.remove(bmid)
+                continue
+            if machine['state'] != 'running':
+                # machine not running
+                continue
+            # machine just started running
+            self.running_machines.add(bmid)
+
+            ips = filter(lambda ip: ':' not in ip,
+                         machine.get('public_ips', []))
+            if not ips:
+                # if not public IPs, search for private IPs, otherwise
+                # continue iterating over the list of machines
+                ips = filter(lambda ip: ':' not in ip,
+                             machine.get('private_ips', []))
+                if not ips:
+                    continue
+
+            machine_obj = Machine.objects(
+                cloud=cloud,
+                machine_id=machine['machine_id'],
+                key_associations__not__size=0
+            ).first()
+            if machine_obj:
+                cached = tasks.ProbeSSH().smart_delay(
+                    self.owner.id, cloud_id, machine['machine_id'],
+                    ips[0], machine['id']
+                )
+                if cached is not None:
+                    messages.append(('probe', cached))
+
+            cached = tasks.Ping().smart_delay(
+                self.owner.id, cloud_id, machine['machine_id'], ips[0]
+            )
+            if cached is not None:
+                messages.append(('ping', cached))
+        return messages
+
+    def _list_zones(self):
+        task = tasks.ListZones()
+        clouds = Cloud.objects(owner=self.owner,
+                               enabled=True,
+                               deleted=None)
+        for cloud in clouds:
+            if cloud.dns_enabled:
+                task.smart_delay(self.owner.id, cloud.id)
+
     def on_close(self, stale=False):
         if not self.closed:
             kwargs = {}
@@ -575,11 +1077,9 @@ class MainConnection(MistConnection):
                 kwargs['stale'] = True
             kwargs.update(self.log_kwargs)
             log_event(action='disconnect', **kwargs)
-        if self.consumer is not None:
-            try:
-                self.consumer.stop()
-            except Exception as exc:
-                log.error("Error closing pika consumer: %r", exc)
+        if self.subscribed:
+            self.subscribed = False
+            owner_updates_hub.unsubscribe(self.owner.id, self)
         super(MainConnection, self).on_close(stale=stale)
 
 
@@ -589,7 +1089,7 @@ class LogsConnection(MistConnection):
         """Open a new connection bound to the current Organization."""
         super(LogsConnection, self).on_open(conn_info)
         self.enabled = True
-        self.consumer = None
+        self.subscribed = False
         self.enforce_logs_for = self.auth_context.org.id
 
     def on_ready(self):
@@ -598,10 +1098,9 @@ class LogsConnection(MistConnection):
             for stype in ('incident', 'job', 'shell', 'session'):
                 self.send('open_' + stype + 's', [])
             return
-        if self.consumer is None:
-            self.consumer = LogsConsumer(self.enforce_logs_for or '*',
-                                         self.emit_event)
-            self.consumer.run()
+        if not self.subscribed:
+            self.subscribed = True
+            logs_hub.subscribe(self.enforce_logs_for or '*', self)
         else:
             log.error("It seems we have received 'on_ready' more than once.")
         for stype in ('incident', 'job', 'shell', 'session'):
@@ -610,12 +1109,6 @@ class LogsConnection(MistConnection):
     def emit_event(self, event):
         """Emit a new event consumed from RabbitMQ."""
         log.info('Received event from amqp')
-        event.pop('_id', None)
-        try:
-            for key, value in json.loads(event.pop('extra')).iteritems():
-                event[key] = value
-        except:
-            pass
         for stype in set([stype for _, stype, _ in event.get('stories', [])]):
             self.send_stories(stype)
         if self.filter_log(event):
@@ -680,12 +1173,10 @@ class LogsConnection(MistConnection):
         return event
 
     def on_close(self, stale=False):
-        """Stop the Consumer and close the WebSocket."""
-        if self.consumer is not None:
-            try:
-                self.consumer.stop()
-            except Exception as exc:
-                log.error("Error closing pika consumer: %r", exc)
+        """Unsubscribe from the shared Consumer and close the WebSocket."""
+        if self.subscribed:
+            self.subscribed = False
+            logs_hub.unsubscribe(self.enforce_logs_for or '*', self)
         super(LogsConnection, self).on_close(stale=stale)
 
 
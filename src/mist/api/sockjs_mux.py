@@ -1,23 +1,97 @@
 import json
 import time
+import zlib
+import base64
 import logging
 
 from sockjs.tornado import conn, session
 from sockjs.tornado.transports import base
 
+from mist.api import config
+
 
 log = logging.getLogger(__name__)
 
 
+# Capabilities a client may request when connecting, see
+# `MultiplexConnection.negotiate`.
+CAPABILITIES = ('zlib', 'compact')
+
+
+class MessageStats(object):
+    """Count bytes sent per message type, to measure the bytes saved
+
+    For each message type, the number of messages, the bytes they'd take if
+    sent as plain JSON and the bytes actually sent are recorded, and logged
+    every `SOCKJS_MESSAGE_STATS_INTERVAL` seconds, if set.
+
+    """
+
+    def __init__(self):
+        self._stats = {}
+        self._since = time.time()
+
+    @property
+    def enabled(self):
+        return bool(config.SOCKJS_MESSAGE_STATS_INTERVAL)
+
+    def record(self, msg_type, original, sent):
+        stats = self._stats.setdefault(msg_type, [0, 0, 0])
+        stats[0] += 1
+        stats[1] += original
+        stats[2] += sent
+        if time.time() - self._since >= config.SOCKJS_MESSAGE_STATS_INTERVAL:
+            self.report()
+
+    def report(self):
+        """Log and reset the stats recorded so far"""
+        log.info("Websocket messages of the last %d seconds:",
+                 time.time() - self._since)
+        for msg_type, (count, original, sent) in sorted(
+                self._stats.items(), key=lambda item: -item[1][1]):
+            log.info("    %s: %d messages, %d bytes, %d sent, %.1f%% saved",
+                     msg_type, count, original, sent,
+                     100.0 * (original - sent) / (original or 1))
+        self._stats = {}
+        self._since = time.time()
+
+
+# Stats of all connections of the same process.
+message_stats = MessageStats()
+
+
 class ChannelSession(session.BaseSession):
     def __init__(self, conn, server, base, name):
         super(ChannelSession, self).__init__(conn, server)
         self.base = base
         self.name = name
 
-    def send_message(self, msg, stats=True, binary=False):
+    @property
+    def capabilities(self):
+        return self.base.capabilities
+
+    def send_message(self, msg, stats=True, binary=False,
+                     msg_type=None, original_size=None):
+        """Send msg, compressed with zlib if large and the client supports it
+
+        Compressed messages are base64 encoded and sent as `zmsg` frames.
+        If `msg_type` is given, the message is recorded in `message_stats`.
+        `original_size` is the size msg would have if it weren't compacted.
+
+        """
         # TODO: Handle stats
-        self.base.send('msg,' + self.name + ',' + msg)
+        frame = 'msg,' + self.name + ',' + msg
+        if ('zlib' in self.base.capabilities and
+                len(msg) >= config.SOCKJS_COMPRESSION_THRESHOLD):
+            compressed = base64.b64encode(
+                zlib.compress(msg, config.SOCKJS_COMPRESSION_LEVEL)
+            )
+            if len(compressed) < len(msg):
+                frame = 'zmsg,' + self.name + ',' + compressed
+        self.base.send(frame)
+        if msg_type is not None and message_stats.enabled:
+            original = (original_size or len(msg)) + len(self.name) + 5
+            message_stats.record(msg_type, original, len(frame))
 
     def on_message(self, msg):
         msg_parts = msg.split(',', 1)
@@ -59,6 +133,8 @@ class MultiplexConnection(conn.SockJSConnection):
 
     last_rcv = 0
 
+    capabilities = frozenset()
+
     def on_open(self, info):
         self.endpoints = dict()
         self.handler = DummyHandler(self.session.conn_info)
@@ -68,6 +144,10 @@ class MultiplexConnection(conn.SockJSConnection):
         if msg == 'h':
             return
 
+        if msg.startswith('cap,'):
+            self.negotiate(msg[4:])
+            return
+
         parts = msg.split(',', 2)
         op, chan = parts[0], parts[1]
 
@@ -93,6 +173,27 @@ class MultiplexConnection(conn.SockJSConnection):
 
                 self.endpoints[chan] = session
 
+    def negotiate(self, requested):
+        """Enable the requested capabilities that are supported
+
+        Clients may send `cap,<JSON list of capabilities>`, preferably before
+        subscribing to any channels. The capabilities enabled are sent back
+        in the same format. Supported capabilities are:
+
+        zlib: Large messages are compressed and sent as `zmsg` frames.
+        compact: Large lists of objects with the same keys are encoded as
+            `{"__columns__": [keys], "__rows__": [[values], ...]}`.
+
+        """
+        try:
+            requested = json.loads(requested)
+        except ValueError:
+            log.warning("Couldn't json parse capabilities: %r", requested)
+            requested = []
+        enabled = [cap for cap in CAPABILITIES if cap in requested]
+        self.capabilities = frozenset(enabled)
+        self.send('cap,' + json.dumps(enabled))
+
     def on_close(self):
         for chan in self.endpoints:
             self.endpoints[chan]._close()
@@ -1,4 +1,3 @@
-from mongoengine import Q
 from mist.api.tag.models import Tag
 from mist.api.helpers import trigger_session_update
 from mist.api.helpers import get_object_with_id
@@ -6,7 +5,45 @@ from mist.api.helpers import get_object_with_id
 
 def get_tags_for_resource(owner, resource_obj, *args, **kwargs):
     return [{'key': tag.key, 'value': tag.value} for tag in
-            Tag.objects(owner=owner, resource=resource_obj)]
+            Tag.objects(owner=owner, resource=resource_obj).only('key',
+                                                                 'value')]
+
+
+def update_cached_tags(owner, resource_obj):
+    """Store the tags of a resource on the resource's document
+
+    Resource models that define a `cached_tags` field keep a denormalized
+    copy of their tags, in the same format as returned by
+    `get_tags_for_resource`, so that their tags can be read without querying
+    the tag collection. A `cached_tags` value of None means that the tags of
+    the resource haven't been cached yet.
+
+    This must be called every time the tags of a resource change.
+    """
+    if 'cached_tags' not in resource_obj._fields:
+        return
+    tags = get_tags_for_resource(owner, resource_obj)
+    resource_obj.__class__.objects(id=resource_obj.id).update(
+        set__cached_tags=tags
+    )
+    resource_obj._data['cached_tags'] = tags
+
+
+def get_tags_for_resources(owner, resources):
+    """Return a dict mapping the id of each resource to a list of its tags
+
+    Tags of all given resources are fetched with a single query.
+    """
+    tags = {resource.id: [] for resource in resources}
+    if not tags:
+        return tags
+    for tag in Tag.objects(owner=owner, resource__in=resources).only(
+            'key', 'value', 'resource').as_pymongo():
+        resource_id = tag['resource']['_ref'].id
+        if resource_id in tags:
+            tags[resource_id].append({'key': tag['key'],
+                                      'value': tag.get('value')})
+    return tags
 
 
 def add_tags_to_resource(owner, resource_obj, tags, *args, **kwargs):
@@ -36,6 +73,8 @@ def add_tags_to_resource(owner, resource_obj, tags, *args, **kwargs):
     for key, value in tag_dict.iteritems():
         Tag(owner=owner, resource=resource_obj, key=key, value=value).save()
 
+    update_cached_tags(owner, resource_obj)
+
     # SEC
     owner.mapper.update(resource_obj)
 
@@ -61,15 +100,10 @@ def remove_tags_from_resource(owner, resource_obj, tags, *args, **kwargs):
     # raise exception for duplicates in query
     key_list = list(set(tags))
 
-    # create a query that will return all the tags with
-    query = reduce(lambda q1, q2: q1.__or__(q2),
-                   map(lambda key: Q(key=key), key_list))
-
-    Tag.objects(Q(owner=owner) & Q(resource=resource_obj) & (query)).delete()
+    Tag.objects(owner=owner, resource=resource_obj,
+                key__in=key_list).delete()
 
-    # I think that the above overly complex query could simply be rewritten as
-    # Tag.objects(owner=owner, resource=resource_obj,
-    #             key__in=key_list).delete()
+    update_cached_tags(owner, resource_obj)
 
     # SEC
     owner.mapper.update(resource_obj)
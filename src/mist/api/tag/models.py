@@ -26,6 +26,19 @@ class Tag(me.Document):
                 'unique': True,
                 'cls': False,
             },
+            # Following indexes cover lookups of the tags of a resource and
+            # of the resources that have a given tag, such as those done to
+            # resolve tagging conditions.
+            {
+                'fields': ['owner', 'resource'],
+                'sparse': False,
+                'cls': False,
+            },
+            {
+                'fields': ['owner', 'resource_type', 'key', 'value'],
+                'sparse': False,
+                'cls': False,
+            },
         ],
     }
 
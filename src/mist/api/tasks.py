@@ -2,7 +2,9 @@ import os
 import re
 import uuid
 import json
+import hashlib
 import logging
+import datetime
 from time import time
 
 import paramiko
@@ -10,8 +12,6 @@ import paramiko
 from libcloud.compute.types import NodeState
 from libcloud.container.base import Container
 
-from base64 import b64encode
-
 from memcache import Client as MemcacheClient
 
 from celery import group
@@ -551,33 +551,54 @@ class UserTask(Task):
             self._ut_cache = MemcacheClient(config.MEMCACHED_HOST)
         return self._ut_cache
 
+    def cache_key(self, args, kwargs):
+        """Return the memcache key of the result of a task call
+
+        Keys are hashed, so that they're short and always valid memcache keys.
+        The key of the task's recent errors and of its refresh lease are
+        derived from it by appending ':error' and ':lease' respectively.
+
+        """
+        id_str = json.dumps([self.task_key, args, kwargs], sort_keys=True)
+        return 'ut:%s:%s' % (self.task_key, hashlib.sha1(id_str).hexdigest())
+
     def smart_delay(self, *args, **kwargs):
         """Return cached result if it exists, send job to celery if needed"""
-        # check cache
-        id_str = json.dumps([self.task_key, args, kwargs])
-        cache_key = b64encode(id_str)
+        blocking = kwargs.pop('blocking', None)
+        cache_key = self.cache_key(args, kwargs)
         cached = self.memcache.get(cache_key)
-        if cached:
-            age = time() - cached['timestamp']
-            if age > self.result_fresh:
-                amqp_log("%s: scheduling task" % id_str)
-                if kwargs.pop('blocking', None):
-                    return self.execute(*args, **kwargs)
-                else:
-                    self.delay(*args, **kwargs)
-            if age < self.result_expires:
-                amqp_log("%s: smart delay cache hit" % id_str)
-                return cached['payload']
-        else:
-            if kwargs.pop('blocking', None):
+        return self.handle_cached(cached, cache_key, args, kwargs, blocking)
+
+    def handle_cached(self, cached, cache_key, args, kwargs, blocking=False):
+        """Refresh a cached result if needed, return its payload if valid
+
+        Stale results are returned, as long as they haven't expired, while
+        they are being refreshed in the background. Concurrent callers are
+        coalesced into a single refresh, by acquiring a short lease.
+
+        """
+        age = time() - cached['timestamp'] if cached else None
+        if age is None or age > self.result_fresh:
+            if blocking:
                 return self.execute(*args, **kwargs)
-            else:
+            if self.acquire_lease(cache_key):
+                amqp_log("%s: scheduling task" % cache_key)
                 self.delay(*args, **kwargs)
+        if age is not None and age < self.result_expires:
+            amqp_log("%s: smart delay cache hit" % cache_key)
+            return cached['payload']
+
+    def acquire_lease(self, cache_key):
+        """Return True if no other refresh of the result is in flight"""
+        if self.memcache.add(cache_key + ':lease', time(),
+                             time=config.USER_TASK_LEASE_TIME):
+            return True
+        # Memcache is unavailable, carry on without coalescing.
+        return not self.memcache.get(cache_key + ':lease')
 
     def clear_cache(self, *args, **kwargs):
-        id_str = json.dumps([self.task_key, args, kwargs])
-        cache_key = b64encode(id_str)
-        log.info("Clearing cache for '%s'", id_str)
+        cache_key = self.cache_key(args, kwargs)
+        log.info("Clearing cache for '%s'", cache_key)
         return self.memcache.delete(cache_key)
 
     def run(self, *args, **kwargs):
@@ -591,8 +612,11 @@ class UserTask(Task):
         # same arguments. it is empty on first run, constant afterwards
         seq_id = kwargs.pop('seq_id', '')
         id_str = json.dumps([self.task_key, args, kwargs])
-        cache_key = b64encode(id_str)
-        cached_err = self.memcache.get(cache_key + 'error')
+        cache_key = self.cache_key(args, kwargs)
+        error_key, lease_key = cache_key + ':error', cache_key + ':lease'
+        cached_values = self.memcache.get_multi([cache_key, error_key])
+        cached, cached_err = cached_values.get(cache_key), \
+            cached_values.get(error_key)
         if cached_err:
             # task has been failing recently
             if seq_id != cached_err['seq_id']:
@@ -606,10 +630,9 @@ class UserTask(Task):
                     #self.memcache.delete(cache_key + 'error')
         if not amqp_owner_listening(owner_id):
             # noone is waiting for result, stop trying, but flush cached erros
-            self.memcache.delete(cache_key + 'error')
+            self.memcache.delete_multi([error_key, lease_key])
             return
         # check cache to stop iteration if other sequence has started
-        cached = self.memcache.get(cache_key)
         if cached:
             if seq_id and seq_id != cached['seq_id']:
                 amqp_log("%s: found new cached seq_id [%s], "
@@ -620,6 +643,7 @@ class UserTask(Task):
             elif not seq_id and time() - cached['timestamp'] < self.result_fresh:
                 amqp_log("%s: fresh task submitted with fresh cached result "
                          ", dropping" % id_str)
+                self.memcache.delete(lease_key)
                 return
         if not seq_id:
             # this task is called externally, not a rerun, create a seq_id
@@ -640,23 +664,27 @@ class UserTask(Task):
             rel_points = [x - x0 for x in cached_err['timestamps']]
             rerun = self.error_rerun_handler(exc, rel_points, *args, **kwargs)
             if rerun is not None:
-                self.memcache.set(cache_key + 'error', cached_err)
+                self.memcache.set(error_key, cached_err)
                 kwargs['seq_id'] = seq_id
                 self.apply_async(args, kwargs, countdown=rerun)
             else:
-                self.memcache.delete(cache_key + 'error')
+                self.memcache.delete(error_key)
+            self.memcache.delete(lease_key)
             amqp_log("%s: error %r, rerun %s" % (id_str, exc, rerun))
             return
         else:
-            self.memcache.delete(cache_key + 'error')
+            self.memcache.delete(error_key)
         cached = {'timestamp': time(), 'payload': data, 'seq_id': seq_id}
         ok = amqp_publish_user(owner_id, routing_key=self.task_key, data=data)
         if not ok:
             # echange closed, no one gives a shit, stop repeating, why try?
             amqp_log("%s: exchange closed" % id_str)
+            self.memcache.delete(lease_key)
             return
         kwargs['seq_id'] = seq_id
-        self.memcache.set(cache_key, cached)
+        self.memcache.set(cache_key, cached, time=self.result_expires)
+        # Let the next stale read trigger a refresh.
+        self.memcache.delete(lease_key)
         if self.polling:
             amqp_log("%s: will rerun in %d secs [%s]" % (id_str,
                                                          self.result_fresh,
@@ -677,6 +705,22 @@ class UserTask(Task):
             return 60 * 10  # Retry in 10mins after the third error
 
 
+def smart_delay_many(calls):
+    """Call `smart_delay` of many user tasks, fetching results at once
+
+    `calls` is a list of (task, args) tuples. Cached results of all calls are
+    fetched from memcache in a single round trip. Return the list of their
+    payloads, or None where no valid result is cached, in the same order.
+
+    """
+    if not calls:
+        return []
+    keys = [task.cache_key(args, {}) for task, args in calls]
+    cached = calls[0][0].memcache.get_multi(list(set(keys)))
+    return [task.handle_cached(cached.get(key), key, args, {})
+            for (task, args), key in zip(calls, keys)]
+
+
 class ListSizes(UserTask):
     abstract = False
     task_key = 'list_sizes'
@@ -1498,14 +1542,35 @@ def revoke_token(token):
 
 @app.task
 def update_poller(org_id):
+    """Increase polling frequency of an organization's clouds and machines
+
+    This is triggered periodically by every open session. Concurrent requests
+    of the same organization are coalesced and the organization is skipped
+    while its override intervals are still fresh.
+
+    """
+    ttl = 120
+    cache = MemcacheClient(config.MEMCACHED_HOST)
+    cache_key = 'update_poller:%s' % org_id
+    # Overrides are refreshed once half of their TTL has passed.
+    if not cache.add(cache_key, time(), time=ttl / 2):
+        if cache.get(cache_key):
+            log.info("Poller for %s is up to date", org_id)
+            return
+        # Memcache is unavailable, carry on without coalescing.
     org = Organization.objects.get(id=org_id)
     log.info("Updating poller for %s", org)
-    for cloud in Cloud.objects(owner=org, deleted=None, enabled=True):
+    clouds = list(Cloud.objects(owner=org, deleted=None, enabled=True))
+    for cloud in clouds:
         log.info("Updating poller for cloud %s", cloud)
-        ListMachinesPollingSchedule.add(cloud=cloud, interval=10, ttl=120)
-        for machine in cloud.ctl.compute.list_cached_machines():
-            log.info("Updating poller for machine %s", machine)
-            PingProbeMachinePollingSchedule.add(machine=machine,
-                                                interval=90, ttl=120)
-            SSHProbeMachinePollingSchedule.add(machine=machine,
-                                               interval=90, ttl=120)
+        ListMachinesPollingSchedule.add(cloud=cloud, interval=10, ttl=ttl)
+    # Fetch cached machines of all clouds with a single query.
+    machine_ids = Machine.objects(
+        cloud__in=clouds, missing_since=None,
+        last_seen__gt=datetime.datetime.utcnow() - datetime.timedelta(days=1),
+    ).scalar('id')
+    machine_ids = list(machine_ids)
+    log.info("Updating poller for %d machines of %s", len(machine_ids), org)
+    for schedule_cls in (PingProbeMachinePollingSchedule,
+                         SSHProbeMachinePollingSchedule):
+        schedule_cls.add_many(machine_ids, interval=90, ttl=ttl)
@@ -0,0 +1,73 @@
+"""Run blocking calls off the Tornado IOLoop
+
+Database queries and other blocking calls made by sockjs connections would
+stall every other connection of the process if run on the IOLoop. The
+`ThreadPoolExecutor` defined here runs them in a bounded pool of threads and
+returns Tornado futures, which are resolved on the IOLoop, so that they can
+be yielded from coroutines:
+
+    @tornado.gen.coroutine
+    def list_keys(self):
+        keys = yield run_in_thread(filter_list_keys, self.auth_context)
+        self.send('list_keys', keys)
+
+"""
+
+import os
+import sys
+import logging
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+from tornado.ioloop import IOLoop
+from tornado.concurrent import Future
+
+from mist.api import config
+
+
+log = logging.getLogger(__name__)
+
+
+class ThreadPoolExecutor(object):
+    """Run blocking calls in a pool of threads, returning Tornado futures"""
+
+    def __init__(self, size=None):
+        self.size = size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._pool = None
+
+    def _get_pool(self):
+        """Return the thread pool, initializing it after forking"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pool = ThreadPool(self.size or
+                                        config.SOCKJS_EXECUTOR_THREADS)
+            return self._pool
+
+    def submit(self, func, *args, **kwargs):
+        """Call func in a thread, return a future resolved on the IOLoop"""
+        future = Future()
+        io_loop = IOLoop.current()
+
+        def run():
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                io_loop.add_callback(future.set_exc_info, sys.exc_info())
+            else:
+                io_loop.add_callback(future.set_result, result)
+
+        self._get_pool().apply_async(run)
+        return future
+
+
+# Executor shared by all connections of the same process.
+executor = ThreadPoolExecutor()
+
+
+def run_in_thread(func, *args, **kwargs):
+    """Call func in the shared thread pool, return a Tornado future"""
+    return executor.submit(func, *args, **kwargs)
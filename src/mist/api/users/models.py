@@ -227,6 +227,12 @@ class Owner(me.Document):
 
     last_active = me.DateTimeField()
 
+    # Saving changes to any of these fields drops the cached auth tokens of
+    # this owner, see `save`. Changes to other fields, e.g. counters updated
+    # while polling, may be served stale from the cache for up to
+    # `AUTH_CACHE_TTL` seconds.
+    AUTH_FIELDS = ('activation_date', )
+
     meta = {
         'allow_inheritance': True,
         'ordering': ['-activation_date'],
@@ -266,6 +272,25 @@ class Owner(me.Document):
                 self.emails = emails
         super(Owner, self).clean()
 
+    def save(self, *args, **kwargs):
+        # Drop cached auth tokens of this user or org in all processes, if
+        # any field that affects authentication or authorization changed.
+        changed = set(field.split('.')[0]
+                      for field in self._get_changed_fields())
+        invalidate = not self._created and changed & set(self.AUTH_FIELDS)
+        result = super(Owner, self).save(*args, **kwargs)
+        if invalidate:
+            # FIXME: Resolve circular import issues
+            from mist.api.auth.cache import invalidate_auth_cache
+            invalidate_auth_cache(owner_ids=[self.id])
+        return result
+
+    def delete(self, *args, **kwargs):
+        super(Owner, self).delete(*args, **kwargs)
+        # FIXME: Resolve circular import issues
+        from mist.api.auth.cache import invalidate_auth_cache
+        invalidate_auth_cache(owner_ids=[self.id])
+
 
 class User(Owner):
     email = HtmlSafeStrField()
@@ -312,6 +337,11 @@ class User(Owner):
 
     ips = me.EmbeddedDocumentListField(WhitelistIP, default=[])
 
+    AUTH_FIELDS = Owner.AUTH_FIELDS + (
+        'email', 'username', 'password', 'status', 'role', 'ips',
+        'can_create_org', 'beta_access', 'selected_plan', 'enterprise_plan',
+    )
+
     meta = {
         'indexes': [
             {
@@ -488,6 +518,11 @@ class Organization(Owner):
     super_org = me.BooleanField(default=False)
     parent = me.ReferenceField('Organization', required=False)
 
+    AUTH_FIELDS = Owner.AUTH_FIELDS + (
+        'name', 'members', 'teams', 'selected_plan', 'enterprise_plan',
+        'enable_r12ns', 'insights_enabled', 'super_org', 'parent',
+    )
+
     @property
     def mapper(self):
         """Returns the `PermissionMapper` for the current Org context."""
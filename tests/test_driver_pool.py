@@ -0,0 +1,105 @@
+import gc
+import threading
+
+import pytest
+
+from mist.api.clouds.controllers import base
+from mist.api.clouds.controllers.base import ConnectionProxy, DriverPool
+
+
+class Driver(object):
+    closed = False
+
+    def disconnect(self):
+        self.closed = True
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(base.time, 'time', lambda: clock[0])
+    return clock
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = DriverPool(size=3, max_idle=60)
+    monkeypatch.setattr(base, 'driver_pool', pool)
+    return pool
+
+
+class TestDriverPool(object):
+
+    def test_checkout_checkin(self, pool):
+        driver = Driver()
+        assert pool.checkout(('Ctl', 'c1', 'x')) is None
+        pool.checkin(('Ctl', 'c1', 'x'), driver)
+        assert pool.checkout(('Ctl', 'c1', 'y')) is None
+        assert pool.checkout(('Ctl', 'c1', 'x')) is driver
+        assert pool.checkout(('Ctl', 'c1', 'x')) is None
+        assert not driver.closed
+
+    def test_lru_eviction(self, pool):
+        drivers = [Driver() for _ in range(4)]
+        for i, driver in enumerate(drivers):
+            pool.checkin(('Ctl', 'c%d' % i, 'x'), driver)
+        assert drivers[0].closed
+        assert not any(driver.closed for driver in drivers[1:])
+        assert pool.checkout(('Ctl', 'c0', 'x')) is None
+        assert pool.checkout(('Ctl', 'c3', 'x')) is drivers[3]
+
+    def test_idle_eviction(self, pool, clock):
+        old, new = Driver(), Driver()
+        pool.checkin(('Ctl', 'c1', 'x'), old)
+        clock[0] += 45
+        pool.checkin(('Ctl', 'c2', 'x'), new)
+        clock[0] += 30
+        assert pool.checkout(('Ctl', 'c1', 'x')) is None
+        assert old.closed
+        assert pool.checkout(('Ctl', 'c2', 'x')) is new
+        assert not new.closed
+
+    def test_invalidate(self, pool):
+        drivers = [Driver(), Driver(), Driver()]
+        pool.checkin(('Ctl', 'c1', 'x'), drivers[0])
+        pool.checkin(('Other', 'c1', 'x'), drivers[1])
+        pool.checkin(('Ctl', 'c2', 'x'), drivers[2])
+        pool.invalidate('c1')
+        assert drivers[0].closed and drivers[1].closed
+        assert not drivers[2].closed
+        assert pool.checkout(('Ctl', 'c1', 'x')) is None
+        assert pool.checkout(('Ctl', 'c2', 'x')) is drivers[2]
+
+    def test_reset_after_fork(self, pool, monkeypatch):
+        idle, released = Driver(), Driver()
+        pool.checkin(('Ctl', 'c1', 'x'), idle)
+        pool.release(('Ctl', 'c2', 'x'), released)
+        monkeypatch.setattr(base.os, 'getpid', lambda: -1)
+        assert pool.checkout(('Ctl', 'c1', 'x')) is None
+        assert pool.checkout(('Ctl', 'c2', 'x')) is None
+        # Drivers of the parent share its sockets, so they're not closed.
+        assert not idle.closed and not released.closed
+
+    def test_garbage_collected_proxy(self, pool):
+        driver = Driver()
+        proxy = ConnectionProxy(driver, pool_key=('Ctl', 'c1', 'x'))
+        del proxy
+        gc.collect()
+        assert pool.checkout(('Ctl', 'c1', 'x')) is driver
+        assert not driver.closed
+
+    def test_finalizer_while_pool_locked(self, pool):
+        driver = Driver()
+
+        def collect():
+            proxy = ConnectionProxy(driver, pool_key=('Ctl', 'c1', 'x'))
+            with pool._lock:
+                del proxy
+                gc.collect()
+
+        thread = threading.Thread(target=collect)
+        thread.daemon = True
+        thread.start()
+        thread.join(5)
+        assert not thread.is_alive()
+        assert pool.checkout(('Ctl', 'c1', 'x')) is driver
@@ -0,0 +1,97 @@
+import copy
+
+import jsonpatch
+
+from mist.api.helpers import IPWhitelist
+from mist.api.helpers import make_patch_by_key
+from mist.api.helpers import unpack_machines_inventory
+
+
+class TestIPWhitelist(object):
+
+    def test_cidr_match(self):
+        whitelist = IPWhitelist(['10.0.0.0/24', '192.168.1.7/32'])
+        assert '10.0.0.1' in whitelist
+        assert '10.0.0.255' in whitelist
+        assert '10.0.1.0' not in whitelist
+        assert '192.168.1.7' in whitelist
+        assert '192.168.1.8' not in whitelist
+
+    def test_overlapping_and_adjacent_cidrs(self):
+        whitelist = IPWhitelist(['10.0.0.0/25', '10.0.0.128/25',
+                                 '10.0.0.0/16', '10.2.0.0/16'])
+        assert '10.0.0.200' in whitelist
+        assert '10.0.255.255' in whitelist
+        assert '10.1.0.0' not in whitelist
+        assert '10.2.3.4' in whitelist
+
+    def test_ipv6(self):
+        whitelist = IPWhitelist(['10.0.0.0/8', '2001:db8::/32'])
+        assert '2001:db8::1' in whitelist
+        assert '2001:db9::1' not in whitelist
+        assert '::ffff:0a00:0001' not in whitelist
+
+    def test_empty_whitelist(self):
+        whitelist = IPWhitelist([])
+        assert '127.0.0.1' not in whitelist
+        assert '::1' not in whitelist
+
+
+class TestMakePatchByKey(object):
+    old = {
+        'a': {'id': 'a', 'state': 'running', 'ips': ['10.0.0.1'],
+              'extra': {'tags': {'env': 'dev'}}},
+        'b': {'id': 'b', 'state': 'stopped', 'ips': []},
+        'c/~1': {'id': 'c/~1', 'state': 'running', 'ips': []},
+        'd': {'id': 'd', 'state': 'running', 'ips': []},
+    }
+
+    def make_new(self):
+        new = copy.deepcopy(self.old)
+        new['a']['state'] = 'stopped'
+        new['a']['ips'].append('10.0.0.2')
+        new['a']['extra']['tags'] = {'env': 'prod', 'team': 'ops'}
+        new['c/~1']['state'] = 'stopped'
+        del new['b']
+        new['e/f'] = {'id': 'e/f', 'state': 'pending', 'ips': []}
+        return new
+
+    def test_same_result_as_jsonpatch(self):
+        new = self.make_new()
+        patch = make_patch_by_key(self.old, new)
+        assert jsonpatch.apply_patch(self.old, patch) == new
+        assert jsonpatch.apply_patch(self.old, patch) == \
+            jsonpatch.apply_patch(self.old, jsonpatch.make_patch(self.old,
+                                                                 new))
+
+    def test_only_changed_documents(self):
+        new = self.make_new()
+        paths = set(op['path'].split('/')[1]
+                    for op in make_patch_by_key(self.old, new))
+        assert paths == {'a', 'b', 'c~1~01', 'e~1f'}
+
+    def test_no_changes(self):
+        assert make_patch_by_key(self.old, copy.deepcopy(self.old)) == []
+        assert make_patch_by_key({}, {}) == []
+
+
+class TestUnpackMachinesInventory(object):
+
+    def test_per_machine_message(self):
+        data = {'owner_id': 'o', 'machine_id': 'm1', 'cost_per_month': 5}
+        assert unpack_machines_inventory(data) == [data]
+
+    def test_per_cloud_message(self):
+        data = {'owner_id': 'o', 'cloud_id': 'c',
+                'machine_ids': ['m1', 'm2'], 'costs_per_month': [5, 0]}
+        assert unpack_machines_inventory(data) == [
+            {'owner_id': 'o', 'cloud_id': 'c', 'machine_id': 'm1',
+             'cost_per_month': 5},
+            {'owner_id': 'o', 'cloud_id': 'c', 'machine_id': 'm2',
+             'cost_per_month': 0},
+        ]
+
+    def test_per_cloud_message_without_machines(self):
+        data = {'owner_id': 'o', 'cloud_id': 'c',
+                'machine_ids': [], 'costs_per_month': []}
+        assert unpack_machines_inventory(data) == []
@@ -0,0 +1,34 @@
+import socket
+
+import pytest
+
+from mist.api.icmp import BatchPinger, open_socket
+
+
+def _can_ping():
+    try:
+        open_socket(socket.AF_INET).close()
+    except socket.error:
+        return False
+    return True
+
+
+@pytest.mark.skipif(not _can_ping(), reason="Can't open ICMP socket")
+class TestBatchPinger(object):
+    pinger = BatchPinger(pkts=3, interval=0.1, timeout=1)
+
+    def test_ping_localhost(self):
+        results = self.pinger.ping(['127.0.0.1', '127.0.0.2', 'localhost'])
+        assert set(results) == {'127.0.0.1', '127.0.0.2', 'localhost'}
+        for result in results.values():
+            assert result['packet_transmit'] == 3
+            assert result['packet_receive'] == 3
+            assert result['packet_loss_rate'] == 0
+            assert 0 <= result['rtt_min'] <= result['rtt_avg']
+            assert result['rtt_avg'] <= result['rtt_max']
+
+    def test_ping_unresolvable(self):
+        results = self.pinger.ping(['127.0.0.1', 'nonexistent.invalid'])
+        assert results['127.0.0.1']['packet_receive'] == 3
+        assert results['nonexistent.invalid']['packet_transmit'] is None
+        assert results['nonexistent.invalid']['rtt_avg'] is None
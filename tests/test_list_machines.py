@@ -0,0 +1,139 @@
+import uuid
+import datetime
+
+import pytest
+
+from pymongo import InsertOne, UpdateOne
+
+from mist.api.clouds.models import OtherCloud
+from mist.api.machines.models import Machine
+
+
+NOW = datetime.datetime(2017, 10, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def other_cloud(request, org):
+    """Fixture to create a cloud, deleting its machines on cleanup"""
+    cloud = OtherCloud(owner=org, title=uuid.uuid4().hex)
+    cloud.save()
+
+    def fin():
+        Machine.objects(cloud=cloud).delete()
+        cloud.delete()
+
+    request.addfinalizer(fin)
+
+    return cloud
+
+
+@pytest.fixture
+def bulk_writes(monkeypatch):
+    """Record the operations of each bulk_write on the machines collection"""
+    collection = Machine._get_collection()
+    calls = []
+    bulk_write = collection.bulk_write
+
+    def record(ops, *args, **kwargs):
+        calls.append(list(ops))
+        return bulk_write(ops, *args, **kwargs)
+
+    monkeypatch.setattr(collection, 'bulk_write', record)
+    return calls
+
+
+def poll(cloud, machines, new_machines=(), now=NOW):
+    """Store polled machines, returning the ones saved"""
+    return cloud.ctl.compute._list_machines__bulk_write(
+        list(machines), list(new_machines), now)
+
+
+def new_machine(cloud, machine_id, **kwargs):
+    kwargs.setdefault('name', machine_id)
+    return Machine(cloud=cloud, machine_id=machine_id, last_seen=NOW,
+                   **kwargs)
+
+
+class TestBulkWrite(object):
+
+    def test_new_machine_inserted(self, other_cloud, bulk_writes):
+        machine = new_machine(other_cloud, 'm1', state='running')
+        assert poll(other_cloud, [machine], [machine]) == [machine]
+        assert [type(op) for op in bulk_writes[0]] == [InsertOne]
+        assert not machine._created
+        assert not machine._get_changed_fields()
+        stored = Machine.objects.get(id=machine.id)
+        assert stored.state == 'running'
+        assert stored.poll_hash == machine.poll_hash is not None
+
+    def test_changed_machine_updated(self, other_cloud, bulk_writes):
+        machine = new_machine(other_cloud, 'm1', state='running')
+        poll(other_cloud, [machine], [machine])
+        machine = Machine.objects.get(id=machine.id)
+        machine.state = 'stopped'
+        assert poll(other_cloud, [machine]) == [machine]
+        assert [type(op) for op in bulk_writes[1]] == [UpdateOne]
+        assert Machine.objects.get(id=machine.id).state == 'stopped'
+
+    def test_unchanged_machine_only_last_seen(self, other_cloud,
+                                              bulk_writes):
+        machine = new_machine(other_cloud, 'm1', state='running')
+        poll(other_cloud, [machine], [machine])
+        later = NOW + datetime.timedelta(minutes=1)
+        machine = Machine.objects.get(id=machine.id)
+        machine.last_seen = later
+        assert poll(other_cloud, [machine], now=later) == [machine]
+        assert len(bulk_writes) == 1
+        stored = Machine.objects.get(id=machine.id)
+        assert stored.last_seen == later
+        assert stored.poll_hash == machine.poll_hash
+
+    def test_failed_op_not_saved(self, other_cloud, bulk_writes):
+        existing = new_machine(other_cloud, 'm0', state='running')
+        poll(other_cloud, [existing], [existing])
+        existing = Machine.objects.get(id=existing.id)
+        existing.state = 'stopped'
+        # Violates the unique index on cloud and machine_id.
+        first = new_machine(other_cloud, 'm1')
+        duplicate = new_machine(other_cloud, 'm1')
+        saved = poll(other_cloud, [existing, first, duplicate],
+                     [first, duplicate])
+        assert saved == [existing, first]
+        assert duplicate._created
+        assert Machine.objects(id=duplicate.id).count() == 0
+        assert Machine.objects.get(id=existing.id).state == 'stopped'
+
+
+class TestPollHash(object):
+
+    def test_unchanged_poll_skips_update(self, other_cloud, bulk_writes):
+        machine = new_machine(other_cloud, 'm1', state='running')
+        poll(other_cloud, [machine], [machine])
+        machine = Machine.objects.get(id=machine.id)
+        machine.state = 'running'
+        machine.name = 'm1'
+        poll(other_cloud, [machine])
+        assert len(bulk_writes) == 1
+
+    def test_changed_field_updates(self, other_cloud, bulk_writes):
+        machine = new_machine(other_cloud, 'm1', state='running')
+        poll(other_cloud, [machine], [machine])
+        machine = Machine.objects.get(id=machine.id)
+        poll_hash = machine.poll_hash
+        machine.os_type = 'windows'
+        poll(other_cloud, [machine])
+        op, = bulk_writes[1]
+        assert isinstance(op, UpdateOne)
+        assert op._doc['$set']['os_type'] == 'windows'
+        stored = Machine.objects.get(id=machine.id)
+        assert stored.os_type == 'windows'
+        assert stored.poll_hash not in (None, poll_hash)
+
+    def test_unpolled_save_keeps_hash(self, other_cloud):
+        machine = new_machine(other_cloud, 'm1', state='running')
+        poll(other_cloud, [machine], [machine])
+        machine = Machine.objects.get(id=machine.id)
+        poll_hash = machine.poll_hash
+        machine.ssh_port = 2222
+        machine.save()
+        assert Machine.objects.get(id=machine.id).poll_hash == poll_hash
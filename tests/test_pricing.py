@@ -0,0 +1,65 @@
+import pytest
+
+from mist.api.clouds.controllers.compute import pricing
+from mist.api.clouds.controllers.compute.pricing import PricingIndex
+
+
+PRICING = {
+    ('compute', 'ec2_us_east'): {
+        't2.micro': {'linux': 0.0116, 'windows': 0.0162},
+        'm4.large': {'linux': 0.1},
+    },
+    ('compute', 'linode'): {'linode2048': 10.0},
+}
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+
+    def get_pricing(driver_type, driver_name):
+        calls.append((driver_type, driver_name))
+        if driver_name == 'broken':
+            raise IOError("Pricing file unavailable")
+        return PRICING[(driver_type, driver_name)]
+
+    monkeypatch.setattr(pricing, 'get_pricing', get_pricing)
+    return calls
+
+
+class TestPricingIndex(object):
+
+    def test_size_price(self, calls):
+        index = PricingIndex()
+        assert index.get_size_price('compute', 'linode', 'linode2048') == 10
+        assert index.get_size_price('compute', 'ec2_us_east', 't2.micro',
+                                    os_type='windows') == 0.0162
+        assert index.get_size_price('compute', 'ec2_us_east', 'm4.large',
+                                    os_type='windows') == 0.1
+        assert index.get_size_price('compute', 'ec2_us_east',
+                                    't2.micro') == PRICING[
+            ('compute', 'ec2_us_east')]['t2.micro']
+        assert calls == [('compute', 'linode'), ('compute', 'ec2_us_east')]
+
+    def test_unknown_size(self, calls):
+        index = PricingIndex()
+        assert index.get_size_price('compute', 'linode', 'unknown') is None
+        assert index.get_size_price('compute', 'ec2_us_east', 'unknown',
+                                    os_type='linux') is None
+
+    def test_missing_driver_is_memoized(self, calls):
+        index = PricingIndex()
+        for _ in range(3):
+            assert index.get_size_price('compute', 'gce_mars', 'n1') is None
+        assert calls == [('compute', 'gce_mars')]
+
+    def test_errors_are_not_memoized(self, calls):
+        index = PricingIndex()
+        for _ in range(2):
+            assert index.get_size_price('compute', 'broken', 'n1') is None
+        assert calls == [('compute', 'broken')] * 2
+        index.clear()
+        index.get_size_price('compute', 'linode', 'linode2048')
+        index.clear()
+        index.get_size_price('compute', 'linode', 'linode2048')
+        assert calls.count(('compute', 'linode')) == 2
@@ -0,0 +1,50 @@
+import pytest
+
+from mist.api import config
+from mist.api.sock import compact_lists
+
+
+@pytest.fixture(autouse=True)
+def min_rows(monkeypatch):
+    monkeypatch.setattr(config, 'SOCKJS_COMPACT_MIN_ROWS', 3)
+
+
+def expand(compacted):
+    return [dict(zip(compacted['__columns__'], row))
+            for row in compacted['__rows__']]
+
+
+class TestCompactLists(object):
+    items = [{'id': str(i), 'name': 'machine-%d' % i, 'cost': i}
+             for i in range(5)]
+
+    def test_compact_list(self):
+        compacted = compact_lists(self.items)
+        assert compacted['__columns__'] == ['cost', 'id', 'name']
+        assert expand(compacted) == self.items
+
+    def test_compact_values_of_dict(self):
+        data = {'cloud_id': 'abc', 'machines': self.items}
+        compacted = compact_lists(data)
+        assert compacted is not data
+        assert compacted['cloud_id'] == 'abc'
+        assert expand(compacted['machines']) == self.items
+        assert data['machines'] is self.items
+
+    def test_short_list_unchanged(self):
+        items = self.items[:2]
+        assert compact_lists(items) is items
+        data = {'machines': items}
+        assert compact_lists(data) is data
+
+    def test_heterogeneous_list_unchanged(self):
+        items = self.items + [{'id': '5', 'name': 'machine-5'}]
+        assert compact_lists(items) is items
+        items = self.items + [{'id': '5', 'name': 'x', 'size': 1}]
+        assert compact_lists(items) is items
+        items = self.items + ['not a dict']
+        assert compact_lists(items) is items
+
+    def test_other_data_unchanged(self):
+        for data in (None, 'string', 5, {'key': 'value'}, []):
+            assert compact_lists(data) is data